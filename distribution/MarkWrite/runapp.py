@@ -17,6 +17,7 @@ from __future__ import division
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import markwrite
+app = markwrite.createApplication()
 
 import sys
 if sys.platform == 'win32':
@@ -32,7 +33,7 @@ from markwrite.gui.mainwin import MarkWriteMainWindow
 pg.setConfigOption('background', markwrite.SETTINGS['plotviews_background_color'])
 pg.setConfigOption('foreground', markwrite.SETTINGS['plotviews_foreground_color'])
 
-wmwin = MarkWriteMainWindow(markwrite.app)
+wmwin = MarkWriteMainWindow(app)
 MarkWriteMainWindow._appdirs = markwrite.appdirs
 wmwin.show()
-status = markwrite.app.exec_()
\ No newline at end of file
+status = app.exec_()
\ No newline at end of file
@@ -20,6 +20,7 @@ os.environ['HDF5_DISABLE_VERSION_CHECK']='2'
 import shutil
 
 import markwrite
+app = markwrite.createApplication()
 
 import sys
 if sys.platform == 'win32':
@@ -42,7 +43,7 @@ from markwrite.gui.mainwin import MarkWriteMainWindow
 pg.setConfigOption('background', markwrite.SETTINGS['plotviews_background_color'])
 pg.setConfigOption('foreground', markwrite.SETTINGS['plotviews_foreground_color'])
 
-wmwin = MarkWriteMainWindow(markwrite.app)
+wmwin = MarkWriteMainWindow(app)
 MarkWriteMainWindow._appdirs = markwrite.appdirs
 wmwin.show()
-status = markwrite.app.exec_()
\ No newline at end of file
+status = app.exec_()
\ No newline at end of file
@@ -17,27 +17,46 @@ __version__ = "0.4.9"
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-# Need to import pyTables module before pyqt imports pyh5 or error occurs when
-# openning an iohub datastore file.
-import tables
-import pyqtgraph
+# Importing markwrite does not import Qt, pyqtgraph or PyTables, so the
+# project, file_io, sigproc and reports modules can be used by scripts running
+# without a display. The MarkWrite GUI calls createApplication() before
+# importing any markwrite.gui modules.
 import sys, os
 from appdirs import AppDirs
 from file_io import readPickle, writePickle
+from settings import SETTINGS, updateSettings
 appdirs = AppDirs("MarkWrite")
 default_settings_file_name = u'default_settings.pkl'
 current_settings_file_name = u'current_settings.pkl'
 current_settings_path = appdirs.user_config_dir
 
-usersettings = readPickle(current_settings_path, current_settings_file_name)
-from pyqtgraph.Qt import QtGui
-app = QtGui.QApplication(sys.argv)
+usersettings = readPickle(current_settings_path, current_settings_file_name,
+                          qcolors=False)
+updateSettings(usersettings)
 
-from gui.projectsettings import ProjectSettingsDialog
-_ = ProjectSettingsDialog(savedstate=usersettings)
-from gui.projectsettings import SETTINGS
-writePickle(current_settings_path, current_settings_file_name, SETTINGS)
+app = None
 
-default_file_path = os.path.join(current_settings_path,default_settings_file_name)
-if not os.path.exists(default_file_path):
-    writePickle(current_settings_path, default_settings_file_name, SETTINGS)
\ No newline at end of file
+def createApplication():
+    """
+    Create the QApplication used by the MarkWrite GUI and initialize the
+    settings dialog from the current SETTINGS. The current and default
+    settings files are saved to the user config folder.
+
+    :return: QApplication instance
+    """
+    global app
+    if app is None:
+        # Need to import pyTables module before pyqt imports pyh5 or error
+        # occurs when openning an iohub datastore file.
+        import tables
+        from pyqtgraph.Qt import QtGui
+        app = QtGui.QApplication(sys.argv)
+
+        from gui.projectsettings import ProjectSettingsDialog
+        _ = ProjectSettingsDialog(savedstate=dict(SETTINGS))
+        writePickle(current_settings_path, current_settings_file_name, SETTINGS)
+
+        default_file_path = os.path.join(current_settings_path,default_settings_file_name)
+        if not os.path.exists(default_file_path):
+            writePickle(current_settings_path, default_settings_file_name, SETTINGS)
+    return app
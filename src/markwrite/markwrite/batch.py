@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+markwrite-batch: create MarkWrite reports for many pen data files.
+
+Each input file is loaded into a MarkWriteProject, the same as opening the
+file in the MarkWrite application (series, run and stroke detection and
+Level 1 trial segments), and each selected report is saved to the output
+folder. Files are processed by a pool of worker processes.
+
+Usage examples:
+
+    markwrite-batch ./test_data -o ./reports
+    markwrite-batch "./data/*.xml" -o ./reports -j 4 --resume
+    markwrite-batch session1.hdf5 --trial-start DV_GO_START \\
+                    --trial-end DV_STOP_END --report SegmentLevel
+
+Report file names only depend on the input file and report type:
+
+    <output>/<input sub folder>/<report prefix>_<input file name>.txt
+
+where <input sub folder> is the path of the input file's folder relative to
+the folder argument it was found in. For file and glob arguments it is
+relative to the common parent folder of all the files they match. Input
+files that would have the same report file names are reported as an error
+before any files are processed. Report files are written to a temporary
+file and renamed once complete, so with --resume any input file that has
+all its report files is skipped.
+
+Use --sink to save reports as hdf5, npz or npy files instead of tab delimited
+text files; the report file extension is then .hdf5, .npz or .npy.
+
+Use --settings to load a MarkWrite settings file (.pkl) saved from the
+MarkWrite application; otherwise the current user settings are used.
+"""
+from __future__ import division
+
+import os
+import sys
+import glob
+import argparse
+import traceback
+import multiprocessing
+
+from util import getTime
+
+BATCH_FILE_EXTENSIONS = ('txyp', 'eptxyp', 'xml', 'hdf5', 'mwp')
+
+def _printText(text=u''):
+    # Print unicode text, even when stdout is a pipe with no encoding.
+    encoding = getattr(sys.stdout, 'encoding', None) or 'utf-8'
+    sys.stdout.write((text+u'\n').encode(encoding, 'replace'))
+
+def _commonFolder(folders):
+    # Return the deepest folder that contains all the absolute folder paths
+    # in folders, or None if there is no such folder.
+    common = []
+    for level in zip(*[f.split(os.sep) for f in folders]):
+        if len(set(os.path.normcase(p) for p in level)) != 1:
+            break
+        common.append(level[0])
+    if not common:
+        return None
+    if len(common) == 1:
+        # File system root, e.g. '/' or 'C:\\'
+        return common[0]+os.sep
+    return os.sep.join(common)
+
+def findInputFiles(input_args, extensions=BATCH_FILE_EXTENSIONS):
+    """
+    Return a sorted list of (file_path, sub_folder) tuples for the pen data
+    files given by input_args. Each input arg can be a file path, a folder
+    (searched recursively) or a glob pattern. sub_folder is the path of the
+    file's folder relative to the folder input arg it was found in. For
+    files given by file path and glob pattern args, sub_folder is relative
+    to the common parent folder of all those files.
+
+    :param input_args: list of file, folder or glob pattern strings.
+    :param extensions: file extensions (without '.') to include.
+    :return: list of (file_path, sub_folder) tuples
+    """
+    found = dict()
+    matched_files = []
+    for iarg in input_args:
+        if not isinstance(iarg, unicode):
+            # Use unicode paths so file names are not limited to ascii.
+            iarg = iarg.decode(sys.getfilesystemencoding() or 'utf-8')
+        if os.path.isdir(iarg):
+            for path, dirs, files in os.walk(iarg):
+                dirs.sort()
+                sub_folder = os.path.relpath(path, iarg)
+                if sub_folder == os.curdir:
+                    sub_folder = u''
+                for f in files:
+                    if f.rsplit(u'.', 1)[-1].lower() in extensions:
+                        fpath = os.path.abspath(os.path.join(path, f))
+                        found.setdefault(fpath, sub_folder)
+        else:
+            for fpath in glob.glob(iarg) or [iarg]:
+                if os.path.isfile(fpath) and fpath.rsplit(u'.', 1)[-1].lower() in extensions:
+                    matched_files.append(os.path.abspath(fpath))
+    if matched_files:
+        parent_folder = _commonFolder([os.path.dirname(fpath)
+                                       for fpath in matched_files])
+        for fpath in matched_files:
+            sub_folder = u''
+            if parent_folder:
+                sub_folder = os.path.relpath(os.path.dirname(fpath),
+                                             parent_folder)
+                if sub_folder == os.curdir:
+                    sub_folder = u''
+            found.setdefault(fpath, sub_folder)
+    return sorted(found.items())
+
+def getReportClasses(names=None):
+    """
+    Return the ReportExporter subclasses to create for each input file.
+    If names is None, all built-in and custom report classes are returned.
+    Otherwise each name must match a report class name, report label or
+    output file prefix, ignoring case, spaces, '_' and a trailing 'Report' or
+    'ReportExporter'.
+
+    :param names: list of report names, or None.
+    :return: list of ReportExporter subclasses
+    """
+    from reports import (PenSampleReportExporter, SegmentLevelReportExporter,
+                         custom_report_classes)
+    report_classes = [PenSampleReportExporter, SegmentLevelReportExporter]
+    for rcls in custom_report_classes:
+        if rcls not in report_classes:
+            report_classes.append(rcls)
+    if not names:
+        return report_classes
+
+    def normalize(rname):
+        rname = rname.lower().replace(u' ', u'').replace(u'_', u'')
+        for suffix in (u'exporter', u'report'):
+            if rname.endswith(suffix):
+                rname = rname[:-len(suffix)]
+        return rname
+
+    selected = []
+    for name in names:
+        matches = [rcls for rcls in report_classes
+                   if normalize(name) in (normalize(rcls.__name__),
+                                          normalize(rcls.reportlabel()))]
+        if not matches:
+            raise ValueError(u"Unknown report type: %s. Available reports: %s"
+                             % (name, u', '.join(r.__name__
+                                                 for r in report_classes)))
+        for rcls in matches:
+            if rcls not in selected:
+                selected.append(rcls)
+    return selected
+
+def getReportFilePath(output_folder, sub_folder, file_path, report_cls,
+                      sink=u'text'):
+    """
+    Return the report file path to use for the given input file, report
+    class and report sink.
+    """
+    from reports.sinks import REPORT_SINKS
+    fname = os.path.split(file_path)[1].replace(u'.', u'_')
+    ext = u'.txt'
+    if sink != u'text':
+        ext = REPORT_SINKS[sink].file_extension
+    return os.path.join(output_folder, sub_folder,
+                        u"{}_{}{}".format(report_cls.outputfileprefix(),
+                                          fname, ext))
+
+def processFile(file_path, report_paths, tstart_cond_name=None,
+                tend_cond_name=None, sink=u'text'):
+    """
+    Create a MarkWriteProject for file_path and save each report in
+    report_paths, a list of (ReportExporter subclass, report file path),
+    using the given report sink.
+
+    :return: dict with 'file_path', 'ok', 'error', 'load_time',
+             'report_time' and 'reports' (list of (file path, row count)).
+    """
+    from project import MarkWriteProject
+
+    result = dict(file_path=file_path, ok=False, error=None, load_time=0.0,
+                  report_time=0.0, reports=[])
+    project = None
+    stime = getTime()
+    try:
+        project = MarkWriteProject(file_path=file_path,
+                                   tstart_cond_name=tstart_cond_name,
+                                   tend_cond_name=tend_cond_name)
+        if len(project.pendata) == 0:
+            raise ValueError(u"No pen data was loaded from the file.")
+        result['load_time'] = getTime()-stime
+
+        stime = getTime()
+        failed = []
+        for report_cls, report_path in report_paths:
+            rfolder = os.path.dirname(report_path)
+            if rfolder and not os.path.isdir(rfolder):
+                try:
+                    os.makedirs(rfolder)
+                except OSError:
+                    # Folder may have been created by another worker.
+                    if not os.path.isdir(rfolder):
+                        raise
+            tmp_path = report_path+u'.partial'
+            row_count = report_cls.export(tmp_path, project, sink)
+            if row_count is None:
+                failed.append(report_cls.__name__)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                continue
+            if os.path.exists(report_path):
+                os.remove(report_path)
+            os.rename(tmp_path, report_path)
+            result['reports'].append((report_path, row_count))
+        result['report_time'] = getTime()-stime
+        if failed:
+            result['error'] = u"Report creation failed: %s" % (
+                u', '.join(failed))
+        else:
+            result['ok'] = True
+    except:
+        result['error'] = traceback.format_exc().decode('utf-8', 'replace')
+    finally:
+        if project:
+            project.close()
+    return result
+
+def _initWorker(settings):
+    # Pool worker initializer. Worker processes do not inherit SETTINGS
+    # changes made by the batch process on Windows.
+    from settings import updateSettings
+    updateSettings(settings)
+
+def _processFileTask(task):
+    # Pool worker entry point. Output printed by the project and report code
+    # is discarded so that the batch progress output stays readable.
+    (file_path, report_paths, tstart_cond_name, tend_cond_name, sink,
+     quiet) = task
+    if quiet:
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        return processFile(file_path, report_paths, tstart_cond_name,
+                           tend_cond_name, sink)
+    finally:
+        if quiet:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+def runBatch(input_files, output_folder, report_classes, workers=1,
+             resume=False, tstart_cond_name=None, tend_cond_name=None,
+             sink=u'text', quiet=True, settings=None):
+    """
+    Create the reports for each (file_path, sub_folder) in input_files,
+    using `workers` processes (0 = one per CPU core). sink is the report
+    file format, 'text' or one of reports.sinks.REPORT_SINKS. settings is
+    a dict of SETTINGS values to use, for example read from a settings
+    file, that is applied in this process and in each worker process.
+
+    A ValueError is raised if two input files would be saved to the same
+    report file.
+
+    :return: list of processFile() result dicts, in input_files order.
+             Files skipped because of resume are not included.
+    """
+    tasks = []
+    skipped = 0
+    report_files = dict()
+    for file_path, sub_folder in input_files:
+        report_paths = [(rcls, getReportFilePath(output_folder, sub_folder,
+                                                 file_path, rcls, sink))
+                        for rcls in report_classes]
+        for _, rpath in report_paths:
+            other_path = report_files.setdefault(os.path.normcase(rpath),
+                                                 file_path)
+            if other_path != file_path:
+                raise ValueError(u"Input files %s and %s would both be "
+                                 u"saved to report file %s."
+                                 % (other_path, file_path, rpath))
+        if resume and all(os.path.isfile(rpath) for _, rpath in report_paths):
+            skipped += 1
+            continue
+        tasks.append((file_path, report_paths, tstart_cond_name,
+                      tend_cond_name, sink, quiet))
+
+    if skipped:
+        print "Skipping %d file(s) with existing reports." % (skipped)
+    if not tasks:
+        return []
+
+    if settings:
+        _initWorker(settings)
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+
+    results = []
+    def handleResult(result):
+        results.append(result)
+        if result['ok']:
+            status = u'OK'
+        else:
+            status = u'FAILED'
+        _printText(u"[%d/%d] %s %s (load %.2f sec, reports %.2f sec)" % (
+            len(results), len(tasks), status, result['file_path'],
+            result['load_time'], result['report_time']))
+        sys.stdout.flush()
+
+    if workers == 1:
+        for task in tasks:
+            handleResult(_processFileTask(task))
+    else:
+        pool = multiprocessing.Pool(workers, _initWorker, (settings,))
+        try:
+            for result in pool.imap_unordered(_processFileTask, tasks):
+                handleResult(result)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    file_order = dict((t[0], i) for i, t in enumerate(tasks))
+    results.sort(key=lambda r: file_order[r['file_path']])
+    return results
+
+def printSummary(results, total_time):
+    failed = [r for r in results if not r['ok']]
+    _printText()
+    _printText(u"Processed %d file(s) in %.2f sec: %d OK, %d failed." % (
+        len(results), total_time, len(results)-len(failed), len(failed)))
+    if failed:
+        _printText()
+        _printText(u"Failed files:")
+        for r in failed:
+            _printText(u"----------------")
+            _printText(r['file_path'])
+            _printText(r['error'].rstrip())
+        _printText(u"----------------")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='markwrite-batch',
+        description=u"Create MarkWrite reports for pen data files (%s)."
+                    % (u', '.join(u'.'+e for e in BATCH_FILE_EXTENSIONS)),
+        epilog=u"Custom report classes are loaded from customreports.py "
+               u"if it is in the current folder or on the python path.")
+    parser.add_argument('inputs', nargs='+', metavar='INPUT',
+                        help=u"Pen data file, folder or glob pattern.")
+    parser.add_argument('-o', '--output', default=u'markwrite_reports',
+                        help=u"Folder to save reports to "
+                             u"(default: %(default)s).")
+    parser.add_argument('-r', '--report', action='append', dest='reports',
+                        metavar='REPORT',
+                        help=u"Report type to create, e.g. PenSample or "
+                             u"SegmentLevel. Can be given more than once. "
+                             u"Default is all report types.")
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help=u"Number of worker processes; 0 uses one per "
+                             u"CPU core (default: %(default)s).")
+    parser.add_argument('--resume', action='store_true',
+                        help=u"Skip input files that already have all "
+                             u"their report files.")
+    parser.add_argument('--trial-start', dest='tstart_cond_name',
+                        help=u"Condition variable with trial start times "
+                             u"(hdf5 files).")
+    parser.add_argument('--trial-end', dest='tend_cond_name',
+                        help=u"Condition variable with trial end times "
+                             u"(hdf5 files).")
+    parser.add_argument('--sink', default=u'text',
+                        choices=[u'text', u'hdf5', u'npz', u'npy'],
+                        help=u"Report file format (default: %(default)s).")
+    parser.add_argument('--settings',
+                        help=u"MarkWrite settings file (.pkl) to use.")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help=u"Show output printed while processing files.")
+    args = parser.parse_args(argv)
+
+    settings = None
+    if args.settings:
+        from file_io import readPickle
+        if not os.path.isfile(args.settings):
+            parser.error(u"Settings file not found: %s" % (args.settings))
+        settings = readPickle(*os.path.split(os.path.abspath(args.settings)),
+                              qcolors=False)
+
+    try:
+        report_classes = getReportClasses(args.reports)
+    except ValueError, e:
+        parser.error(unicode(e))
+
+    input_files = findInputFiles(args.inputs)
+    if not input_files:
+        parser.error(u"No input files found.")
+
+    output_folder = args.output
+    if not isinstance(output_folder, unicode):
+        output_folder = output_folder.decode(sys.getfilesystemencoding() or 'utf-8')
+    output_folder = os.path.abspath(output_folder)
+    _printText(u"Creating %s for %d file(s) in %s" % (
+        u', '.join(r.reportlabel() for r in report_classes),
+        len(input_files), output_folder))
+
+    stime = getTime()
+    try:
+        results = runBatch(input_files, output_folder, report_classes,
+                           workers=args.workers, resume=args.resume,
+                           tstart_cond_name=args.tstart_cond_name,
+                           tend_cond_name=args.tend_cond_name,
+                           sink=args.sink, quiet=not args.verbose,
+                           settings=settings)
+    except ValueError, e:
+        parser.error(unicode(e))
+    printSummary(results, getTime()-stime)
+    if any(not r['ok'] for r in results):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
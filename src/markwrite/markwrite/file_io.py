@@ -18,9 +18,15 @@ from __future__ import division
 import numpy as np
 from util import getSegmentTagsFilePath, SAMPLE_STATES, contiguous_regions
 import codecs
+import itertools
 import os
+import re
+import sys
 import traceback
-from gui.projectsettings import SETTINGS
+from settings import SETTINGS
+
+# Matches a complete '!' condition variable line of a .txyp file.
+_CV_LINE_PATTERN = re.compile(br'^ *!.*(?:\n|\Z)', re.MULTILINE)
             
 markwrite_pendata_format = [('time', np.float64),
                     ('x', np.int32),
@@ -37,6 +43,187 @@ markwrite_pendata_format = [('time', np.float64),
                     ('xy_acceleration', np.float64),
                     ('segment_id', np.uint16)]
 
+# Same fields as markwrite_pendata_format, with the channels set by MarkWrite
+# stored as float32. Used when SETTINGS['pendata_format'] is 'compact'.
+compact_pendata_format = [('time', np.float64),
+                    ('x', np.int32),
+                    ('y', np.int32),
+                    ('pressure', np.int16),
+                    ('state', np.uint8),
+                    # Following are set by MarkWrite
+                    ('x_filtered', np.float32),
+                    ('y_filtered', np.float32),
+                    ('pressure_filtered', np.float32),
+                    ('x_velocity', np.float32),
+                    ('y_velocity', np.float32),
+                    ('xy_velocity', np.float32),
+                    ('xy_acceleration', np.float32),
+                    ('segment_id', np.uint16)]
+
+pendata_formats = dict(standard=markwrite_pendata_format,
+                       compact=compact_pendata_format)
+
+class PenSampleColumns(object):
+    """
+    Pen sample data stored as one array per field (structure of arrays)
+    instead of a single numpy structured array. Used for project.pendata
+    when SETTINGS['pendata_layout'] is 'columns'.
+
+    PenSampleColumns supports the parts of the structured ndarray
+    interface that MarkWrite uses for pen data:
+
+        * pendata['x'] returns the x field array. It is not a copy, so it
+          can be changed in place. pendata['x'] = values sets the field.
+        * pendata[start:stop] returns a PenSampleColumns view of the samples.
+        * pendata[index_array] and pendata[bool_mask] return a
+          PenSampleColumns copy of the selected samples.
+        * pendata[i] returns a copy of sample i as a numpy record.
+        * len(pendata), .shape, .dtype and .nbytes, iterating over the
+          sample records, and np.asarray(pendata), which returns the
+          samples as a structured ndarray.
+    """
+    ndim = 1
+
+    def __init__(self, columns, dtype, viewof=None):
+        """
+        columns is a dict of field name -> 1D ndarray, with an array for
+        each field of the structured dtype. viewof is the (pendata,
+        start_ix) that the columns are a slice of, if any.
+        """
+        self.dtype = np.dtype(dtype)
+        self._columns = dict((fname, columns[fname])
+                             for fname in self.dtype.names)
+        self._viewof = viewof
+
+    @classmethod
+    def fromarray(cls, pendata, dtype=None):
+        """
+        Return a PenSampleColumns copy of the pendata structured array,
+        optionally converting it to dtype.
+        """
+        if dtype is None:
+            dtype = pendata.dtype
+        dtype = np.dtype(dtype)
+        columns = dict((fname, np.array(pendata[fname], dtype=dtype[fname]))
+                       for fname in dtype.names)
+        return cls(columns, dtype)
+
+    @classmethod
+    def zeros(cls, count, dtype):
+        dtype = np.dtype(dtype)
+        return cls(dict((fname, np.zeros(count, dtype=dtype[fname]))
+                        for fname in dtype.names), dtype)
+
+    def __len__(self):
+        return self._columns[self.dtype.names[0]].shape[0]
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def size(self):
+        return len(self)
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self._columns.values())
+
+    def viewIndexRange(self, pendata):
+        """
+        Return the (start_ix, end_ix) range of pendata that this
+        PenSampleColumns is a slice of, or None if it is not a slice of
+        pendata.
+        """
+        if self is pendata:
+            return 0, len(self)
+        if self._viewof is None or self._viewof[0] is not pendata:
+            return None
+        start_ix = self._viewof[1]
+        return start_ix, start_ix+len(self)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return self._columns[key]
+        if isinstance(key, slice):
+            columns = dict((fname, c[key]) for fname, c
+                           in self._columns.items())
+            start_ix, stop_ix, step = key.indices(len(self))
+            viewof = None
+            if step == 1:
+                base, offset = self._viewof or (self, 0)
+                viewof = base, offset+start_ix
+            return PenSampleColumns(columns, self.dtype, viewof)
+        if isinstance(key, list) and key and \
+                all(isinstance(k, basestring) for k in key):
+            return PenSampleColumns(self._columns, [(fname, self.dtype[fname])
+                                                    for fname in key])
+        if isinstance(key, list) and not key:
+            key = np.zeros(0, dtype=np.intp)
+        key = np.asarray(key)
+        if key.ndim == 0:
+            sample = np.zeros((), dtype=self.dtype)
+            for fname, c in self._columns.items():
+                sample[fname] = c[key]
+            return sample[()]
+        return PenSampleColumns(dict((fname, c[key]) for fname, c
+                                     in self._columns.items()), self.dtype)
+
+    def __setitem__(self, key, value):
+        if isinstance(key, basestring):
+            self._columns[key][...] = value
+            return
+        for fname, c in self._columns.items():
+            c[key] = value[fname]
+
+    def __array__(self, dtype=None):
+        samples = np.empty(len(self), dtype=self.dtype)
+        for fname, c in self._columns.items():
+            samples[fname] = c
+        if dtype is not None:
+            return samples.astype(dtype)
+        return samples
+
+    def __iter__(self):
+        # Sample records are created from the columns in chunks.
+        chunk_size = 10000
+        for cstart in xrange(0, len(self), chunk_size):
+            for sample in np.asarray(self[cstart:cstart+chunk_size]):
+                yield sample
+
+    def __repr__(self):
+        return "PenSampleColumns(%d samples, %s)" % (len(self), self.dtype)
+
+    def copy(self):
+        return PenSampleColumns(dict((fname, c.copy()) for fname, c
+                                     in self._columns.items()), self.dtype)
+
+def formatPenData(pendata, format_name=None, layout=None):
+    """
+    Return pendata in the given pen sample format ('standard' or
+    'compact', see pendata_formats) and layout ('records' for a
+    structured ndarray, 'columns' for PenSampleColumns). The
+    SETTINGS['pendata_format'] and SETTINGS['pendata_layout'] values are
+    used for a format_name or layout of None.
+
+    pendata is returned as is if it already has the format and layout,
+    otherwise it is copied.
+    """
+    if format_name is None:
+        format_name = SETTINGS['pendata_format']
+    if layout is None:
+        layout = SETTINGS['pendata_layout']
+    dtype = np.dtype(pendata_formats[format_name])
+    if layout == 'columns':
+        if isinstance(pendata, PenSampleColumns) and pendata.dtype == dtype:
+            return pendata
+        return PenSampleColumns.fromarray(pendata, dtype)
+    if isinstance(pendata, np.ndarray) and pendata.dtype == dtype:
+        return pendata
+    if isinstance(pendata, PenSampleColumns):
+        return np.asarray(pendata, dtype=dtype)
+    return pendata.astype(dtype)
+
 
 class DataImporter(object):
     '''
@@ -50,8 +237,13 @@ class DataImporter(object):
     The array returned by .asarray() will already have already had status data
     processed by the setstatusdata() implementaton. Default setstatusdata 
     is a direct pass through of the pendata array, with no changes made.
+
+    After .asarray(file_path) returns, .import_report is None or a dict
+    describing any changes made to the data read from the file, for example
+    samples that were removed or retimed.
     '''
     _ADD_SAMPLE_COL_COUNT = 8
+    import_report = None
     def __init__(self):
         pass
 
@@ -102,9 +294,25 @@ class DataImporter(object):
         if cls.validate(file_path) is False:
             raise IOError("File could not be imported. Invalid format for DataImporter.")
 
-        txyps_array = [s+(0,)*cls._ADD_SAMPLE_COL_COUNT for s in cls.parse(file_path)]        
-        
-        return cls.postprocess(np.asarray(txyps_array, markwrite_pendata_format))
+        cls.import_report = None
+        return cls.postprocess(cls.parsearray(file_path))
+
+    @classmethod
+    def parsearray(cls, file_path):
+        '''
+        Return the data points parsed from the file as a numpy ndarray with
+        dtype markwrite_pendata_format. Fields that are set by MarkWrite are
+        left as 0.
+
+        Default implementation converts the list of tuples returned by
+        .parse(file_path). DataImporter subclasses that can read the file
+        contents in bulk can override this method to fill the array directly.
+
+        :param file_path:
+        :return: ndarray
+        '''
+        txyps_array = [s+(0,)*cls._ADD_SAMPLE_COL_COUNT for s in cls.parse(file_path)]
+        return np.asarray(txyps_array, markwrite_pendata_format)
 
     @classmethod
     def postprocess(cls, pendata):
@@ -193,6 +401,17 @@ class TabDelimitedDataImporter(DataImporter):
 
     exp_condvars = None
     condvars_names = None  
+
+    # Series found by .postprocess(), saved in the 'series' array of the
+    # import report. end_ix is the index after the last series sample, and
+    # retimed_isi is the ISI of the sample times given to a series with
+    # duplicate timestamps, or NaN if the series was not retimed.
+    series_report_dtype = np.dtype([('start_ix', np.uint32),
+                                    ('end_ix', np.uint32),
+                                    ('start_time', np.float64),
+                                    ('end_time', np.float64),
+                                    ('duplicate_count', np.uint32),
+                                    ('retimed_isi', np.float64)])
             
     def __init__(self):
         DataImporter.__init__(self)
@@ -211,7 +430,7 @@ class TabDelimitedDataImporter(DataImporter):
         condvars_array=[]
         with codecs.open(file_path, "r", "utf-8") as f:
             cls.exp_condvars = None
-            cls.condvars_names = None  
+            cls.condvars_names = None
             for line_index, tab_line in enumerate(f):
                 tab_line = tab_line.strip(u' \r\n')
                 if line_index < cls.DATA_START_LINE_INDEX:
@@ -219,17 +438,9 @@ class TabDelimitedDataImporter(DataImporter):
                     continue
                 try:
                     tab_line = tab_line.replace(u'\t', u' ')
-                    if tab_line.startswith(u'!TRIAL_CV_LABELS'):
-                        if cls.condvars_names is None:
-                            line_tokens = tab_line.split(u' ')
-                            cls.condvars_names = [str(n) for n in line_tokens[1:]]
+                    if cls._parseConditionVariableLine(tab_line, condvars_array):
                         continue
 
-                    if tab_line.startswith(u'!TRIAL_CV_VALUES'):
-                        line_tokens = tab_line.split(u' ')
-                        condvars_array.append(tuple(line_tokens[1:]))
-                        continue
-                    
                     line_tokens = tab_line.split(u' ')
                     list_result.append(
                     (float(line_tokens[cls.TIME_COLUMN_IX].strip())/1000.0,
@@ -242,43 +453,139 @@ class TabDelimitedDataImporter(DataImporter):
                 except IndexError:
                     print("Note: Skipping Line {0}. Contains {1} Tokens.".format(len(list_result), len(line_tokens)))
 
-            if cls.condvars_names and condvars_array:
-                cvdtype=[]
-                for i, lt in enumerate(condvars_array[0]):
-                    etype = 'U16'
+        cls._setConditionVariables(condvars_array)
+        return list_result
+
+    @classmethod
+    def parsearray(cls, file_path):
+        """
+        Bulk version of .parse(). The numeric sample lines of the file are
+        converted in a single np.fromstring() call and written directly into
+        a markwrite_pendata_format array. Only the '!' condition variable
+        lines are handled one at a time.
+
+        If the sample block contains anything that can not be read as
+        whole numbers (other than the time column), the line by line
+        .parse() implementation is used instead so that the original
+        error handling applies.
+        """
+        with open(file_path, 'rb') as f:
+            file_parts = f.read().split(b'\n', cls.DATA_START_LINE_INDEX)
+        sample_block = b''
+        if len(file_parts) > cls.DATA_START_LINE_INDEX:
+            sample_block = file_parts[cls.DATA_START_LINE_INDEX]
+
+        cls.exp_condvars = None
+        cls.condvars_names = None
+        condvars_array = []
+        if b'!' in sample_block:
+            for tab_line in _CV_LINE_PATTERN.findall(sample_block):
+                tab_line = tab_line.decode('utf-8').strip(u' \r\n')
+                cls._parseConditionVariableLine(tab_line.replace(u'\t', u' '),
+                                                condvars_array)
+            sample_block = _CV_LINE_PATTERN.sub(b'', sample_block)
+
+        line_count = sample_block.count(b'\n')
+        if sample_block and not sample_block.endswith(b'\n'):
+            line_count += 1
+        values = np.fromstring(sample_block, dtype=np.float64, sep=' ')
+
+        # Count the whitespace separated tokens found on each sample line.
+        chars = np.frombuffer(sample_block, dtype=np.uint8)
+        is_space = (chars == 32) | (chars == 9) | (chars == 13) | (chars == 10)
+        token_starts = ~is_space
+        token_starts[1:] &= is_space[:-1]
+        line_ixs = np.cumsum(chars == 10)
+        token_counts = np.bincount(line_ixs[token_starts], minlength=line_count)
+
+        col_count = cls.PRESS_COLUMN_IX + 1
+        if values.shape[0] != token_counts.sum():
+            # A token could not be converted, so let parse() report it.
+            return super(TabDelimitedDataImporter, cls).parsearray(file_path)
+
+        if np.all(token_counts == col_count):
+            columns = values.reshape(-1, col_count)
+        else:
+            valid_lines = token_counts >= col_count
+            for line_ix in (~valid_lines).nonzero()[0]:
+                print("Note: Skipping Line {0}. Contains {1} Tokens.".format(
+                    valid_lines[:line_ix].sum(), token_counts[line_ix]))
+            line_offsets = np.cumsum(token_counts) - token_counts
+            columns = values[line_offsets[valid_lines][:, np.newaxis] +
+                             np.arange(col_count)]
+
+        int_columns = columns[:, [cls.X_COLUMN_IX, cls.Y_COLUMN_IX,
+                                  cls.PRESS_COLUMN_IX]]
+        if np.any(int_columns != np.floor(int_columns)):
+            return super(TabDelimitedDataImporter, cls).parsearray(file_path)
+
+        pendata = np.zeros(columns.shape[0], dtype=markwrite_pendata_format)
+        pendata['time'] = columns[:, cls.TIME_COLUMN_IX] / 1000.0
+        pendata['x'] = columns[:, cls.X_COLUMN_IX]
+        pendata['y'] = columns[:, cls.Y_COLUMN_IX]
+        pendata['pressure'] = columns[:, cls.PRESS_COLUMN_IX]
+
+        cls._setConditionVariables(condvars_array)
+        return pendata
+
+    @classmethod
+    def _parseConditionVariableLine(cls, tab_line, condvars_array):
+        """
+        Handle a '!TRIAL_CV_LABELS' or '!TRIAL_CV_VALUES' line. tab_line
+        must already have had tabs replaced by spaces.
+
+        Returns True if tab_line was a condition variable line.
+        """
+        if tab_line.startswith(u'!TRIAL_CV_LABELS'):
+            if cls.condvars_names is None:
+                line_tokens = tab_line.split(u' ')
+                cls.condvars_names = [str(n) for n in line_tokens[1:]]
+            return True
+
+        if tab_line.startswith(u'!TRIAL_CV_VALUES'):
+            line_tokens = tab_line.split(u' ')
+            condvars_array.append(tuple(line_tokens[1:]))
+            return True
+        return False
+
+    @classmethod
+    def _setConditionVariables(cls, condvars_array):
+        if cls.condvars_names and condvars_array:
+            cvdtype=[]
+            for i, lt in enumerate(condvars_array[0]):
+                etype = 'U16'
+                try:
+                    lt = int(lt)
+                    etype = np.int64
+                except:
                     try:
-                        lt = int(lt)
-                        etype = np.int64
+                        lt = float(lt)
+                        etype = np.float64
+                    except: 
+                        pass
+                cvdtype.append((cls.condvars_names[i], etype))
+            cvdtype = np.dtype(cvdtype)
+                
+            temparray_ = []
+            for cv_list in condvars_array:
+                temp_elem_=[]
+                for i, cv in enumerate(cv_list):
+                    try:
+                        cv = int(cv)
                     except:
                         try:
-                            lt = float(lt)
-                            etype = np.float64
+                            cv = float(cv)
                         except: 
                             pass
-                    cvdtype.append((cls.condvars_names[i], etype))
-                cvdtype = np.dtype(cvdtype)
-                    
-                temparray_ = []
-                for cv_list in condvars_array:
-                    temp_elem_=[]
-                    for i, cv in enumerate(cv_list):
-                        try:
-                            cv = int(cv)
-                        except:
-                            try:
-                                cv = float(cv)
-                            except: 
-                                pass
-                        if cls.condvars_names[i].find("TRIAL_START")>=0:
-                            cv = cv / 1000.0    
-                        elif cls.condvars_names[i].find("TRIAL_END")>=0:
-                            cv = cv / 1000.0    
-                        temp_elem_.append(cv)                        
-                    temparray_.append(tuple(temp_elem_))
-                condvars_array = temparray_
-
-                cls.exp_condvars = np.asarray(condvars_array, dtype=cvdtype)
-        return list_result
+                    if cls.condvars_names[i].find("TRIAL_START")>=0:
+                        cv = cv / 1000.0    
+                    elif cls.condvars_names[i].find("TRIAL_END")>=0:
+                        cv = cv / 1000.0    
+                    temp_elem_.append(cv)                        
+                temparray_.append(tuple(temp_elem_))
+            condvars_array = temparray_
+
+            cls.exp_condvars = np.asarray(condvars_array, dtype=cvdtype)
 
     @classmethod
     def postprocess(cls,pendata):
@@ -293,12 +600,6 @@ class TabDelimitedDataImporter(DataImporter):
         non_mono_ix = (sample_dts < 0.0).nonzero()[0]    
         if len(non_mono_ix)>0:
             non_mono_ix = non_mono_ix + 1
-            print ">>>>>>>"
-            print "WARNING: Non-monotonic Timestamps Detected."
-            print "         Removing %d sample(s) with negative ISIs...."%(len(non_mono_ix))
-            print "         Sample Indices:",non_mono_ix
-            print "<<<<<<<"
-            print
             # TODO: This code needs updating, it is a quick and dirty fix.
             #       Simply removes samples with negative ISI. In Guidos files,
             #       this seems to only occur within the first few samples
@@ -317,9 +618,7 @@ class TabDelimitedDataImporter(DataImporter):
                 series_isi_thresh = np.percentile(sample_dts,99.0,interpolation='nearest')*2.5
             except TypeError: 
                 series_isi_thresh = np.percentile(sample_dts,99.0)*2.5
-        print "series_isi_thresh:",series_isi_thresh
-        print
-        
+
         # Find sample array ix where ISI threshold is exceeded.
         # These are the series start ix
         series_start_ixs = (sample_dts > series_isi_thresh).nonzero()[0]
@@ -327,66 +626,89 @@ class TabDelimitedDataImporter(DataImporter):
             series_start_ixs=series_start_ixs+1
         # First sample in data file is always a series start.
         series_start_ixs = np.insert(series_start_ixs, 0, 0)
-        # Create list of series_start, series_end indexs for slicing
-        series_bounds = []  # holds (series_start_ix, series_end_ix, 
-                            # series_len, stime, etime, series_dur, series_dur/series_len)
-        for i, start_ix in enumerate(series_start_ixs[:-1]):
-            end_ix = series_start_ixs[i+1]
-            stime, etime = pendata['time'][[start_ix,end_ix-1]]
-            sdur = etime - stime 
-            slen = end_ix-start_ix
-            series_bounds.append((start_ix,end_ix,
-                                  slen,stime, etime,sdur,sdur/slen))
-        start_ix, end_ix = series_start_ixs[-1], len(pendata)
-        stime, etime = pendata['time'][[start_ix,end_ix-1]]
-        sdur = etime - stime 
-        slen = end_ix-start_ix                         
-        series_bounds.append((start_ix,end_ix,
-                              slen,stime, etime,sdur,sdur/(slen-1)))
-
-        # For each Sample Series in the data file,
-        # 1) handle duplicate sample timestamps
-        # 2) set FIRST_PRESS and FIRST_HOVER sample status as needed. 
-        for i, sb in enumerate(series_bounds):
-            # Cleanup duplicate timestamps after series bounds have been found
-            # TODO: This code needs updating, it is a quick and dirty fix.
-            #       A constant ISI across all series should really be used.
-            dup_ix = (sample_dts[sb[0]:sb[1]] == 0.0).nonzero()[0]# + sb[0]    
-            if len(dup_ix)>0:
-                start_ix, end_ix, slen, stime, etime, sdur, sampling_interval = sb
-                calc_sample_times, calc_isi = np.linspace(etime-slen*sampling_interval,etime,slen,retstep=True)
-                print ">>>>>>>"
-                print "Warning: Duplicate timestamps found in series", i+1, (stime, etime)
-                print "         Sample / Duplicate Count:",slen,'/',len(dup_ix)
-                print "         Calc. Series ISI:",calc_isi
-                print "         Updating Series sample times......."
-                print "<<<<<<<"
-                print
-                pendata['time'][start_ix:end_ix] = calc_sample_times[:]
-
-            # Update sample state field to include FIRST_PRESS as needed
-            run_start_ixs, _, _ = contiguous_regions(pendata['state'][sb[0]:sb[1]] == SAMPLE_STATES["PRESSED"])
-            if len(run_start_ixs):
-                run_start_ixs = np.array(run_start_ixs, dtype=np.uint32) + sb[0]
-                pendata['state'][run_start_ixs]+= SAMPLE_STATES['FIRST_PRESS']        
-            # Update sample state field to include FIRST_HOVER as needed
-            hover_start_ixs, _, _ = contiguous_regions(pendata['state'][sb[0]:sb[1]] == SAMPLE_STATES["HOVERING"])
-            if len(hover_start_ixs):
-                hover_start_ixs = np.array(hover_start_ixs, dtype=np.uint32) + sb[0]
-                pendata['state'][hover_start_ixs]+= SAMPLE_STATES['FIRST_HOVER']
+        series_end_ixs = np.append(series_start_ixs[1:], len(pendata))
+        series_lens = series_end_ixs - series_start_ixs
+        series_stimes = pendata['time'][series_start_ixs]
+        series_etimes = pendata['time'][series_end_ixs-1]
+        # The sampling interval of the last series is calculated using
+        # one less sample than the other series.
+        isi_sample_counts = series_lens.astype(np.float64)
+        isi_sample_counts[-1] -= 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sampling_intervals = (series_etimes-series_stimes)/isi_sample_counts
+
+        # Cleanup duplicate timestamps after series bounds have been found.
+        # The ISIs checked for a series are sample_dts[start_ix:end_ix].
+        # TODO: This code needs updating, it is a quick and dirty fix.
+        #       A constant ISI across all series should really be used.
+        dup_counts = np.append(0, np.cumsum(sample_dts == 0.0))
+        dup_counts = (dup_counts[np.minimum(series_end_ixs, len(sample_dts))]
+                      - dup_counts[np.minimum(series_start_ixs, len(sample_dts))])
+        retimed = dup_counts > 0
+        retimed_isis = np.full(len(series_start_ixs), np.nan)
+        if retimed.any():
+            # The sample times of each series with duplicate timestamps are
+            # replaced with
+            # np.linspace(etime-slen*sampling_interval, etime, slen).
+            slens = series_lens[retimed]
+            etimes = series_etimes[retimed]
+            stimes = etimes - slens*sampling_intervals[retimed]
+            deltas = etimes - stimes
+            with np.errstate(divide='ignore', invalid='ignore'):
+                retimed_isis[retimed] = deltas/(slens-1)
+            offsets = np.cumsum(slens) - slens
+            series_sample_ixs = np.arange(slens.sum()) - np.repeat(offsets,
+                                                                   slens)
+            sample_ixs = np.repeat(series_start_ixs[retimed],
+                                   slens) + series_sample_ixs
+            series_sample_ixs = series_sample_ixs.astype(np.float64)
+            steps = np.repeat(retimed_isis[retimed], slens)
+            zero_steps = steps == 0
+            calc_sample_times = series_sample_ixs*steps
+            calc_sample_times[zero_steps] = (
+                series_sample_ixs[zero_steps] /
+                np.repeat(slens-1, slens)[zero_steps] *
+                np.repeat(deltas, slens)[zero_steps])
+            calc_sample_times += np.repeat(stimes, slens)
+            calc_sample_times[offsets[slens > 1]+slens[slens > 1]-1] = \
+                etimes[slens > 1]
+            pendata['time'][sample_ixs] = calc_sample_times
+
+        # Set FIRST_PRESS and FIRST_HOVER sample status for the first sample
+        # of each run of PRESSED or HOVERING samples within a series.
+        series_start_mask = np.zeros(len(pendata), dtype=bool)
+        series_start_mask[series_start_ixs] = True
+        for run_state, first_state in (('PRESSED', 'FIRST_PRESS'),
+                                       ('HOVERING', 'FIRST_HOVER')):
+            in_run = pendata['state'] == SAMPLE_STATES[run_state]
+            run_starts = in_run.copy()
+            run_starts[1:] &= ~in_run[:-1] | series_start_mask[1:]
+            pendata['state'][run_starts] += SAMPLE_STATES[first_state]
 
         # For whole sample array, update series start sample's status
         # with FIRST_ENTER value.
         if len(series_start_ixs):
             pendata['state'][series_start_ixs] += SAMPLE_STATES['FIRST_ENTER']        
-        
+
+        series_report = np.zeros(len(series_start_ixs),
+                                 dtype=cls.series_report_dtype)
+        series_report['start_ix'] = series_start_ixs
+        series_report['end_ix'] = series_end_ixs
+        series_report['start_time'] = series_stimes
+        series_report['end_time'] = series_etimes
+        series_report['duplicate_count'] = dup_counts
+        series_report['retimed_isi'] = retimed_isis
+        cls.import_report = dict(removed_sample_ixs=non_mono_ix,
+                                 series_isi_thresh=series_isi_thresh,
+                                 series=series_report)
+
         # Return pendata array with sample state field populated.
         return pendata
 
 #
 # ioHub HDF5 File Importer  (*.hdf5)
 #
-from tables import openFile
+# PyTables is only imported when an HDF5 file is opened.
 from collections import namedtuple
 
 class HubDatastoreImporter(DataImporter):
@@ -435,6 +757,7 @@ class HubDatastoreImporter(DataImporter):
     
     @classmethod
     def _load(cls, file_path):
+        from tables import openFile
         try:
             cls._close()
             cls.hdfFile=openFile(file_path, 'r')
@@ -454,20 +777,43 @@ class HubDatastoreImporter(DataImporter):
         return file_valid
 
     @classmethod
-    def parse(cls, file_path):
-        list_result = []
-        if cls._load(file_path) is None:
-            return list_result
+    def _getPenSampleTable(cls):
+        """
+        Returns the ioHub event table that the Pen Sample Events are stored
+        in, or None if the file has no table for that event type.
+        """
+        event_mapping_info=cls._getEventMappingInformation().get(cls.WINTAB_TABLET_SAMPLE)
+        if event_mapping_info:
+            return cls.hdfFile.getNode(event_mapping_info.table_path)
+        return None
+
+    @classmethod
+    def _readPenSampleColumns(cls):
+        """
+        Read the Pen Sample Events from the iohub hdf5 file into a
+        markwrite_pendata_format array.
 
-        for r in cls._getPenSampleEvents():
-            list_result.append((
-                             r['time'],
-                             r['x'],
-                             r['y'],
-                             r['pressure'],
-                             r['status'] # state field
-                             ))
+        The event table can hold more than one tablet event type, so the
+        type column is read first to find the sample rows. Each needed
+        column is then read with a single table.read() call and the non
+        sample rows are masked out.
+        """
+        sample_table = cls._getPenSampleTable()
+        if sample_table is None:
+            return np.zeros(0, dtype=markwrite_pendata_format)
 
+        sample_mask = sample_table.read(field='type') == cls.WINTAB_TABLET_SAMPLE
+        pendata = np.zeros(np.count_nonzero(sample_mask), dtype=markwrite_pendata_format)
+        for pendata_field, table_field in [('time', 'time'),
+                                           ('x', 'x'),
+                                           ('y', 'y'),
+                                           ('pressure', 'pressure'),
+                                           ('state', 'status')]:
+            pendata[pendata_field] = sample_table.read(field=table_field)[sample_mask]
+        return pendata
+
+    @classmethod
+    def _readConditionVariables(cls):
         try:
             cls.exp_condvars = None
             cls.condvars_names = None            
@@ -479,8 +825,30 @@ class HubDatastoreImporter(DataImporter):
             cls.exp_condvars = None
             cls.condvars_names = None
 
-        cls._close()
-        return list_result
+    @classmethod
+    def parse(cls, file_path):
+        """
+        Return the pen samples of the file as a list of
+        (time, x, y, pressure, status) tuples, read with .parsearray().
+        """
+        pendata = cls.parsearray(file_path)
+        return zip(pendata['time'], pendata['x'], pendata['y'],
+                   pendata['pressure'], pendata['state'])
+
+    @classmethod
+    def parsearray(cls, file_path):
+        """
+        Read the pen samples of the file, see _readPenSampleColumns().
+        """
+        if cls._load(file_path) is None:
+            return np.zeros(0, dtype=markwrite_pendata_format)
+
+        try:
+            pendata = cls._readPenSampleColumns()
+            cls._readConditionVariables()
+        finally:
+            cls._close()
+        return pendata
 
     def __del__(self):
         self._close()
@@ -488,43 +856,124 @@ class HubDatastoreImporter(DataImporter):
 #
 # XML Format Importer (*.xml)
 #
-import xml.etree.ElementTree as ET
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 class XmlDataImporter(DataImporter):
+    # Number of elements read from the start of the file by validate().
+    VALIDATE_ELEMENT_COUNT = 16
+    # Number of samples collected before they are copied to the array
+    # returned by parsearray().
+    SAMPLE_CHUNK_SIZE = 16384
+
     def __init__(self):
         DataImporter.__init__(self)
 
     @classmethod
     def validate(cls, file_path):
         try:
-            xml_root = ET.parse(file_path)
+            # Only the start of the file is parsed. A file that is not well
+            # formed after that point will fail in parse() / parsearray().
             # TODO: Use element near start of file to verify that XML
             # file contains expected format. For example "xmlns:tns"
-            return xml_root is not None
+            element_count = 0
+            for event, elem in ET.iterparse(file_path, events=('start',)):
+                element_count += 1
+                if element_count >= cls.VALIDATE_ELEMENT_COUNT:
+                    break
+            return element_count > 0
         except:
             pass
         return False
 
     @classmethod
-    def parse(cls, file_path):
-        list_result = []
-        xml_root = ET.parse(file_path).getroot()
-        for stroke_set in xml_root.iter(u'strokes'):
-            si=0
-            for stroke in stroke_set.iter(u'stroke'):
+    def _iterSamples(cls, file_path):
+        """
+        Yields a (time, x, y, status) tuple for each stroke element of the
+        file, where time is the unconverted integer Time attribute.
+
+        Stroke and strokes elements are removed from their parent element
+        as soon as they have been read, so the element tree for the whole
+        file is never held in memory.
+        """
+        # The elements that have been started but not ended; the last one
+        # is the parent of the element being read.
+        open_elems = []
+        si = 0
+        for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == u'strokes':
+                    si = 0
+                open_elems.append(elem)
+                continue
+
+            open_elems.pop()
+            if elem.tag == u'stroke':
                 status = SAMPLE_STATES['PRESSED']
                 if si == 0:
                     status += SAMPLE_STATES['FIRST_PRESS']
+                yield (long(elem.get("Time")),
+                       int(elem.get("X")),
+                       int(elem.get("Y")),
+                       status)
+                si+=1
+            if elem.tag in (u'stroke', u'strokes') and open_elems:
+                # Earlier stroke siblings have already been removed, so
+                # elem is near the start of its parent's children.
+                open_elems[-1].remove(elem)
 
-                list_result.append((long(stroke.get("Time"))/1000.0,
-                                int(stroke.get("X")),
-                                int(stroke.get("Y")),
+    @classmethod
+    def parse(cls, file_path):
+        list_result = []
+        for stime, sx, sy, status in cls._iterSamples(file_path):
+            list_result.append((stime/1000.0,
+                                sx,
+                                sy,
                                 1, # pressure, always 1
                                 status))
-                si+=1
-
         return list_result
 
+    @classmethod
+    def parsearray(cls, file_path):
+        """
+        Bulk version of .parse(). Samples are collected in chunks of
+        SAMPLE_CHUNK_SIZE and copied into a pendata array that doubles in
+        size when it is full, so peak memory use is proportional to
+        the returned array. The array is trimmed to the number of samples
+        read in place, without a copy.
+        """
+        chunk_dtype = [('time', np.int64),
+                       ('x', np.int32),
+                       ('y', np.int32),
+                       ('state', np.uint8)]
+        pendata = np.zeros(cls.SAMPLE_CHUNK_SIZE, dtype=markwrite_pendata_format)
+        sample_count = 0
+        samples = cls._iterSamples(file_path)
+        while True:
+            chunk = list(itertools.islice(samples, cls.SAMPLE_CHUNK_SIZE))
+            if not chunk:
+                break
+            chunk_array = np.array(chunk, dtype=chunk_dtype)
+            end_ix = sample_count+chunk_array.shape[0]
+            if end_ix > pendata.shape[0]:
+                grown = np.zeros(max(end_ix, pendata.shape[0]*2), dtype=markwrite_pendata_format)
+                grown[:sample_count] = pendata[:sample_count]
+                pendata = grown
+            chunk_data = pendata[sample_count:end_ix]
+            chunk_data['time'] = chunk_array['time']/1000.0
+            chunk_data['x'] = chunk_array['x']
+            chunk_data['y'] = chunk_array['y']
+            chunk_data['pressure'] = 1 # pressure, always 1
+            chunk_data['state'] = chunk_array['state']
+            sample_count = end_ix
+            del chunk_data
+        # There are no views of pendata left, so its memory can be
+        # reallocated.
+        pendata.resize(sample_count, refcheck=False)
+        return pendata
+
 ################################################################################
 
 def loadPredefinedSegmentTagList(file_name=u'default.tag'):
@@ -536,27 +985,33 @@ def loadPredefinedSegmentTagList(file_name=u'default.tag'):
 
 import cPickle
 
-def readPickle(file_path, file_name):
+def readPickle(file_path, file_name, qcolors=True):
     abs_file_path = os.path.join(file_path,file_name)
     dobj=None
     if os.path.isfile(abs_file_path):
-        from pyqtgraph import mkColor
         with open(abs_file_path, 'rb') as f:
             dobj = cPickle.load(f)
-        for k, v in dobj.items():
-            if isinstance(v, tuple) and len(v)==3 and isinstance(v[0], (int, long, float)):
-                #print "Creating color from:",k, v
-                dobj[k] = mkColor(v)
+        if qcolors:
+            # Colors are saved as (r,g,b) tuples; convert them back to QColor.
+            from pyqtgraph import mkColor
+            for k, v in dobj.items():
+                if isinstance(v, tuple) and len(v)==3 and isinstance(v[0], (int, long, float)):
+                    #print "Creating color from:",k, v
+                    dobj[k] = mkColor(v)
     return dobj
 
 def writePickle(file_path, file_name, dictobj):
-    from pyqtgraph.Qt import QtGui
     abs_file_path = os.path.join(file_path,file_name)
     dobj=dict()
     if not os.path.exists(file_path):
         os.makedirs(file_path)
+    # Only check for QColor values if Qt is in use.
+    QColor = None
+    if 'pyqtgraph' in sys.modules:
+        from pyqtgraph.Qt import QtGui
+        QColor = QtGui.QColor
     for k,v in dictobj.items():
-        if isinstance(v, QtGui.QColor):
+        if QColor and isinstance(v, QColor):
             dobj[k] = (v.red(), v.green(), v.blue())
         else:
             dobj[k]=v
@@ -564,4 +1019,238 @@ def writePickle(file_path, file_name, dictobj):
         cPickle.dump(dobj, f, cPickle.HIGHEST_PROTOCOL)
 
 ################################################################################
+#
+# MarkWrite Project File Container (*.mwp)
+#
+# A project file starts with MWP_FILE_MAGIC, followed by the container format
+# version and the length of the header as little endian uint32 values. The
+# header is a pickled dict holding all non array project values plus a
+# directory of the array blocks that follow it. Each numpy array is stored
+# one column (field) per block, so a single column can be read without
+# loading the rest of the array. Blocks can optionally be zlib compressed.
+#
+# Project files saved by MarkWrite 0.4.9 and earlier are a single pickled dict.
+# readProjectFile() still loads these; they are written in the new
+# format the next time the project is saved.
+#
+
+import struct
+import zlib
+
+MWP_FILE_MAGIC = b'MWPROJ\x00\x00'
+MWP_FORMAT_VERSION = 1
+MWP_BLOCK_ALIGNMENT = 64
+_MWP_PREAMBLE = struct.Struct('<8sII')
+
+def _alignedOffset(offset):
+    return -(-offset // MWP_BLOCK_ALIGNMENT) * MWP_BLOCK_ALIGNMENT
+
+def _isBlockArray(value):
+    if isinstance(value, PenSampleColumns):
+        return True
+    return isinstance(value, np.ndarray) and not value.dtype.hasobject
+
+class ProjectFileReader(object):
+    """
+    Read access to a MarkWrite project file container. Supports the dict
+    operations used when opening a project (keys(), get(), in, [] and del).
+
+    Project values that are numpy arrays are only read from the file the
+    first time they are accessed. Use readColumn() to get one field of an
+    array without reading the other fields. Reading an array raises an
+    IOError if the file has changed since it was opened.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file_stat = self._fileStat()
+        with open(file_path, 'rb') as f:
+            magic, version, header_len = _MWP_PREAMBLE.unpack(
+                f.read(_MWP_PREAMBLE.size))
+            if magic != MWP_FILE_MAGIC:
+                raise IOError("Not a MarkWrite project container file: %s"
+                              % (file_path))
+            if version > MWP_FORMAT_VERSION:
+                raise IOError("MarkWrite project file format version %d is "
+                              "not supported." % (version))
+            header = cPickle.loads(f.read(header_len))
+        self.format_version = version
+        self._data_start = _alignedOffset(_MWP_PREAMBLE.size + header_len)
+        self._values = header['values']
+        self._arrays = header['arrays']
+
+    def keys(self):
+        return self._values.keys() + self._arrays.keys()
+
+    def arraynames(self):
+        return self._arrays.keys()
+
+    def shape(self, name):
+        """
+        Return the shape of the array saved as project value `name`, without
+        reading the array.
+        """
+        if name in self._values:
+            return self._values[name].shape
+        return self._arrays[name]['shape']
+
+    def __contains__(self, name):
+        return name in self._values or name in self._arrays
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            self._values[name] = self._readArray(name)
+            del self._arrays[name]
+        return self._values[name]
+
+    def __setitem__(self, name, value):
+        self._arrays.pop(name, None)
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        if name in self._arrays:
+            del self._arrays[name]
+        else:
+            del self._values[name]
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def readColumn(self, name, field=None):
+        """
+        Return the `field` column of the array saved as project value `name`.
+        field should be None for arrays that do not have a structured dtype.
+        """
+        if name in self._values:
+            if field is None:
+                return self._values[name]
+            return self._values[name][field]
+        array_info = self._arrays[name]
+        with self._openData() as f:
+            return self._readBlock(f, array_info['columns'][field])
+
+    def readColumns(self, name):
+        """
+        Return the structured array saved as project value `name` as a
+        PenSampleColumns, without creating the structured array.
+        """
+        if name in self._values:
+            return PenSampleColumns.fromarray(self._values[name])
+        array_info = self._arrays[name]
+        with self._openData() as f:
+            columns = dict((field, self._readBlock(f, block_info))
+                           for field, block_info
+                           in array_info['columns'].items())
+        return PenSampleColumns(columns, array_info['dtype'])
+
+    def _readArray(self, name):
+        array_info = self._arrays[name]
+        adtype = array_info['dtype']
+        with self._openData() as f:
+            if adtype.names is None:
+                return self._readBlock(f, array_info['columns'][None])
+            result = np.empty(array_info['shape'], dtype=adtype)
+            for field in adtype.names:
+                result[field] = self._readBlock(f, array_info['columns'][field])
+            return result
+
+    def _fileStat(self):
+        fstat = os.stat(self.file_path)
+        return fstat.st_size, fstat.st_mtime
+
+    def _openData(self):
+        if self._fileStat() != self._file_stat:
+            raise IOError("MarkWrite project file changed after it was "
+                          "opened: %s" % (self.file_path))
+        return open(self.file_path, 'rb')
+
+    def _readBlock(self, f, block_info):
+        offset, stored_size, compressed, block_dtype, shape = block_info
+        f.seek(self._data_start+offset)
+        if compressed:
+            block = np.frombuffer(zlib.decompress(f.read(stored_size)),
+                                  dtype=block_dtype).copy()
+        else:
+            block = np.fromfile(f, dtype=block_dtype,
+                                count=stored_size//block_dtype.itemsize)
+        return block.reshape(shape)
+
+def readProjectFile(file_path, file_name):
+    """
+    Open the MarkWrite project file file_name in the directory file_path.
+    Returns a ProjectFileReader, or the dict read from the file if it is a
+    legacy pickle based project file.
+    """
+    abs_file_path = os.path.join(file_path, file_name)
+    with open(abs_file_path, 'rb') as f:
+        magic = f.read(len(MWP_FILE_MAGIC))
+    if magic != MWP_FILE_MAGIC:
+        return readPickle(file_path, file_name)
+    return ProjectFileReader(abs_file_path)
+
+def writeProjectFile(file_path, file_name, projdict, compress=False):
+    """
+    Save projdict to the MarkWrite project file file_name in the directory
+    file_path. Numpy arrays in projdict are saved one column per block; all
+    other values are pickled into the file header.
+
+    If compress is True, array blocks are zlib compressed.
+    """
+    abs_file_path = os.path.join(file_path, file_name)
+    if file_path and not os.path.exists(file_path):
+        os.makedirs(file_path)
+
+    values = dict()
+    arrays = dict()
+    blocks = []
+    offset = 0
+    for name, value in projdict.items():
+        if not _isBlockArray(value):
+            values[name] = value
+            continue
+        if value.dtype.names is None:
+            fields = [(None, value)]
+        else:
+            fields = [(field, value[field]) for field in value.dtype.names]
+        columns = dict()
+        for field, column in fields:
+            block = np.ascontiguousarray(column).tostring()
+            if compress:
+                block = zlib.compress(block)
+            columns[field] = (offset, len(block), compress, column.dtype,
+                              column.shape)
+            blocks.append((offset, block))
+            offset = _alignedOffset(offset+len(block))
+        arrays[name] = dict(dtype=value.dtype,
+                            shape=value.shape,
+                            columns=columns)
+
+    header = cPickle.dumps(dict(format_version=MWP_FORMAT_VERSION,
+                                values=values,
+                                arrays=arrays),
+                           cPickle.HIGHEST_PROTOCOL)
+    data_start = _alignedOffset(_MWP_PREAMBLE.size+len(header))
+    # The file is written to a temporary file in the same directory that
+    # is then renamed to abs_file_path, so an error while saving does not
+    # leave a partly written project file in place of the last saved one.
+    tmp_file_path = '%s.%d.tmp' % (abs_file_path, os.getpid())
+    try:
+        with open(tmp_file_path, 'wb') as f:
+            f.write(_MWP_PREAMBLE.pack(MWP_FILE_MAGIC, MWP_FORMAT_VERSION,
+                                       len(header)))
+            f.write(header)
+            for block_offset, block in blocks:
+                f.seek(data_start+block_offset)
+                f.write(block)
+        # os.rename() does not replace an existing file on Windows.
+        if sys.platform == 'win32' and os.path.exists(abs_file_path):
+            os.remove(abs_file_path)
+        os.rename(tmp_file_path, abs_file_path)
+    except Exception:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise
+
+################################################################################
 
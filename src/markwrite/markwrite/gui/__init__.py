@@ -16,7 +16,5 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import division
 from projectsettings import ProjectSettingsDialog,SETTINGS, APP_WIN_SIZE_SETTING
-
-X_FIELD = 'x_filtered'
-Y_FIELD = 'y_filtered'
+from markwrite.util import X_FIELD, Y_FIELD
 
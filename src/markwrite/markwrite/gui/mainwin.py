@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import division
 
+import os
 import functools
 
 import numpy as np
@@ -30,6 +31,7 @@ from pyqtgraph.dockarea import DockArea, Dock
 from markwrite.util import getIconFilePath
 from markwrite.file_io import loadPredefinedSegmentTagList, readPickle, writePickle
 from markwrite.reports import PenSampleReportExporter, SegmentLevelReportExporter, custom_report_classes
+from markwrite.reports.sinks import REPORT_SINKS
 from markwrite.segment import PenDataSegment
 from dialogs import ExitApplication, fileOpenDlg, ErrorDialog, warnDlg, \
     fileSaveDlg,ConfirmAction,infoDlg, singleSelectDialog
@@ -1012,9 +1014,19 @@ class MarkWriteMainWindow(QtGui.QMainWindow):
         default_file_name = u"{}_{}.txt".format(reportcls.outputfileprefix(),self.project.name)
         file_path = fileSaveDlg(initFilePath=self.project.projectfileinfo['folder'],
                                 initFileName=default_file_name,
-                                prompt=u"Export %s"%(reportcls.reportlabel()))
+                                prompt=u"Export %s"%(reportcls.reportlabel()),
+                                allowed="Text files (*.txt);;"
+                                        "HDF5 files (*.hdf5);;"
+                                        "Numpy files (*.npz *.npy);;"
+                                        "All files (*.*)")
         if file_path:
-            reportcls().export(file_path, self.project)
+            # The report file format is chosen by the file extension.
+            sink = u'text'
+            file_ext = os.path.splitext(file_path)[1].lower()
+            for sink_name, sink_cls in REPORT_SINKS.items():
+                if sink_cls.file_extension == file_ext:
+                    sink = sink_name
+            reportcls().export(file_path, self.project, sink)
 
     def createSegmentFromSelectedTimePeriod(self, name=None, trim_time_region = True):
         """
@@ -1096,10 +1108,9 @@ class MarkWriteMainWindow(QtGui.QMainWindow):
             # Decrement the pendata array 'segment_id' field for elements within
             # the segment being removed so that # of segments that contain each
             # pen point can be tracked
-            allpendata = self.project.pendata
-            segment_filter = (allpendata['time'] >= segment.starttime) & (
-            allpendata['time'] <= segment.endtime)
-            allpendata['segment_id'][segment_filter] = segment.parent.id
+            self.project._setSegmentIdForTimePeriod(segment.starttime,
+                                                    segment.endtime,
+                                                    segment.parent.id)
             self.setActiveObject(self.project.selectedtimeregion)
             #self.handleSelectedPenDataUpdate(None,None)
             self.sigSegmentRemoved.emit(segment, seg_ix)
@@ -1246,7 +1257,7 @@ class MarkWriteMainWindow(QtGui.QMainWindow):
 
     def updateApplicationFromSettings(self, updatedsettings, allsettings):
         if self.project and len(updatedsettings)>0:            
-            stroke_settings_changed = [s for s in updatedsettings.keys() if s.find('stroke_detect_')==0]
+            stroke_settings_changed = [s for s in updatedsettings.keys() if s.find('stroke_detect_')==0 or s.find('device_')==0]
             if stroke_settings_changed:
                 reply = QtGui.QMessageBox.question(self, 'Stroke Detection Settings', "Stroke detection setting have changed.\nReparse Stroke Boundaries?", QtGui.QMessageBox.Yes | 
                                                     QtGui.QMessageBox.No, QtGui.QMessageBox.No)
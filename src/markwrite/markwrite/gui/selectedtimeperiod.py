@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import division
+from collections import OrderedDict
+from weakref import proxy, ProxyType
+
+import pyqtgraph as pg
+
+selectedtimeperiod_properties = None
+
+
+class SelectedTimePeriodItem(pg.LinearRegionItem):
+    def __init__(self, *args, **kwargs):
+        project = kwargs.pop('project')
+        kwargs['movable'] = True
+        pg.LinearRegionItem.__init__(self, *args, **kwargs)
+        for l in self.lines:
+            l.pen.color()
+            l.setPen(l.pen.color(),
+                     width=2)
+            l.setHoverPen(l.hoverPen.color(), width=2)
+        self._project = None
+        if project:
+            self.project = proxy(project)
+        self._ignore_events=False
+
+    def mouseClickEvent(self, ev):
+        self.project._mwapp.setActiveObject(self)
+        pg.LinearRegionItem.mouseClickEvent(self, ev)
+
+    def mouseDoubleClickEvent(self, event):
+        if self._ignore_events:
+            return
+        pg.LinearRegionItem.mouseDoubleClickEvent(self, event)
+        self.project._mwapp.setActiveObject(self)
+        self.project._mwapp._penDataTimeLineWidget.zoomToPenData(
+            self.selectedpendata)
+        self.project._mwapp._penDataSpatialViewWidget.zoomToPenData(
+            self.selectedpendata)
+
+    def lineMoved(self):
+        if self.blockLineSignal:
+            return
+        pg.LinearRegionItem.lineMoved(self)
+        if self.project._mwapp._segmenttree.doNotSetActiveObject is False:
+            self.project._mwapp.setActiveObject(self)
+
+    def lineMoveFinished(self):
+        pg.LinearRegionItem.lineMoveFinished(self)
+        if self.project._mwapp._segmenttree.doNotSetActiveObject is False:
+            self.project._mwapp.setActiveObject(self)
+
+    def getBounds(self):
+        return self.lines[0].maxRange
+
+    @property
+    def project(self):
+        return self._project
+
+    @project.setter
+    def project(self, p):
+        if p is None:
+            self._project = proxy(p)
+            self.setBounds(bounds=(0, 0))
+            self.setRegion([0, 0])
+        else:
+            if isinstance(p, ProxyType):
+                self._project = p
+            else:
+                self._project = proxy(p)
+
+    @property
+    def allpendata(self):
+        return self.project.pendata
+
+    @property
+    def selectedpendata(self):
+        _, _, spendata = self.selectedtimerangeanddata
+        return spendata
+
+    @property
+    def selectedtimerangeanddata(self):
+        minT, maxT = self.getRegion()
+        return minT, maxT, self.project.getPenDataForTimePeriod(minT, maxT)
+
+    def propertiesTableData(self):
+        """
+        Return a dict of segment properties to display in the Selected Project
+        Tree Node Object Properties Table.
+
+        :return: dict of segmentcategory properties to display
+        """
+        global selectedtimeperiod_properties
+        props = selectedtimeperiod_properties
+
+        if selectedtimeperiod_properties is None:
+            selectedtimeperiod_properties = OrderedDict()
+            props = selectedtimeperiod_properties
+            props['Name'] = ['']
+            props['Start Time'] = ['']
+            props['End Time'] = ['']
+            props['Point Count'] = ['']
+
+        props['Name'][0] = u"Selected Time Period"
+        stime, etime = self.getRegion()
+        props['Start Time'][0] = '%.3f' % stime
+        props['End Time'][0] = '%.3f' % etime
+        props['Point Count'][0] = self.selectedpendata.shape[0]
+        mwapp = self._project._mwapp
+        trialname = None
+        if mwapp:
+            if mwapp.activetrial:
+                trialname = mwapp.activetrial.name
+        if trialname:
+            props.setdefault('Current Trial', [''])[0] = '%s' % (trialname)
+        elif props.has_key('Current Trial'):
+            del props['Current Trial']
+
+        return props
+
+    def toDict(self):
+        return dict(timerange=self.getRegion())
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+On disk cache of imported and processed pen data, so that opening the same
+pen data file again does not need to parse and process the file.
+
+Each cache entry is a folder in the user cache folder, named
+'<file hash>_<key hash>', where the file hash is the sha1 hash of the pen
+data file contents and the key hash is the sha1 hash of everything else the
+cached data depends on (DataImporter used, SETTINGS values, ...). Non empty
+numeric ndarrays are saved as .npy files and are memory mapped (copy on
+write) when an entry is loaded; all other values are saved in a pickle
+file. On Windows, a file can not be removed while it is memory mapped, so
+the arrays are read into memory instead, and cache entries can be removed
+or replaced while a project loaded from them is open.
+
+The total size of the cache is kept below SETTINGS['pendata_cache_max_mb']
+by removing the least recently used entries when an entry is saved. Setting
+pendata_cache_max_mb to 0 disables the cache.
+"""
+import os
+import sys
+import shutil
+import hashlib
+import cPickle
+
+import numpy as np
+
+from settings import SETTINGS
+
+class PenDataCache(object):
+    # Change when the format of cache entries changes, so entries saved in
+    # the old format are not used.
+    cache_version = 1
+    entry_values_file_name = 'values.pkl'
+    array_mmap_mode = None if sys.platform == 'win32' else 'c'
+    _cache_dir = None
+
+    @classmethod
+    def isEnabled(cls):
+        return SETTINGS['pendata_cache_max_mb'] > 0
+
+    @classmethod
+    def getCacheDir(cls):
+        '''
+        Return the folder that cache entries are saved in.
+
+        :return: str
+        '''
+        if cls._cache_dir is None:
+            from markwrite import appdirs as mwappdirs
+            cls._cache_dir = os.path.join(mwappdirs.user_cache_dir, u'pendata')
+        return cls._cache_dir
+
+    @classmethod
+    def fileHash(cls, file_path, chunk_size=2**20):
+        '''
+        Return the sha1 hex digest of the contents of file_path.
+
+        :param file_path:
+        :return: str
+        '''
+        fhash = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                fhash.update(chunk)
+                chunk = f.read(chunk_size)
+        return fhash.hexdigest()
+
+    @classmethod
+    def entryKey(cls, file_hash, *key_values):
+        '''
+        Return the cache key of the data created from the pen data file
+        with contents hash file_hash, using key_values. key_values must be
+        values whose repr() is the same each time MarkWrite is run, for
+        example tuples of SETTINGS (name, value) pairs.
+
+        :param file_hash: str returned by fileHash()
+        :param key_values:
+        :return: str
+        '''
+        from markwrite import __version__
+        khash = hashlib.sha1(repr((cls.cache_version, __version__) +
+                                  key_values))
+        return '%s_%s' % (file_hash, khash.hexdigest())
+
+    @classmethod
+    def load(cls, key):
+        '''
+        Return the dict of values saved for key, or None if the cache does
+        not have an entry for key. ndarrays are memory mapped from the
+        cache entry files (or read into memory on Windows), and can be
+        modified without changing the entry.
+
+        :param key: str returned by entryKey()
+        :return: dict or None
+        '''
+        entry_dir = os.path.join(cls.getCacheDir(), key)
+        values_path = os.path.join(entry_dir, cls.entry_values_file_name)
+        if not os.path.isfile(values_path):
+            return None
+        try:
+            with open(values_path, 'rb') as f:
+                values, array_names = cPickle.load(f)
+            for aname in array_names:
+                values[aname] = np.asarray(np.load(
+                    os.path.join(entry_dir, aname + '.npy'),
+                    mmap_mode=cls.array_mmap_mode))
+            # Used as the last access time of the entry.
+            os.utime(entry_dir, None)
+        except Exception:
+            print "Warning: Removing unreadable pen data cache entry:", key
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        return values
+
+    @classmethod
+    def save(cls, key, values):
+        '''
+        Save the dict of values for key, replacing any existing entry, and
+        remove least recently used entries until the cache size is less
+        than SETTINGS['pendata_cache_max_mb'].
+
+        Errors writing the entry are printed and otherwise ignored, since
+        the cache is only used to open pen data files faster.
+
+        :param key: str returned by entryKey()
+        :param values: dict
+        :return: bool, True if the entry was saved
+        '''
+        cache_dir = cls.getCacheDir()
+        entry_dir = os.path.join(cache_dir, key)
+        # The entry is written to a temporary folder that is renamed once
+        # complete, so a partly written entry is never loaded.
+        tmp_dir = u'%s.%d.tmp' % (entry_dir, os.getpid())
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            pvalues = dict()
+            array_names = []
+            for vname, v in values.items():
+                if isinstance(v, np.ndarray) and v.size and \
+                        not v.dtype.hasobject:
+                    np.save(os.path.join(tmp_dir, vname + '.npy'), v)
+                    array_names.append(vname)
+                else:
+                    pvalues[vname] = v
+            with open(os.path.join(tmp_dir, cls.entry_values_file_name),
+                      'wb') as f:
+                cPickle.dump((pvalues, array_names), f,
+                             cPickle.HIGHEST_PROTOCOL)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(tmp_dir, entry_dir)
+        except Exception:
+            print "Warning: Could not save pen data cache entry:", key
+            import traceback
+            traceback.print_exc()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        cls.evict(SETTINGS['pendata_cache_max_mb'] * 2**20, keep=key)
+        return True
+
+    @classmethod
+    def entries(cls):
+        '''
+        Return a list of (last access time, size in bytes, key) for each
+        cache entry, least recently used first.
+
+        :return: list
+        '''
+        cache_dir = cls.getCacheDir()
+        if not os.path.isdir(cache_dir):
+            return []
+        entries = []
+        for key in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir, key)
+            if key.endswith('.tmp') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, fname))
+                           for fname in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_dir), size, key))
+            except OSError:
+                pass
+        entries.sort()
+        return entries
+
+    @classmethod
+    def evict(cls, max_bytes, keep=None):
+        '''
+        Remove least recently used cache entries, other than keep, until
+        the total size of the cache entries is max_bytes or less.
+
+        :param max_bytes: int
+        :param keep: key of an entry that is not removed
+        :return: int, number of entries removed
+        '''
+        entries = cls.entries()
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, key in entries:
+            if total_size <= max_bytes:
+                break
+            if key == keep:
+                continue
+            cls._removeEntry(key)
+            total_size -= size
+            removed += 1
+        return removed
+
+    @classmethod
+    def invalidate(cls, file_path=None):
+        '''
+        Remove the cache entries created from the pen data file file_path,
+        or all cache entries if file_path is None.
+
+        :param file_path:
+        :return: int, number of entries removed
+        '''
+        prefix = ''
+        if file_path is not None:
+            prefix = cls.fileHash(file_path) + '_'
+        removed = 0
+        for _, _, key in cls.entries():
+            if key.startswith(prefix):
+                cls._removeEntry(key)
+                removed += 1
+        return removed
+
+    @classmethod
+    def _removeEntry(cls, key):
+        shutil.rmtree(os.path.join(cls.getCacheDir(), key),
+                      ignore_errors=True)
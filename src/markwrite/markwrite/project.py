@@ -16,142 +16,39 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import division
 
-from weakref import proxy, ProxyType
+from weakref import proxy
 import os
 import glob
 import codecs
 
 import numpy as np
-import pyqtgraph as pg
-from pyqtgraph import OrderedDict
+from collections import OrderedDict
 
 from file_io import EyePenDataImporter, XmlDataImporter, HubDatastoreImporter
-from file_io import TabDelimitedDataImporter, readPickle, writePickle
+from file_io import TabDelimitedDataImporter, readProjectFile, writeProjectFile
+from file_io import ProjectFileReader, formatPenData
 from file_io import SAMPLE_STATES
 from segment import PenDataSegment, PenDataSegmentCategory
-from util import contiguous_regions, getFilteredStringList
-from gui.projectsettings import SETTINGS
+from util import contiguous_regions, getFilteredStringList, interval_sample_owners
+from pendata_cache import PenDataCache
+from settings import SETTINGS
 from .sigproc import filter_pen_sample_series, calculate_velocity
+from .sigproc import parse_using_sample_field, vc_parse_series
+from .sigproc import vc_stale_stage
+from .sigproc.series_pool import map_series
 
 _warning_count = 0
 
-selectedtimeperiod_properties = None
-
-
-class SelectedTimePeriodItem(pg.LinearRegionItem):
-    def __init__(self, *args, **kwargs):
-        project = kwargs.pop('project')
-        kwargs['movable'] = True
-        pg.LinearRegionItem.__init__(self, *args, **kwargs)
-        for l in self.lines:
-            l.pen.color()
-            l.setPen(l.pen.color(),
-                     width=2)
-            l.setHoverPen(l.hoverPen.color(), width=2)
-        self._project = None
-        if project:
-            self.project = proxy(project)
-        self._ignore_events=False
-
-    def mouseClickEvent(self, ev):
-        self.project._mwapp.setActiveObject(self)
-        pg.LinearRegionItem.mouseClickEvent(self, ev)
-
-    def mouseDoubleClickEvent(self, event):
-        if self._ignore_events:
-            return
-        pg.LinearRegionItem.mouseDoubleClickEvent(self, event)
-        self.project._mwapp.setActiveObject(self)
-        self.project._mwapp._penDataTimeLineWidget.zoomToPenData(
-            self.selectedpendata)
-        self.project._mwapp._penDataSpatialViewWidget.zoomToPenData(
-            self.selectedpendata)
-
-    def lineMoved(self):
-        if self.blockLineSignal:
-            return
-        pg.LinearRegionItem.lineMoved(self)
-        if self.project._mwapp._segmenttree.doNotSetActiveObject is False:
-            self.project._mwapp.setActiveObject(self)
-
-    def lineMoveFinished(self):
-        pg.LinearRegionItem.lineMoveFinished(self)
-        if self.project._mwapp._segmenttree.doNotSetActiveObject is False:
-            self.project._mwapp.setActiveObject(self)
-
-    def getBounds(self):
-        return self.lines[0].maxRange
-
-    @property
-    def project(self):
-        return self._project
-
-    @project.setter
-    def project(self, p):
-        if p is None:
-            self._project = proxy(p)
-            self.setBounds(bounds=(0, 0))
-            self.setRegion([0, 0])
-        else:
-            if isinstance(p, ProxyType):
-                self._project = p
-            else:
-                self._project = proxy(p)
-
-    @property
-    def allpendata(self):
-        return self.project.pendata
-
-    @property
-    def selectedpendata(self):
-        _, _, spendata = self.selectedtimerangeanddata
-        return spendata
-
-    @property
-    def selectedtimerangeanddata(self):
-        minT, maxT = self.getRegion()
-        allpendata = self.allpendata
-        return minT, maxT, allpendata[
-            (allpendata['time'] >= minT) & (allpendata['time'] <= maxT)]
-
-    def propertiesTableData(self):
-        """
-        Return a dict of segment properties to display in the Selected Project
-        Tree Node Object Properties Table.
-
-        :return: dict of segmentcategory properties to display
-        """
-        global selectedtimeperiod_properties
-        props = selectedtimeperiod_properties
-
-        if selectedtimeperiod_properties is None:
-            selectedtimeperiod_properties = OrderedDict()
-            props = selectedtimeperiod_properties
-            props['Name'] = ['']
-            props['Start Time'] = ['']
-            props['End Time'] = ['']
-            props['Point Count'] = ['']
-
-        props['Name'][0] = u"Selected Time Period"
-        stime, etime = self.getRegion()
-        props['Start Time'][0] = '%.3f' % stime
-        props['End Time'][0] = '%.3f' % etime
-        props['Point Count'][0] = self.selectedpendata.shape[0]
-        mwapp = self._project._mwapp
-        trialname = None
-        if mwapp:
-            if mwapp.activetrial:
-                trialname = mwapp.activetrial.name
-        if trialname:
-            props.setdefault('Current Trial', [''])[0] = '%s' % (trialname)
-        elif props.has_key('Current Trial'):
-            del props['Current Trial']
-
-        return props
-
-    def toDict(self):
-        return dict(timerange=self.getRegion())
-
+sample_label_dtype = np.dtype([('series_id', np.uint32),
+                               ('run_id', np.uint32),
+                               ('stroke_id', np.uint32),
+                               ('stroke_type', np.int16)])
+# sample_labels dtype used when SETTINGS['pendata_format'] is 'compact'.
+# Only used if each boundary table has less than 65535 rows.
+compact_sample_label_dtype = np.dtype([('series_id', np.uint16),
+                                       ('run_id', np.uint16),
+                                       ('stroke_id', np.uint16),
+                                       ('stroke_type', np.int8)])
 
 def updateDataFileLoadingProgressDialog(mwapp, inc_val=2):
     if mwapp:
@@ -165,6 +62,93 @@ def updateDataFileLoadingProgressDialog(mwapp, inc_val=2):
             pass
 
 
+# Filtering a series takes about 0.35 usec per sample, so a worker process
+# is only used for each 65536 samples to filter; with fewer, the time saved
+# is less than the time taken to start the worker processes and copy
+# pendata to and from shared memory.
+SERIES_FILTER_MIN_WORKER_SAMPLE_COUNT = 65536
+
+def _processPenSampleSeries(pseries):
+    """
+    Filter the samples of a single pen sample Series and calculate their
+    velocity and acceleration data. pseries is updated in place.
+    """
+    # 1) Filter each sample Series
+    filter_pen_sample_series(pseries)
+    # 2) Calculate pen sample velocity and acceleration data.
+    calculate_velocity(pseries)
+
+def _parsePenSampleSeriesStrokes(pseries, vc_cache=None):
+    """
+    Run the stroke detection algorithm selected in SETTINGS on the samples
+    of a single pen sample Series or Run. Returns the parser output used by
+    MarkWriteProject._findstrokes(), or None if pseries is too short to be
+    parsed.
+
+    vc_cache is the series_dat of an earlier velocity & curvature parse of
+    pseries, see vc_parse_series().
+    """
+    if SETTINGS['stroke_detect_algorithm'] == "xy_velocity&curvature":
+        if len(pseries['time']) < SETTINGS['stroke_detect_min_p2p_sample_count']:
+            return None
+        return vc_parse_series(pseries, cache=vc_cache)
+    return parse_using_sample_field(pseries)
+
+def _strokeParseFingerprint():
+    """
+    Return the SETTINGS values that the stroke boundaries found by
+    MarkWriteProject._parseStrokeBoundaries() depend on, as a sorted tuple
+    of (setting name, value) pairs. Saved with a project so that stroke
+    boundaries only need to be parsed again when a project is opened if
+    these settings have changed.
+    """
+    return tuple(sorted((k, v) for k, v in SETTINGS.items()
+                        if k.startswith('stroke_detect_') or
+                        k.startswith('device_')))
+
+def _importFingerprint():
+    """
+    Return the SETTINGS values that the pen sample array created by a
+    DataImporter depends on, as a sorted tuple of (setting name, value)
+    pairs. Used as part of the PenDataCache key of imported pen data.
+    """
+    return tuple(sorted((k, v) for k, v in SETTINGS.items()
+                        if k.startswith('series_detect_')))
+
+def _processFingerprint():
+    """
+    Return the SETTINGS values that the processed pendata and Series, Run
+    and Stroke boundaries of a new project depend on, as a sorted tuple of
+    (setting name, value) pairs. Used as part of the PenDataCache key of
+    processed pen data.
+    """
+    return tuple(sorted(_strokeParseFingerprint() + tuple(
+        (k, SETTINGS[k]) for k in ('auto_generate_l1segments',
+                                   'filter_imported_pen_data',
+                                   'hdf5_apply_time_offset_var_select_filter',
+                                   'pendata_format'))))
+
+def _projectFilePenDataLoader(proj_file):
+    """
+    Return a lazy array loader (see MarkWriteProject._setLazyArray()) that
+    reads the pendata saved in the ProjectFileReader proj_file, in the pen
+    sample format and layout of the current settings.
+    """
+    def load(project):
+        if SETTINGS['pendata_layout'] == 'columns':
+            pendata = proj_file.readColumns('pendata')
+        else:
+            pendata = proj_file['pendata']
+            del proj_file['pendata']
+        return formatPenData(pendata)
+    return load
+
+def _strokeBoundarySamplesLoader(project):
+    # Lazy array loader of stroke_boundary_samples, see
+    # MarkWriteProject._openFromProjectFile().
+    return project.pendata[project._stroke_boundary_ixs]
+
+
 class MarkWriteProject(object):
     project_file_extension = u'mwp'
     serialize_attributes = (
@@ -184,7 +168,9 @@ class MarkWriteProject(object):
         'series_boundaries',
         'run_boundaries',
         'stroke_boundary_samples',
+        '_stroke_boundary_ixs',
         'stroke_boundaries',
+        'stroke_parse_fingerprint',
         'segmenttree',
         'gui_state'
     )
@@ -192,7 +178,7 @@ class MarkWriteProject(object):
                               txyp=TabDelimitedDataImporter,
                               eptxyp=EyePenDataImporter,
                               hdf5=HubDatastoreImporter,
-                              mwp=readPickle)
+                              mwp=readProjectFile)
     _selectedtimeregion = None
     schema_version = "0.3"
 
@@ -227,6 +213,9 @@ class MarkWriteProject(object):
         ## listed in MarkWriteProject.serialize_attributes
         #
 
+        # Loaders of array attributes that are read the first time they are
+        # used, see _setLazyArray().
+        self._lazy_arrays = dict()
         self.name = u"Unknown"
         self.projectfileinfo = dict(saved=False,
                                     abspath=None,
@@ -250,6 +239,9 @@ class MarkWriteProject(object):
 
         self.autodetected_segment_tags = []
         self.pendata = []
+        # DataImporter.import_report of the pen data file, if the project
+        # was created from one.
+        self.import_report = None
 
         # TODO: Remove nonzero_pressure_mask and nonzero_region_ix attributes
         #       from project, switching to use of run_boundaries instead.
@@ -261,9 +253,21 @@ class MarkWriteProject(object):
         self.run_boundaries = []
         self.stroke_boundary_samples = None
         self.stroke_boundaries = []
+        # _strokeParseFingerprint() when stroke_boundaries were parsed.
+        self.stroke_parse_fingerprint = None
+        self._vc_parser_dat = dict()
+        # vc_parse_series() series_dat of each (start_ix, stop_ix) Series or
+        # Run pendata range from the last stroke parse.
+        self._vc_parse_cache = dict()
         self.segmenttree = None
 
         self._stroke_boundary_ixs = []
+        # pendata array that _sorted_pendata_times was created from
+        self._time_index_pendata = None
+        self._sorted_pendata_times = None
+        # Per sample series / run / stroke labels, see getSampleLabels()
+        self.sample_labels = np.zeros(0, dtype=sample_label_dtype)
+        self._sample_stroke_counts = np.zeros(0, dtype=np.int64)
         self._mwapp = None
         self._modified = True
         
@@ -352,6 +356,54 @@ class MarkWriteProject(object):
         '''
         return self.pendata[self.pendata['segment_id'] > 0]
 
+    @property
+    def pendata(self):
+        '''
+        ndarray of all pen samples loaded from the source data file. See
+        allpendata.
+
+        When a project is opened from a .mwp file, pendata is read from the
+        file the first time it is used.
+
+        :return: 1D numpy array with dtype markwrite.file_io.markwrite_pendata
+        '''
+        if 'pendata' in self._lazy_arrays:
+            self._pendata = self._lazy_arrays.pop('pendata')(self)
+        return self._pendata
+
+    @pendata.setter
+    def pendata(self, a):
+        self._lazy_arrays.pop('pendata', None)
+        self._pendata = a
+
+    @property
+    def stroke_boundary_samples(self):
+        '''
+        ndarray of the pen samples at the start and end of each stroke.
+
+        When a project is opened from a .mwp file without parsing the stroke
+        boundaries again, the samples are taken from pendata the first time
+        they are used.
+
+        :return: 1D numpy array with dtype markwrite.file_io.markwrite_pendata
+        '''
+        if 'stroke_boundary_samples' in self._lazy_arrays:
+            self._stroke_boundary_samples = self._lazy_arrays.pop(
+                'stroke_boundary_samples')(self)
+        return self._stroke_boundary_samples
+
+    @stroke_boundary_samples.setter
+    def stroke_boundary_samples(self, a):
+        self._lazy_arrays.pop('stroke_boundary_samples', None)
+        self._stroke_boundary_samples = a
+
+    def _setLazyArray(self, name, loader):
+        # Set the array attribute name to the array returned by
+        # loader(self) the first time the attribute is used. loader must
+        # not keep a reference to the project; the project has a __del__
+        # method, so reference cycles that include it are never collected.
+        self._lazy_arrays[name] = loader
+
 
     def getSeriesPeriodForTime(self, atime, positions='current'):
         """
@@ -519,91 +571,84 @@ class MarkWriteProject(object):
         except:
             return None
 
+    def getSampleLabels(self, sample_indices=None):
+        '''
+        Return the sample_labels records for the pendata samples at
+        sample_indices, which can be an int, slice, or array of sample
+        indices. If sample_indices is None, all sample_labels are returned.
+
+        Each record has the fields:
+            series_id: id + 1 of the sample Series containing the sample, or 0
+            run_id: id + 1 of the pressed Run containing the sample, or 0
+            stroke_id: id + 1 of the first pen Stroke containing the sample, or 0
+            stroke_type: stroke_type of that pen Stroke, or -1
+
+        :param sample_indices: int, slice, ndarray or None
+        :return: ndarray of dtype sample_label_dtype
+        '''
+        if sample_indices is None:
+            return self.sample_labels
+        return self.sample_labels[sample_indices]
+
+    def _warnMultipleStrokesForSample(self, sample_index):
+        global _warning_count
+        stroke_count = self._sample_stroke_counts[sample_index]
+        if stroke_count > 1:
+            if _warning_count<10:
+                print "Warning, %d strokes found for sample ix %d. Using first detected stroke for report." % (stroke_count, sample_index)
+                _warning_count+=1
+                if _warning_count == 10:
+                    print "Will stop warning you!!!!!"
+
     def getSeriesForSample(self, sample_index):
         '''
-        Return a record from the series_boundaries ndarray for the sample
-        Series that contains sample_index.
+        Return the id + 1 of the sample Series that contains sample_index.
 
         If the sample at pendata[sample_index] is not within a Series,
-        return None.
+        return 0.
 
         :param sample_index: int (valid value range 0 : len(pendata)-1)
-        :return: Record / row from series_boundaries attribute, or None
-        '''
-        starts = self.series_boundaries['start_ix']
-        ends = self.series_boundaries['end_ix']
-        series = self.series_boundaries[
-            (sample_index >= starts) & (sample_index <= ends)]
-        if len(series) > 1:
-            print "Error, > 1 stroke found:", sample_index, series
-        elif len(series) == 1:
-            return series['id'][0] + 1
-        return 0
+        :return: int
+        '''
+        return self.sample_labels['series_id'][sample_index]
 
     def getPressedRunForSample(self, sample_index):
         '''
-        Return a record from the run_boundaries ndarray for the sample
-        Run that contains sample_index.
+        Return the id + 1 of the sample Run that contains sample_index.
 
         If the sample at pendata[sample_index] is not within a Run,
-        return None.
+        return 0.
 
         :param sample_index: int (valid value range 0 : len(pendata)-1)
-        :return: Record / row from run_boundaries attribute, or None
-        '''
-        starts = self.run_boundaries['start_ix']
-        ends = self.run_boundaries['end_ix']
-        run = self.run_boundaries[
-            (sample_index >= starts) & (sample_index <= ends)]
-        if len(run) > 1:
-            print "Error, > 1 stroke found:", sample_index, run
-        elif len(run) == 1:
-            return run['id'][0] + 1
-        return 0
+        :return: int
+        '''
+        return self.sample_labels['run_id'][sample_index]
 
     def getStrokeForSample(self, sample_index):
         '''
-        Return a record from the stroke_boundaries ndarray for the pen Stroke
-        that contains sample_index.
+        Return the id + 1 of the pen Stroke that contains sample_index.
 
         If the sample at pendata[sample_index] is not within a pen Stroke,
-        return None.
+        return 0.
 
         :param sample_index: int (valid value range 0 : len(pendata)-1)
-        :return: Record / row from stroke_boundaries attribute, or None
+        :return: int
         '''
-        global _warning_count
-        starts = self.stroke_boundaries['start_ix']
-        ends = self.stroke_boundaries['end_ix']
-        stroke = self.stroke_boundaries[(sample_index >= starts) & (sample_index <= ends)]
-        if len(stroke) > 1:
-            if _warning_count<10:
-                print "Warning, %d strokes found for sample ix %d. Using first detected stroke for report." % (len(stroke), sample_index)
-                _warning_count+=1
-                if _warning_count == 10:
-                    print "Will stop warning you!!!!!"
-        if len(stroke) > 0:
-            return stroke['id'][0] + 1
-        return 0
+        self._warnMultipleStrokesForSample(sample_index)
+        return self.sample_labels['stroke_id'][sample_index]
 
     def getStrokeTypeForSample(self, sample_index):
         '''
-        '''
-        global _warning_count
-        starts = self.stroke_boundaries['start_ix']
-        ends = self.stroke_boundaries['end_ix']
-        stroke = self.stroke_boundaries[(sample_index >= starts) & (sample_index <= ends)]
-        if len(stroke) > 1:
-            if _warning_count<10:
-                print "Warning, %d strokes found for sample ix %d. Using first detected stroke for report." % (
-                len(stroke), sample_index)
-                _warning_count+=1
-                if _warning_count == 10:
-                    print "Will stop warning you!!!!!"
-        if len(stroke)>0:
-            return stroke['stroke_type'][0]
-        return -1
+        Return the stroke_type of the pen Stroke that contains sample_index.
+
+        If the sample at pendata[sample_index] is not within a pen Stroke,
+        return -1.
 
+        :param sample_index: int (valid value range 0 : len(pendata)-1)
+        :return: int
+        '''
+        self._warnMultipleStrokesForSample(sample_index)
+        return self.sample_labels['stroke_type'][sample_index]
 
     def getPenDataForTimePeriod(self, tstart, tend, pendata=None):
         '''
@@ -615,10 +660,63 @@ class MarkWriteProject(object):
         :param pendata: ndarray of dtype markwrite.file_io.markwrite_pendata_format
         :return: ndarray of dtype markwrite.file_io.markwrite_pendata_format
         '''
-        if pendata is None:
+        if pendata is None or pendata is self.pendata:
+            ix_range = self.getTimePeriodIndexRange(tstart, tend)
+            if ix_range is not None:
+                return self.pendata[ix_range[0]:ix_range[1]]
             pendata = self.pendata
         return pendata[(pendata['time'] >= tstart) & (pendata['time'] <= tend)]
 
+    def getTimePeriodIndexRange(self, tstart, tend):
+        '''
+        Return the (start_ix, end_ix) index range of the samples in the
+        project pendata array with time >= tstart and <= tend, so that
+        pendata[start_ix:end_ix] is a view of those samples. The range is
+        found with a binary search of pendata['time'].
+
+        If the pendata time field is not sorted, None is returned.
+
+        :param tstart: float (sec.usec time format)
+        :param tend:  float (sec.usec time format)
+        :return: (int, int) or None
+        '''
+        ptimes = self._getSortedPenDataTimes()
+        if ptimes is None:
+            return None
+        return (int(np.searchsorted(ptimes, tstart, side='left')),
+                int(np.searchsorted(ptimes, tend, side='right')))
+
+    def _getSortedPenDataTimes(self):
+        # Return a contiguous copy of pendata['time'] if it is sorted,
+        # otherwise None. searchsorted() would copy the strided time field
+        # on every call, so the copy is made once per pendata array.
+        pendata = self.pendata
+        if pendata is None or len(pendata) == 0:
+            return None
+        if self._time_index_pendata is not pendata:
+            ptimes = np.ascontiguousarray(pendata['time'])
+            if np.all(ptimes[1:] >= ptimes[:-1]):
+                self._sorted_pendata_times = ptimes
+            else:
+                self._sorted_pendata_times = None
+            self._time_index_pendata = pendata
+        return self._sorted_pendata_times
+
+    def _setSegmentIdForTimePeriod(self, tstart, tend, segment_id):
+        '''
+        This method can only be used by the MarkWrite GUI app.
+
+        Set the 'segment_id' field of the pendata samples with
+        time >= tstart and <= tend.
+        '''
+        ix_range = self.getTimePeriodIndexRange(tstart, tend)
+        if ix_range is not None:
+            self.pendata['segment_id'][ix_range[0]:ix_range[1]] = segment_id
+        else:
+            pendata = self.pendata
+            mask = (pendata['time'] >= tstart) & (pendata['time'] <= tend)
+            pendata['segment_id'][mask] = segment_id
+
     def getTrialConditionsForSample(self, sample):
         '''
         Returns a list of trial condition variable data for the given sample.
@@ -668,8 +766,8 @@ class MarkWriteProject(object):
         '''
         Return a dict representation of the project, suitable for
         serialization using packages like pickle. When a project is saved to a
-        .mwp file, the return value of this method is what gets pickled as the
-        file contents.
+        .mwp file, the return value of this method is what gets written to
+        the file by markwrite.file_io.writeProjectFile.
 
         :return: dict
         '''
@@ -686,6 +784,9 @@ class MarkWriteProject(object):
             else:
                 print "### MarkWriteProject.toDict Error: %s is not a member " \
                       "of the project class" % a
+        # Saved as an array so it is stored as a block of the project file.
+        projdict['_stroke_boundary_ixs'] = np.asarray(
+            self._stroke_boundary_ixs, dtype=np.int64)
         return projdict
 
     def save(self):
@@ -698,7 +799,7 @@ class MarkWriteProject(object):
             return self.saveAs(self.projectfileinfo['abspath'])
         return False
 
-    def saveAs(self, tofile):
+    def saveAs(self, tofile, compress=False):
         '''
         Save the project object to disk using the file path specified by tofile.
 
@@ -710,13 +811,16 @@ class MarkWriteProject(object):
         If a file already exists at topath, it will be overwritten with this
         projects serialized data.
 
+        If compress is True, the project's numpy arrays are zlib compressed
+        within the project file.
+
         :return: bool (True if save was successful, False otherwise)
         '''
         try:
             self._updateProjectFileInfo(tofile, saved=True)
             projdict = self.toDict()
             pdir, pfile = os.path.split(tofile)
-            writePickle(pdir, pfile, projdict)
+            writeProjectFile(pdir, pfile, projdict, compress)
             self.modified = False
             return True
         except:
@@ -733,6 +837,10 @@ class MarkWriteProject(object):
         :return: bool
         """
         self._selectedtimeregion = None
+        self._time_index_pendata = None
+        self._sorted_pendata_times = None
+        self._vc_parser_dat = dict()
+        self._vc_parse_cache = dict()
         for a in self.serialize_attributes:
             setattr(self, a, None)
         return True
@@ -752,13 +860,78 @@ class MarkWriteProject(object):
             self.projectfileinfo['folder'], self.projectfileinfo['shortname'],
             self.projectfileinfo['extension'])
 
-        pen_data = fimporter.asarray(file_path)
+        # Pen data files that have been opened before are loaded from the
+        # pen data cache, skipping the import and processing steps that
+        # have a cache entry for the file contents and current SETTINGS.
+        file_hash = None
+        if PenDataCache.isEnabled():
+            file_hash = PenDataCache.fileHash(file_path)
+        pen_data, exp_condvars = self._importPenData(file_path, fimporter,
+                                                     file_hash)
         updateDataFileLoadingProgressDialog(self._mwapp)
 
-        self._detectTrialPeriodConditionVariables(fimporter, pen_data)
+        self._detectTrialPeriodConditionVariables(exp_condvars, pen_data)
         updateDataFileLoadingProgressDialog(self._mwapp)
 
-        self.pendata = self._parsePenDataByTrials(pen_data)
+        process_key = None
+        if file_hash:
+            process_key = PenDataCache.entryKey(file_hash, fimporter.__name__,
+                                                _importFingerprint(),
+                                                self._stimevar, self._etimevar,
+                                                _processFingerprint())
+        if process_key is None or not self._loadProcessedPenData(process_key):
+            self._processPenData(pen_data)
+            if process_key:
+                self._saveProcessedPenData(process_key)
+        del pen_data
+        updateDataFileLoadingProgressDialog(self._mwapp)
+
+        if self._mwapp:
+            # If project is being created via MarkWrite GUI, create
+            # SelectedTimePeriodItem widget.
+            if self._selectedtimeregion is None:
+                from gui.selectedtimeperiod import SelectedTimePeriodItem
+                MarkWriteProject._selectedtimeregion = SelectedTimePeriodItem(
+                    project=self)
+            else:
+                MarkWriteProject._selectedtimeregion.project = self
+        else:
+            # Otherwise, project is being created via custom script using
+            # markwrite api, so create segments for any detected
+            # trial periods.
+            for t, tbounds in enumerate(self.trial_boundaries):
+                self.createSegmentForTimePeriod(u"Trial%d" % (t + 1),
+                                                self.segmenttree.id,
+                                                tbounds['start_time'],
+                                                tbounds['end_time'],
+                                                update_segid_field=True)
+            self._mapTrialConditions2TrialSegments()
+        updateDataFileLoadingProgressDialog(self._mwapp, 5)
+
+    def _importPenData(self, file_path, fimporter, file_hash=None):
+        # Return the (pen_data, exp_condvars) read from file_path by
+        # fimporter. If file_hash is given, they are loaded from the pen data
+        # cache when possible, and saved to it when not.
+        import_key = None
+        if file_hash:
+            import_key = PenDataCache.entryKey(file_hash, fimporter.__name__,
+                                               _importFingerprint())
+            cached = PenDataCache.load(import_key)
+            if cached:
+                self.import_report = cached['import_report']
+                return cached['pen_data'], cached['exp_condvars']
+
+        pen_data = fimporter.asarray(file_path)
+        self.import_report = fimporter.import_report
+        exp_condvars = getattr(fimporter, 'exp_condvars', None)
+        if import_key:
+            PenDataCache.save(import_key, dict(pen_data=pen_data,
+                                               exp_condvars=exp_condvars,
+                                               import_report=self.import_report))
+        return pen_data, exp_condvars
+
+    def _processPenData(self, pen_data):
+        self.pendata = formatPenData(self._parsePenDataByTrials(pen_data))
         updateDataFileLoadingProgressDialog(self._mwapp, 10)
 
         self._normalizeConditionVariableTimes()
@@ -781,105 +954,66 @@ class MarkWriteProject(object):
         # 4) Detect pen stroke boundaries within
         #      a) full sample Series
         #      b) each sample Run within the Series
-        self.run_boundaries = []
         self._stroke_boundary_ixs = []
         self.stroke_boundary_samples = None
         self.stroke_boundaries = []
-        press_run_count = 0
-        for series_bounds in self.series_boundaries:
-            # get sample array for current series
-            pseries = self.pendata[
-                      series_bounds['start_ix']:series_bounds['end_ix'] + 1]
-            psb_start_ix = series_bounds['start_ix']
-
-            # 1) Filter each sample Series
-            filter_pen_sample_series(pseries)
-            # 2) Calculate pen sample velocity and acceleration data.
-            calculate_velocity(pseries)
-            
-            updateDataFileLoadingProgressDialog(self._mwapp)
-
-            # 3) Detect Sample Runs within the Series.
-            #    First attempt to use FIRST_PRESS pen sample state.
-            fpstatus = SAMPLE_STATES['FIRST_PRESS']
-            press_starts = list(
-                *(pseries['state'] & fpstatus == fpstatus).nonzero())
-            if len(press_starts) != 0:
-                if pseries['pressure'][0] > 0 and press_starts[0] != 0:
-                    press_starts.insert(0, 0)
-                press_stops = press_starts[1:]
-                press_stops.append(len(pseries))
-                # Add pressed period boundaries array for current series to
-                # the list of series pen pressed boundaries.
-                for i in range(len(press_starts)):
-                    si = press_starts[i]
-                    pressed_run_ixs = \
-                    (pseries[si:press_stops[i]]['pressure'] > 0).nonzero()[0]
-                    if len(pressed_run_ixs):
-                        ei = si + pressed_run_ixs[-1]
-                        st, et = pseries['time'][[si, ei]]
-                        curr_press_series_id = press_run_count
-                        press_run_count += 1
-                        self.run_boundaries.append((
-                        curr_press_series_id, series_bounds['id'],
-                        psb_start_ix + si, st, psb_start_ix + ei, et))
-
-                    updateDataFileLoadingProgressDialog(self._mwapp)
-            else:
-                # If no FIRST_PRESS pen sample states are found,
-                # use pen pressed periods (pressure > 0) to find Runs.
-                press_starts, press_stops, press_lenths = contiguous_regions(
-                    pseries['pressure'] > 0)
-                # Add pressed period boundaries array for current series to
-                # the list of series pen pressed boundaries.
-                for i in xrange(len(press_starts)):
-                    si, ei = press_starts[i], press_stops[i]
-                    try:
-                        st, et = pseries['time'][[si, ei]]
-                    except IndexError, err:
-                        ei = ei - 1
-                        st, et = pseries['time'][[si, ei]]
-                        press_stops[i] = ei
-                    curr_press_series_id = press_run_count
-                    press_run_count += 1
-                    self.run_boundaries.append((
-                    curr_press_series_id, series_bounds['id'],
-                    psb_start_ix + si, st, psb_start_ix + ei, et))
-
-                    updateDataFileLoadingProgressDialog(self._mwapp)
+        map_series(_processPenSampleSeries, self.pendata,
+                   [(series_bounds['start_ix'], series_bounds['end_ix'] + 1)
+                    for series_bounds in self.series_boundaries],
+                   SETTINGS['series_process_worker_count'],
+                   modifies_pendata=True,
+                   min_worker_sample_count=SERIES_FILTER_MIN_WORKER_SAMPLE_COUNT)
+        updateDataFileLoadingProgressDialog(self._mwapp)
 
-        # Convert run_boundaries list of lists into an ndarray
-        run_dtype = np.dtype({
-        'names': ['id', 'parent_id', 'start_ix', 'start_time', 'end_ix',
-                  'end_time'],
-        'formats': [np.uint16, np.uint16, np.uint32, np.float64, np.uint32,
-                    np.float64]})
-        self.run_boundaries = np.asarray(self.run_boundaries, dtype=run_dtype)
-        
-        self._parseStrokeBoundaries()
-        
+        self.run_boundaries = self._parsePenSampleRuns()
         updateDataFileLoadingProgressDialog(self._mwapp)
 
-        if self._mwapp:
-            # If project is being created via MarkWrite GUI, create
-            # SelectedTimePeriodItem widget.
-            if self._selectedtimeregion is None:
-                MarkWriteProject._selectedtimeregion = SelectedTimePeriodItem(
-                    project=self)
-            else:
-                MarkWriteProject._selectedtimeregion.project = self
-        else:
-            # Otherwise, project is being created via custom script using
-            # markwrite api, so create segments for any detected
-            # trial periods.
-            for t, tbounds in enumerate(self.trial_boundaries):
-                self.createSegmentForTimePeriod(u"Trial%d" % (t + 1),
-                                                self.segmenttree.id,
-                                                tbounds['start_time'],
-                                                tbounds['end_time'],
-                                                update_segid_field=True)
-            self._mapTrialConditions2TrialSegments()
-        updateDataFileLoadingProgressDialog(self._mwapp, 5)
+        self._parseStrokeBoundaries()
+
+    # Project attributes set by _processPenData() that are saved in the pen
+    # data cache. pendata is saved separately.
+    _processed_cache_attributes = ('trial_cond_vars',
+                                   'trial_boundaries',
+                                   'timebase_offset',
+                                   'autosegl1',
+                                   'series_boundaries',
+                                   'run_boundaries',
+                                   'stroke_boundaries',
+                                   '_stroke_boundary_ixs')
+
+    def _saveProcessedPenData(self, cache_key):
+        values = dict((aname, getattr(self, aname)) for aname in
+                      self._processed_cache_attributes)
+        values['_stroke_boundary_ixs'] = np.asarray(self._stroke_boundary_ixs,
+                                                    dtype=np.int64)
+        values['pendata'] = np.asarray(self.pendata)
+        return PenDataCache.save(cache_key, values)
+
+    def _loadProcessedPenData(self, cache_key):
+        # Set the project attributes that _processPenData() sets from the pen
+        # data cache entry cache_key. Returns False if there is no entry.
+        cached = PenDataCache.load(cache_key)
+        if not cached:
+            return False
+        for aname in self._processed_cache_attributes:
+            setattr(self, aname, cached[aname])
+        self._stroke_boundary_ixs = np.asarray(
+            self._stroke_boundary_ixs, dtype=np.int64).tolist()
+        self.pendata = formatPenData(cached['pendata'])
+        updateDataFileLoadingProgressDialog(self._mwapp, 10)
+
+        self.nonzero_pressure_mask = self.pendata['pressure'] > 0
+        # nonzero_regions_ix will be a tuple of (starts, stops, lengths) arrays
+        self.nonzero_region_ix = contiguous_regions(self.nonzero_pressure_mask)
+
+        self.segmenttree = PenDataSegmentCategory(name=self.name, project=self)
+        self.pendata['segment_id'] = self.segmenttree.id
+        self.stroke_boundary_samples = self.pendata[self._stroke_boundary_ixs]
+        self.stroke_parse_fingerprint = _strokeParseFingerprint()
+        self.vc_parser_dat = None
+        self._vc_parse_cache = dict()
+        self._createSampleLabels()
+        return True
 
     def _parseStrokeBoundaries(self):
         # 1) Filter each sample Series
@@ -892,20 +1026,12 @@ class MarkWriteProject(object):
         self.stroke_boundary_samples = None
         self.stroke_boundaries = []
         self.vc_parser_dat = dict()
-        if SETTINGS['stroke_detect_pressed_runs_only'] is False:
-            # 4a) Detect pen stroke boundaries within current Series
-            for series_bounds in self.series_boundaries:
-                # get sample array for current series
-                pseries = self.pendata[
-                          series_bounds['start_ix']:series_bounds['end_ix'] + 1]
-                psb_start_ix = series_bounds['start_ix']
-
-                self._findstrokes(pseries, psb_start_ix, series_bounds['id'])
-        else:
-            # 4b) Detect strokes in pressed runs only
-            for curr_press_series_id, rbp_id, si, rb_start_time, ei, rb_end_time in self.run_boundaries:
-                self._findstrokes(self.pendata[si:ei + 1], si, 
-                                  curr_press_series_id)                    
+        search_bounds = self._getStrokeSearchBounds()
+        parsed_strokes = self._parseSearchBounds(search_bounds)
+        for (si, ei, parent_id), series_strokes in zip(search_bounds,
+                                                      parsed_strokes):
+            self._findstrokes(self.pendata[si:ei + 1], si, parent_id,
+                              series_strokes)
 
         # Convert run_boundaries list of lists into an ndarray
         stroke_dtype = np.dtype({
@@ -919,6 +1045,117 @@ class MarkWriteProject(object):
         # Create ndarray of pen samples that are the detected stroke
         # boundary points.
         self.stroke_boundary_samples = self.pendata[self._stroke_boundary_ixs]        
+        self.stroke_parse_fingerprint = _strokeParseFingerprint()
+
+        self._createSampleLabels()
+
+    def _getStrokeSearchBounds(self):
+        # Return a (start_ix, end_ix, parent_id) tuple for each Series or
+        # Run that strokes are detected in. end_ix is inclusive.
+        if SETTINGS['stroke_detect_pressed_runs_only'] is False:
+            # 4a) Detect pen stroke boundaries within current Series
+            return [(series_bounds['start_ix'],
+                     series_bounds['end_ix'],
+                     series_bounds['id'])
+                    for series_bounds in self.series_boundaries]
+        # 4b) Detect strokes in pressed runs only
+        return [(si, ei, curr_press_series_id)
+                for curr_press_series_id, rbp_id, si, rb_start_time, ei, rb_end_time in self.run_boundaries]
+
+    def _parseSearchBounds(self, search_bounds):
+        # Return the _parsePenSampleSeriesStrokes() result for each
+        # (start_ix, end_ix, parent_id) search bounds. When the velocity &
+        # curvature parser is used, Series and Runs parsed before only rerun
+        # the parser stages whose settings have changed. The others are
+        # parsed in the series worker pool.
+        index_ranges = [(si, ei + 1) for si, ei, _ in search_bounds]
+        worker_count = SETTINGS['series_process_worker_count']
+        if SETTINGS['stroke_detect_algorithm'] != "xy_velocity&curvature":
+            self._vc_parse_cache = dict()
+            return map_series(_parsePenSampleSeriesStrokes, self.pendata,
+                              index_ranges, worker_count)
+
+        vc_caches = [self._vc_parse_cache.get(ir) for ir in index_ranges]
+        pooled = [i for i, vc_cache in enumerate(vc_caches)
+                  if vc_stale_stage(vc_cache) == 0]
+        parsed_strokes = [None] * len(index_ranges)
+        pooled_strokes = map_series(_parsePenSampleSeriesStrokes, self.pendata,
+                                    [index_ranges[i] for i in pooled],
+                                    worker_count)
+        for i, series_strokes in zip(pooled, pooled_strokes):
+            parsed_strokes[i] = series_strokes
+            vc_caches[i] = None
+        for i, vc_cache in enumerate(vc_caches):
+            if vc_cache is not None:
+                si, ei = index_ranges[i]
+                parsed_strokes[i] = _parsePenSampleSeriesStrokes(
+                    self.pendata[si:ei], vc_cache)
+
+        self._vc_parse_cache = dict(
+            (ir, series_strokes[1]) for ir, series_strokes
+            in zip(index_ranges, parsed_strokes) if series_strokes is not None)
+        return parsed_strokes
+
+    @property
+    def vc_parser_dat(self):
+        """
+        Dict of the velocity & curvature stroke parser diagnostic arrays
+        (see sigproc.parse_strokes.vc_parse_series) for each Series or Run
+        id, when the xy_velocity&curvature stroke detection algorithm is
+        used.
+
+        When a project file is opened without parsing the stroke
+        boundaries again, the arrays are calculated the first time the
+        property is used.
+
+        :return: dict
+        """
+        if self._vc_parser_dat is None:
+            self._vc_parser_dat = dict()
+            if SETTINGS['stroke_detect_algorithm'] == "xy_velocity&curvature":
+                search_bounds = self._getStrokeSearchBounds()
+                parsed_strokes = self._parseSearchBounds(search_bounds)
+                for (si, ei, parent_id), series_strokes in zip(search_bounds,
+                                                              parsed_strokes):
+                    if series_strokes is not None:
+                        self._vc_parser_dat[parent_id] = series_strokes[1]
+        return self._vc_parser_dat
+
+    @vc_parser_dat.setter
+    def vc_parser_dat(self, d):
+        self._vc_parser_dat = d
+
+    def _createSampleLabels(self, sample_count=None):
+        # Label each pen sample with the Series, Run and Stroke that it is in,
+        # so per sample lookups do not need to search the boundary tables.
+        # sample_count is the length of pendata, given when pendata has
+        # not been read yet.
+        if sample_count is None:
+            sample_count = len(self.pendata)
+        label_boundaries = [('series_id', self.series_boundaries),
+                            ('run_id', self.run_boundaries),
+                            ('stroke_id', self.stroke_boundaries)]
+        label_dtype = sample_label_dtype
+        if SETTINGS['pendata_format'] == 'compact' and \
+                max(len(b) for _, b in label_boundaries) < 0xFFFF:
+            label_dtype = compact_sample_label_dtype
+        self.sample_labels = np.zeros(sample_count, dtype=label_dtype)
+        self.sample_labels['stroke_type'] = -1
+        self._sample_stroke_counts = np.zeros(sample_count, dtype=np.int64)
+        for label_field, boundaries in label_boundaries:
+            if len(boundaries) == 0:
+                continue
+            owners, counts = interval_sample_owners(boundaries['start_ix'],
+                                                    boundaries['end_ix'],
+                                                    sample_count)
+            labeled = owners >= 0
+            if label_field == 'stroke_id':
+                if label_dtype is compact_sample_label_dtype and \
+                        not (counts > 0xFF).any():
+                    counts = counts.astype(np.uint8)
+                self._sample_stroke_counts = counts
+                self.sample_labels['stroke_type'][labeled] = boundaries['stroke_type'][owners[labeled]]
+            self.sample_labels[label_field][labeled] = boundaries['id'][owners[labeled]].astype(label_dtype[label_field]) + 1
         
     def _detectAssociatedSegmentTagsFile(self, dir_path, fname, fext):
         tag_list = []
@@ -961,14 +1198,10 @@ class MarkWriteProject(object):
 
         self.pendatafileinfo['utcdateloaded'] = datetime.datetime.utcnow()
 
-    def _detectTrialPeriodConditionVariables(self, fimporter, pen_data):
+    def _detectTrialPeriodConditionVariables(self, exp_condvars, pen_data):
         # If file opened was an iohub hdf5 file, and had a
-        # cond var table, get the cond var table as a ndarray.
-        try:
-            self.trial_cond_vars = fimporter.exp_condvars
-        except:
-            self.trial_cond_vars = []
-
+        # cond var table, exp_condvars is the cond var table as a ndarray.
+        self.trial_cond_vars = exp_condvars
         if self.trial_cond_vars is None:
             self.trial_cond_vars = []
         # If cond var table exists, give user option of selecting
@@ -996,11 +1229,25 @@ class MarkWriteProject(object):
                 tvarlists["End Time Variable"] = getFilteredStringList(
                     tvarlists["End Time Variable"], trial_end_var_select_filter)
 
-            from gui.dialogs import DlgFromDict
+            if self._mwapp:
+                from gui.dialogs import DlgFromDict
+
+                dictDlg = DlgFromDict(dictionary=tvarlists,
+                                      title='Select Trial Time Conditions')
+                tvars_selected = dictDlg.OK
+            else:
+                # No GUI to ask which variables to use, so the select
+                # filters must match a single start and end time variable.
+                for tvarlabel, tvarnames in tvarlists.items():
+                    if len(tvarnames) != 1:
+                        raise ValueError(
+                            "Trial {} could not be selected from: {}. Set "
+                            "tstart_cond_name and tend_cond_name.".format(
+                                tvarlabel, tvarnames))
+                    tvarlists[tvarlabel] = tvarnames[0]
+                tvars_selected = True
 
-            dictDlg = DlgFromDict(dictionary=tvarlists,
-                                  title='Select Trial Time Conditions')
-            if dictDlg.OK:
+            if tvars_selected:
                 self._stimevar = tvarlists["Start Time Variable"]
                 self._etimevar = tvarlists["End Time Variable"]
 
@@ -1028,97 +1275,142 @@ class MarkWriteProject(object):
                         removed_count += 1
 
     def _parsePenDataByTrials(self, pen_data):
-        trials = []  # list of tuples; each being (cvrow_index,
-        # start_sample_ix, start_sample_time, end_sample_ix, end_sample_time)
+        trial_dtype = np.dtype({
+        'names': ['cvrow_ix', 'start_ix', 'start_time', 'end_ix', 'end_time'],
+        'formats': [np.int32, np.uint32, np.float64, np.uint32, np.float64]})
         if len(
                 self.trial_cond_vars) and self._stimevar is not None and \
                         self._etimevar is not None:
-            # go through each trial, select only the samples within
-            # the trial period, add the trials sample array to list of trial
-            # sample data.
-            samples_by_trial = []
-            trialsamplecount = 0
-            lastrialendix = -1
-
-            CVROW_IX = 0
-            TS_IX_IX = 1
-            TS_TIME_IX = 2
-            TE_IX_IX = 3
-            TE_TIME_IX = 4
-
+            # Select only the samples within each trial period, keeping
+            # the samples of each trial in trial order.
+            trial_count = len(self.trial_cond_vars)
+            trial_starts = np.zeros(trial_count, dtype=np.float64)
+            trial_ends = np.zeros(trial_count, dtype=np.float64)
+            valid_trials = np.zeros(trial_count, dtype=bool)
             for tix, t in enumerate(self.trial_cond_vars):
-                tbounds = [tix, 0, 0.0, 0, 0.0]
                 try:
-                    trialstart = float(t[self._stimevar])
-                    trialend = float(t[self._etimevar])
-
-                    if trialend - trialstart <= 0:
+                    trial_starts[tix] = float(t[self._stimevar])
+                    trial_ends[tix] = float(t[self._etimevar])
+                    if trial_ends[tix] - trial_starts[tix] <= 0:
                         raise ValueError(
                             "Trial end time must be greater than trial start "
                             "time: [{}, {}]".format(
-                                trialstart, trialend))
-
-                    trial_time_mask = (pen_data['time'] >= trialstart) & (
-                    pen_data['time'] < trialend)
-                    start_ix, end_ix, trial_length = contiguous_regions(
-                        trial_time_mask)
-                    start_ix, end_ix = start_ix[0], end_ix[0]
-
-                    # check for trial overlap
-                    if not (end_ix > start_ix and start_ix >= lastrialendix):
-                        raise ValueError(
-                            "Trial sample range overlaps with existing trial: "
-                            "current=[{}, {}], last_trial_end_ix= {}".format(
-                                start_ix, end_ix, lastrialendix))
-
-                    lastrialendix = end_ix
-
-                    trial_samples = pen_data[trial_time_mask]
-
-                    if len(trial_samples) > 0:
-                        tbounds[TS_IX_IX] = trialsamplecount
-                        trialsamplecount += len(trial_samples)
-                        tbounds[TE_IX_IX] = trialsamplecount - 1
-                        samples_by_trial.append(trial_samples)
-
-                    # Normalize pen sample times so first sample starts at
-                    # 0.0 sec.
-                    if tix == 0:
-                        self.timebase_offset = trialstart
-                        tbounds[TS_TIME_IX] = 0.0
-                    else:
-                        tbounds[TS_TIME_IX] = trialstart - self.timebase_offset
-                    tbounds[TE_TIME_IX] = trialend - self.timebase_offset
-
+                                trial_starts[tix], trial_ends[tix]))
+                    valid_trials[tix] = True
                 except:
-                    print(
-                    "Error getting trial time period: [{}, {}] = [{}, "
-                    "{}]".format(
-                        self._stimevar, self._etimevar, t[self._stimevar],
-                        t[self._etimevar]))
+                    self._printTrialPeriodError(t)
                     import traceback
 
                     traceback.print_exc()
-                finally:
-                    trials.append(tuple(tbounds))
-
-            # make pendata == concat'ed samples_by_trial
-            pen_data = np.concatenate(samples_by_trial)
 
+            # [start_ixs[i], stop_ixs[i]) is the sample index range of trial
+            # i, found using the samples with time >= trial start and
+            # < trial end.
+            ptimes = pen_data['time']
+            trial_sample_ixs = None
+            if np.all(ptimes[1:] >= ptimes[:-1]):
+                start_ixs = np.searchsorted(ptimes, trial_starts, side='left')
+                stop_ixs = np.searchsorted(ptimes, trial_ends, side='left')
+                stop_ixs[~valid_trials] = start_ixs[~valid_trials]
+            else:
+                # Pen sample times are not in order, so a trial period
+                # can have more than one sample range. The first one is
+                # used for overlap checks.
+                start_ixs = np.zeros(trial_count, dtype=np.int64)
+                stop_ixs = np.zeros(trial_count, dtype=np.int64)
+                trial_sample_ixs = [np.zeros(0, dtype=np.int64)]*trial_count
+                for tix in valid_trials.nonzero()[0]:
+                    trial_time_mask = (ptimes >= trial_starts[tix]) & (
+                        ptimes < trial_ends[tix])
+                    if trial_time_mask.any():
+                        rstarts, rstops, rlengths = contiguous_regions(
+                            trial_time_mask)
+                        start_ixs[tix], stop_ixs[tix] = rstarts[0], rstops[0]
+                        trial_sample_ixs[tix] = trial_time_mask.nonzero()[0]
+
+            for tix in (valid_trials & (stop_ixs <= start_ixs)).nonzero()[0]:
+                self._printTrialPeriodError(self.trial_cond_vars[tix],
+                                            "Trial period has no pen samples.")
+            used_trials = valid_trials & (stop_ixs > start_ixs)
+
+            # check for trial overlap: a trial must not start before the
+            # end of the last trial that was used. Trials found to overlap
+            # are dropped one at a time, in trial order, so that each
+            # check uses the same last trial that a trial by trial check
+            # would.
+            while True:
+                last_stop_ixs = np.maximum.accumulate(
+                    np.where(used_trials, stop_ixs, -1))
+                prev_stop_ixs = np.empty_like(last_stop_ixs)
+                prev_stop_ixs[0] = -1
+                prev_stop_ixs[1:] = last_stop_ixs[:-1]
+                overlaps = (used_trials & (start_ixs < prev_stop_ixs)).nonzero()[0]
+                if len(overlaps) == 0:
+                    break
+                tix = overlaps[0]
+                used_trials[tix] = False
+                self._printTrialPeriodError(self.trial_cond_vars[tix],
+                    "Trial sample range overlaps with existing trial: "
+                    "current=[{}, {}], last_trial_end_ix= {}".format(
+                        start_ixs[tix], stop_ixs[tix], prev_stop_ixs[tix]))
+
+            if not used_trials.any():
+                raise ValueError("No pen samples were found within any "
+                                 "trial period.")
+
+            if trial_sample_ixs is None:
+                sample_counts = np.where(used_trials, stop_ixs - start_ixs, 0)
+                trial_stop_ixs = np.cumsum(sample_counts)
+                trial_start_ixs = trial_stop_ixs - sample_counts
+                sample_ixs = np.arange(trial_stop_ixs[-1]) + np.repeat(
+                    start_ixs - trial_start_ixs, sample_counts)
+            else:
+                sample_counts = np.asarray(
+                    [len(trial_sample_ixs[tix]) if used_trials[tix] else 0
+                     for tix in xrange(trial_count)], dtype=np.int64)
+                trial_stop_ixs = np.cumsum(sample_counts)
+                trial_start_ixs = trial_stop_ixs - sample_counts
+                sample_ixs = np.concatenate([trial_sample_ixs[tix] for tix in
+                                             used_trials.nonzero()[0]])
+
+            # make pendata == the samples of each trial
+            trial_pen_data = np.empty(len(sample_ixs), dtype=pen_data.dtype)
+            np.take(pen_data, sample_ixs, out=trial_pen_data)
+            pen_data = trial_pen_data
+
+            # Normalize pen sample times so first sample starts at
+            # 0.0 sec.
+            if used_trials[0]:
+                self.timebase_offset = trial_starts[0]
+
+            self.trial_boundaries = np.zeros(trial_count, dtype=trial_dtype)
+            self.trial_boundaries['cvrow_ix'] = np.arange(trial_count)
+            tbounds = self.trial_boundaries
+            tbounds['start_ix'][used_trials] = trial_start_ixs[used_trials]
+            tbounds['end_ix'][used_trials] = trial_stop_ixs[used_trials] - 1
+            tbounds['start_time'][used_trials] = trial_starts[used_trials] - \
+                                                 self.timebase_offset
+            tbounds['end_time'][used_trials] = trial_ends[used_trials] - \
+                                               self.timebase_offset
         else:
             # Normalize pen sample times so first sample starts at 0.0 sec.
             self.timebase_offset = pen_data['time'][0]
             self.autosegl1 = False
+            self.trial_boundaries = np.zeros(0, dtype=trial_dtype)
 
         # Normalize pen sample times so first sample starts at 0.0 sec.
         pen_data['time'] -= self.timebase_offset
-
-        trial_dtype = np.dtype({
-        'names': ['cvrow_ix', 'start_ix', 'start_time', 'end_ix', 'end_time'],
-        'formats': [np.int32, np.uint32, np.float64, np.uint32, np.float64]})
-        self.trial_boundaries = np.asarray(trials, dtype=trial_dtype)
         return pen_data
 
+    def _printTrialPeriodError(self, trial_cond_vars, msg=None):
+        print(
+        "Error getting trial time period: [{}, {}] = [{}, "
+        "{}]".format(
+            self._stimevar, self._etimevar, trial_cond_vars[self._stimevar],
+            trial_cond_vars[self._etimevar]))
+        if msg:
+            print(msg)
+
     def _mapTrialConditions2TrialSegments(self):
         if len(self.trial_cond_vars) and len(
                 self.trial_boundaries) and self.segmenttree.children:
@@ -1177,16 +1469,97 @@ class MarkWriteProject(object):
                          np.float64]})
         return np.asarray(slist, dtype=series_dtype)
 
-    def _findstrokes(self, searchsamplearray, obsolute_offset, parent_id):            
+    def _parsePenSampleRuns(self):
+        """
+        Find pen sample Run boundaries within each pen sample Series.
+        Series that have samples with status field state FIRST_PRESS
+        have a Run starting at each FIRST_PRESS sample (and at the start of
+        the Series if its first sample is pressed), ending at the last
+        pressed sample before the next Run start. Other Series have a Run
+        for each period of pressed samples (pressure > 0), ending at the
+        first unpressed sample after the period.
+        :return: ndarray with element dtype of ['id','parent_id','start_ix',
+        'start_time','end_ix','end_time']
+        """
+        pendata = self.pendata
+        series_starts = self.series_boundaries['start_ix'].astype(np.int64)
+        series_ends = self.series_boundaries['end_ix'].astype(np.int64)
+        sample_ixs = np.arange(len(pendata))
+        # Position in series_boundaries of the Series each sample is in.
+        sample_series = np.repeat(np.arange(len(series_starts)),
+                                  series_ends - series_starts + 1)
+        is_series_start = np.zeros(len(pendata), dtype=bool)
+        is_series_start[series_starts] = True
+        is_series_end = np.zeros(len(pendata), dtype=bool)
+        is_series_end[series_ends] = True
+
+        pressed = pendata['pressure'] > 0
+        fpstatus = SAMPLE_STATES['FIRST_PRESS']
+        first_press = pendata['state'] & fpstatus == fpstatus
+        fp_series = np.bincount(sample_series[first_press],
+                                minlength=len(series_starts)) > 0
+
+        # 1) Runs of Series with FIRST_PRESS samples.
+        run_start_mask = first_press.copy()
+        fp_series_starts = series_starts[fp_series]
+        run_start_mask[fp_series_starts[pressed[fp_series_starts]]] = True
+        fp_starts, = run_start_mask.nonzero()
+        fp_start_series = sample_series[fp_starts]
+        fp_stops = np.empty_like(fp_starts)
+        fp_stops[:-1] = fp_starts[1:]
+        series_last = np.ones(len(fp_starts), dtype=bool)
+        series_last[:-1] = fp_start_series[1:] != fp_start_series[:-1]
+        fp_stops[series_last] = series_ends[fp_start_series[series_last]] + 1
+        # Index of the last pressed sample at or before each sample.
+        last_pressed = np.maximum.accumulate(np.where(pressed, sample_ixs, -1))
+        fp_ends = last_pressed[fp_stops - 1]
+        has_press = fp_ends >= fp_starts
+        fp_starts, fp_ends = fp_starts[has_press], fp_ends[has_press]
+
+        # 2) Runs of Series without FIRST_PRESS samples.
+        pr_pressed = pressed & ~fp_series[sample_series]
+        prev_pressed = np.zeros_like(pr_pressed)
+        prev_pressed[1:] = pr_pressed[:-1]
+        next_pressed = np.zeros_like(pr_pressed)
+        next_pressed[:-1] = pr_pressed[1:]
+        pr_starts, = (pr_pressed & (is_series_start | ~prev_pressed)).nonzero()
+        pr_lasts, = (pr_pressed & (is_series_end | ~next_pressed)).nonzero()
+        pr_ends = pr_lasts + 1 - is_series_end[pr_lasts]
+
+        run_starts = np.concatenate((fp_starts, pr_starts))
+        run_ends = np.concatenate((fp_ends, pr_ends))
+        order = np.argsort(run_starts, kind='mergesort')
+        run_starts, run_ends = run_starts[order], run_ends[order]
+
+        run_dtype = np.dtype({
+        'names': ['id', 'parent_id', 'start_ix', 'start_time', 'end_ix',
+                  'end_time'],
+        'formats': [np.uint16, np.uint16, np.uint32, np.float64, np.uint32,
+                    np.float64]})
+        runs = np.empty(len(run_starts), dtype=run_dtype)
+        runs['id'] = np.arange(len(run_starts))
+        runs['parent_id'] = self.series_boundaries['id'][
+            sample_series[run_starts]]
+        runs['start_ix'] = run_starts
+        runs['start_time'] = pendata['time'][run_starts]
+        runs['end_ix'] = run_ends
+        runs['end_time'] = pendata['time'][run_ends]
+        return runs
+
+    def _findstrokes(self, searchsamplearray, obsolute_offset, parent_id,
+                     parsed_strokes=None):
+        # parsed_strokes is the _parsePenSampleSeriesStrokes() result for
+        # searchsamplearray, if it has already been calculated.
         edge_points = None
         
         # Find stroke boundary points
         
         if SETTINGS['stroke_detect_algorithm'] == "xy_velocity&curvature":
-            from .sigproc import parse_velocity_and_curvature
             if len(searchsamplearray['time']) < SETTINGS['stroke_detect_min_p2p_sample_count']:
                 return
-            stroke_bounds_with_pauses = parse_velocity_and_curvature(searchsamplearray, self.vc_parser_dat, parent_id)
+            if parsed_strokes is None:
+                parsed_strokes = _parsePenSampleSeriesStrokes(searchsamplearray)
+            stroke_bounds_with_pauses, self.vc_parser_dat[parent_id] = parsed_strokes
             if stroke_bounds_with_pauses is not None:
                 if len(stroke_bounds_with_pauses) >= 1:
                     #['id', 'type', 'start_ix', 'end_ix'],            
@@ -1212,8 +1585,9 @@ class MarkWriteProject(object):
                          obsolute_offset + len(searchsamplearray) - 1,
                          searchsamplearray['time'][-1], 0))                        
         else:
-            from .sigproc import parse_using_sample_field
-            edge_points = parse_using_sample_field(searchsamplearray)
+            edge_points = parsed_strokes
+            if edge_points is None:
+                edge_points = _parsePenSampleSeriesStrokes(searchsamplearray)
             
             # Create stroke boundary lookup tables                   
             if len(edge_points) > 1:
@@ -1331,15 +1705,18 @@ class MarkWriteProject(object):
         '''
 
         sparent = self.segmenttree.id2obj[parent_id]
-        spendata = self.getPenDataForTimePeriod(tstart, tend)
+        ix_range = self.getTimePeriodIndexRange(tstart, tend)
+        spendata = None
+        if ix_range is None:
+            spendata = self.getPenDataForTimePeriod(tstart, tend)
         new_segment = PenDataSegment(name=tag, pendata=spendata, parent=sparent,
-                                     fulltimerange=(tstart, tend), id=id)
+                                     fulltimerange=(tstart, tend), id=id,
+                                     ix_range=ix_range)
 
         if update_segid_field is True:
-            pendata = self.pendata
-            mask = (pendata['time'] >= new_segment.starttime) & (
-            pendata['time'] <= new_segment.endtime)
-            self.pendata['segment_id'][mask] = new_segment.id
+            self._setSegmentIdForTimePeriod(new_segment.starttime,
+                                            new_segment.endtime,
+                                            new_segment.id)
         self.modified = True
         return new_segment
 
@@ -1358,14 +1735,19 @@ class MarkWriteProject(object):
         :return:
         """
         sparent = self.segmenttree.id2obj[parent_id]
-        new_segment = PenDataSegment(name=tag, pendata=self.selectedpendata,
+        tstart, tend = self.selectedtimeperiod
+        ix_range = self.getTimePeriodIndexRange(tstart, tend)
+        spendata = None
+        if ix_range is None:
+            spendata = self.selectedpendata
+        new_segment = PenDataSegment(name=tag, pendata=spendata,
                                      parent=sparent,
-                                     fulltimerange=self.selectedtimeperiod)
+                                     fulltimerange=(tstart, tend),
+                                     ix_range=ix_range)
 
-        pendata = self.pendata
-        mask = (pendata['time'] >= new_segment.starttime) & (
-        pendata['time'] <= new_segment.endtime)
-        self.pendata['segment_id'][mask] = new_segment.id
+        self._setSegmentIdForTimePeriod(new_segment.starttime,
+                                        new_segment.endtime,
+                                        new_segment.id)
         self.modified = True
         return new_segment
 
@@ -1469,6 +1851,27 @@ class MarkWriteProject(object):
         segmenttree = projdict.get('segmenttree')
         projattrnames.remove('segmenttree')
 
+        # The saved stroke boundaries are used if the project was saved
+        # with the current stroke detection settings.
+        reuse_stroke_boundaries = \
+            projdict.get('stroke_parse_fingerprint') == \
+            _strokeParseFingerprint() and \
+            isinstance(projdict.get('stroke_boundaries'), np.ndarray) and \
+            '_stroke_boundary_ixs' in projattrnames
+
+        # pendata is read from a project container file the first time it
+        # is used, and stroke_boundary_samples are then taken from pendata
+        # if the saved stroke boundaries are used.
+        sample_count = None
+        if isinstance(projdict, ProjectFileReader) and \
+                'pendata' in projdict.arraynames():
+            sample_count = projdict.shape('pendata')[0]
+            self._setLazyArray('pendata', _projectFilePenDataLoader(projdict))
+            projattrnames.remove('pendata')
+        if reuse_stroke_boundaries and \
+                'stroke_boundary_samples' in projattrnames:
+            projattrnames.remove('stroke_boundary_samples')
+
         for aname in projattrnames:
             aval = projdict[aname]
             setattr(self, aname, aval)
@@ -1477,12 +1880,21 @@ class MarkWriteProject(object):
 
         del projdict
 
+        # Use the pen sample format and layout of the current settings.
+        if 'pendata' not in self._lazy_arrays:
+            self.pendata = formatPenData(self.pendata)
+        if not reuse_stroke_boundaries and \
+                self.stroke_boundary_samples is not None:
+            self.stroke_boundary_samples = formatPenData(
+                self.stroke_boundary_samples)
+
         self.segmenttree = PenDataSegmentCategory.fromDict(segmenttree, self,
                                                            None)
         updateDataFileLoadingProgressDialog(self._mwapp, 10)
 
         if self._mwapp:
             if self._selectedtimeregion is None:
+                from gui.selectedtimeperiod import SelectedTimePeriodItem
                 MarkWriteProject._selectedtimeregion = SelectedTimePeriodItem(
                     project=self)
             else:
@@ -1490,8 +1902,21 @@ class MarkWriteProject(object):
 
         updateDataFileLoadingProgressDialog(self._mwapp, 5)
 
-        # Reparse boundaries so that V&C alg will regen data needed for reports        
-        self._parseStrokeBoundaries()
+        # Reparse stroke boundaries if the project was saved without them,
+        # or with different stroke detection settings.
+        if reuse_stroke_boundaries:
+            self.vc_parser_dat = None
+            self._stroke_boundary_ixs = np.asarray(
+                self._stroke_boundary_ixs, dtype=np.int64).tolist()
+            # stroke_boundary_samples are the pendata samples at the stroke
+            # boundary indices; taking them from pendata again updates
+            # segment_id, the only pendata field that changes after the
+            # stroke boundaries are parsed.
+            self._setLazyArray('stroke_boundary_samples',
+                               _strokeBoundarySamplesLoader)
+            self._createSampleLabels(sample_count)
+        else:
+            self._parseStrokeBoundaries()
         
         self.modified = False
         updateDataFileLoadingProgressDialog(self._mwapp)
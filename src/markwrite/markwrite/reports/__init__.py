@@ -16,6 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import codecs
 import re
+import numpy as np
+from markwrite.file_io import PenSampleColumns
 
 first_cap_re = re.compile('(.)([A-Z][a-z]+)')
 all_cap_re = re.compile('([a-z0-9])([A-Z])')
@@ -124,6 +126,20 @@ class ReportExporter(object):
     Users of the MarkWrite application will then be able to use the new
     report type.
 
+    Reports with many data rows can instead provide the report data as
+    blocks of columns by implementing the datablocks() class method. Each
+    block is a dict of column name -> numpy array (or list), or a numpy
+    structured array with a field for each report column. ReportExporter
+    then formats each column of a block in one step, which is much faster
+    than formatting the report one data row at a time. For example, the
+    datarows() method of RawSampleDataReportExporter could be replaced by:
+
+            @classmethod
+            def datablocks(cls):
+                pendata = cls.project.pendata
+                for i in range(0, pendata.shape[0], 10000):
+                    yield pendata[i:i+10000]
+
     Review the doc strings for the full ReportExporter class to learn all the
     different options that can be changed for use in a ReportExporter subclass.
     '''
@@ -230,6 +246,29 @@ class ReportExporter(object):
         """
         yield []
 
+    @classmethod
+    def datablocks(cls):
+        """
+        Optional.
+        This class method can be implemented by the subclass being created
+        instead of .datarows(), to provide the report data rows as blocks of
+        columns.
+
+        Each block yielded must be either a dict with a numpy array (or list)
+        of values for each report column, keyed by column name, or a numpy
+        structured array with a field for each report column. All columns in a
+        block must have the same length, which is the number of data rows in
+        the block. Report columns that are not in a block, and masked values
+        of numpy masked arrays, are saved as the missingval. All other values
+        are formatted the same way as data row values.
+
+        If the method returns None, data rows are read from .datarows().
+        A subclass of a report class that implements .datablocks() and
+        overrides .datarows() uses .datarows().
+        :return: a yielded dict or ndarray for each block of data rows, or None
+        """
+        return None
+
     @classmethod
     def preamble(cls):
         """
@@ -295,7 +334,7 @@ class ReportExporter(object):
         return cls.sep.join(rowformater)+cls.nl
 
     @classmethod
-    def export(cls, file_path, project):
+    def export(cls, file_path, project, sink=u'text'):
         """
         ReportExporter subclasses should not override this method.        
 
@@ -306,16 +345,28 @@ class ReportExporter(object):
 
             MyReportExporter.export(path_to_output_file, markwrite_app.project)
 
+        To save the report columns to a binary file instead of a tab
+        delimited text file, give the file format as the sink argument:
+
+            MyReportExporter.export(path_to_output_file, markwrite_app.project,
+                                    sink='hdf5')
+
         :param file_path: Absolute file path to save the report to.
         :param project: The MarkWriteProject instance that will be used
                         for data and further calculations by the datarows
                         method.
-        :return: None
+        :param sink: 'text' (the default), or one of the binary report
+                     file formats in reports.sinks.REPORT_SINKS: 'hdf5',
+                     'npz' or 'npy'.
+        :return: number of data rows saved, or None if an error occurred
+                 while creating the report.
         """
+        if sink != u'text' and sink not in REPORT_SINKS:
+            raise ValueError(u"Unknown report sink: {}".format(sink))
         cls.project = project
         try:
-            
-            import pyqtgraph
+            if sink != u'text':
+                return cls._exportsink(file_path, REPORT_SINKS[sink])
             with codecs.open(file_path, "w", "utf-8") as f:
                 rp = cls.preamble()
                 if len(rp)>0:
@@ -325,12 +376,20 @@ class ReportExporter(object):
                 if len(cls.columnnames())>0:
                     f.write(cls.sep.join(cls.columnnames())+cls.nl)
                 rowformatstr=cls.rowformat()
+                colcount=cls.columncount()
                 ri = 0
- 
-                if project._mwapp:                 
+
+                datablocks = None
+                if cls._usesdatablocks():
+                    datablocks = cls.datablocks()
+
+                if datablocks is not None:
+                    ri = cls._writeblocks(cls._textblockwriter(f), datablocks)
+                elif project._mwapp:                 
+                    import pyqtgraph
                     with pyqtgraph.ProgressDialog(cls.progress_dialog_title, 0,cls.datarowcount(), cancelText=None) as dlg:     
                         for row in cls.datarows():
-                            row.extend([cls.missingval,]*(cls.columncount()-len(row)))
+                            row.extend([cls.missingval,]*(colcount-len(row)))
                             f.write(rowformatstr.format(*row))
     
                             if ri%cls.progress_update_rate==0:
@@ -342,7 +401,7 @@ class ReportExporter(object):
                             ri+=1
                 else:
                     for row in cls.datarows():
-                        row.extend([cls.missingval,]*(cls.columncount()-len(row)))
+                        row.extend([cls.missingval,]*(colcount-len(row)))
                         f.write(rowformatstr.format(*row))
                         ri+=1           
             return ri
@@ -351,8 +410,156 @@ class ReportExporter(object):
             traceback.print_exc()
         finally:
             cls.project = None
-        return 0
+        return None
+
+    @classmethod
+    def _usesdatablocks(cls):
+        # True if the report's datablocks() method should be used, i.e. it is
+        # not ReportExporter.datablocks() and has not been replaced by a
+        # datarows() method in a subclass.
+        for c in cls.__mro__:
+            if 'datablocks' in c.__dict__:
+                return c is not ReportExporter
+            if 'datarows' in c.__dict__:
+                return False
+        return False
+
+    @classmethod
+    def _exportsink(cls, file_path, sink_cls):
+        # Save the report to file_path using a binary ReportSink class.
+        # Returns the number of data rows saved.
+        datablocks = None
+        if cls._usesdatablocks():
+            datablocks = cls.datablocks()
+        if datablocks is None:
+            datablocks = cls._rowblocks()
+
+        column_names = cls.columnnames()
+        sink = sink_cls(file_path, column_names, title=cls.reportlabel(),
+                        preamble=cls.preamble(),
+                        expectedrows=cls.datarowcount())
+        dtypes = []
+        def writeblock(block):
+            block_names, rowcount = cls._blockrowcount(block)
+            if rowcount == 0:
+                return 0
+            columns = []
+            for ci, cname in enumerate(column_names):
+                cvalues = None
+                if cname in block_names:
+                    cvalues = block[cname]
+                values, mask = sinks.blockcolumn(cls, cvalues, rowcount)
+                if len(dtypes) <= ci:
+                    dtypes.append(sinks.columndtype(values, mask))
+                columns.append(sinks.typedcolumn(cls, cname, values, mask,
+                                                 dtypes[ci], rowcount))
+            sink.write(columns)
+            return rowcount
+        try:
+            return cls._writeblocks(writeblock, datablocks)
+        finally:
+            sink.close()
+
+    @classmethod
+    def _rowblocks(cls, blockrowcount=10000):
+        # Yield the data rows of a report that only implements datarows()
+        # as blocks of up to blockrowcount rows.
+        column_names = cls.columnnames()
+        colcount = cls.columncount()
+        rows = []
+        for row in cls.datarows():
+            row.extend([cls.missingval,]*(colcount-len(row)))
+            rows.append(row)
+            if len(rows) == blockrowcount:
+                yield dict(zip(column_names, zip(*rows)))
+                rows = []
+        if rows:
+            yield dict(zip(column_names, zip(*rows)))
+
+    @classmethod
+    def _writeblocks(cls, writeblock, datablocks):
+        # Call writeblock(block) for each block returned by datablocks(),
+        # showing the progress dialog when run from the MarkWrite
+        # application. writeblock returns the number of data rows it saved.
+        # Returns the number of data rows saved.
+        if not cls.project._mwapp:
+            ri = 0
+            for block in datablocks:
+                ri+=writeblock(block)
+            return ri
 
+        import pyqtgraph
+        ri = 0
+        with pyqtgraph.ProgressDialog(cls.progress_dialog_title, 0,cls.datarowcount(), cancelText=None) as dlg:
+            for block in datablocks:
+                ri+=writeblock(block)
+                dlg.setValue(ri)
+                if dlg.wasCanceled():
+                    break
+        return ri
+
+    @classmethod
+    def _textblockwriter(cls, f):
+        # Return a writeblock function that saves each block as report text
+        # lines to the file f.
+        column_names = cls.columnnames()
+        def writeblock(block):
+            text, rowcount = cls._formatblock(block, column_names)
+            f.write(text)
+            return rowcount
+        return writeblock
+
+    @classmethod
+    def _blockrowcount(cls, block):
+        # Return the column names in a data block, and the number of data
+        # rows in the block.
+        if isinstance(block, (np.ndarray, PenSampleColumns)):
+            return block.dtype.names or (), block.shape[0]
+        for cvalues in block.values():
+            return block, len(cvalues)
+        return block, 0
+
+    @classmethod
+    def _formatblock(cls, block, column_names):
+        # Return the report text for a block of data rows, and the number of
+        # rows in the block. Each column is formatted in one step, and the
+        # formatted columns are then joined into report lines.
+        block_names, rowcount = cls._blockrowcount(block)
+        if rowcount == 0:
+            return u'', 0
+
+        columns = []
+        for cname in column_names:
+            if cname in block_names:
+                columns.append(cls._formatcolumn(cname, block[cname]))
+            else:
+                columns.append([cls.missingval]*rowcount)
+        if not columns:
+            return cls.nl*rowcount, rowcount
+        lines = map(cls.sep.join, zip(*columns))
+        lines.append(u'')
+        return cls.nl.join(lines), rowcount
+
+    @classmethod
+    def _formatcolumn(cls, cname, values):
+        # Return a list of the formatted values of a report column.
+        # Arrays are converted to lists of python values first; these format
+        # the same as the numpy scalars in a data row.
+        fmt = unicode(cls.formating.get(cname, u"{}"))
+        mask = None
+        if isinstance(values, np.ma.MaskedArray):
+            mask = np.ma.getmaskarray(values)
+            values = values.data
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        svalues = map(fmt.format, values)
+        if mask is not None:
+            for i in np.flatnonzero(mask):
+                svalues[i] = cls.missingval
+        return svalues
+
+from . import sinks
+from .sinks import REPORT_SINKS
 from .sample import PenSampleReportExporter
 from .segment import SegmentLevelReportExporter
 
@@ -45,48 +45,151 @@ class PenSampleReportExporter(ReportExporter):
 
     @classmethod
     def datarows(cls):
+        # The rows are taken from the same column blocks as datablocks(),
+        # so both give the same report. datarows() is still used when the
+        # columns can not be given by name.
+        for columns in cls._sampleblocks():
+            for row in zip(*columns):
+                yield list(row)
+
+    @classmethod
+    def datablocks(cls):
+        column_names = cls.columnnames()
+        if len(set(column_names)) != len(column_names):
+            # A trial condition variable has the same name as another
+            # column, so the columns can not be given by name.
+            return None
+        return (dict(zip(column_names, columns))
+                for columns in cls._sampleblocks())
+
+    @classmethod
+    def _sampleblocks(cls, chunk_size=50000):
+        # Yield the report data in blocks of up to chunk_size samples. Each
+        # block is a list with the values of each report column, in
+        # columnnames() order.
         pendata = cls.project.pendata
 
         ss = cls.project.segmenttree
         sfile=ss.name
-
-        lvls = range(1,ss.getLevelCount()+1)
-
-        segs_by_lvl=ss.getLeveledSegments()
         catname = ss.name
 
+        sample_count = pendata.shape[0]
+        lvl_names, lvl_found_counts = cls._levelSegmentNames()
+
+        # The trial condition values of a sample follow the segment names
+        # found for it, so they start in the first segment level column
+        # that has no segment name for the sample. trial_cvs is a 2D object
+        # array of trial condition values; the last row is for samples
+        # that are not in a trial.
         cvcolcount=0
         if len(cls.project.trial_cond_vars):
             cvcolcount=len(cls.project.trial_cond_vars.dtype.names)
+        if cvcolcount:
+            trial_cvrow_ixs, tcvs = cls._trialConditionLabels()
+            trial_cvs = np.empty((len(tcvs)+1, cvcolcount), dtype=object)
+            trial_cvs.fill(cls.missingval)
+            for r, tcv in enumerate(tcvs):
+                for c, v in enumerate(tcv):
+                    trial_cvs[r, c] = v
+        label_colcount = len(lvl_names)+cvcolcount
+
+        # Convert each unique sample state value only once.
+        states = pendata['state']
+        state_values = np.unique(states)
+        state_lists = np.empty(len(state_values), dtype=object)
+        for svi, sv in enumerate(state_values):
+            state_lists[svi] = convertSampleStateValue(sv)
+
+        for cstart in xrange(0, sample_count, chunk_size):
+            cend = min(cstart+chunk_size, sample_count)
+            crange = slice(cstart, cend)
+            ccount = cend-cstart
+            cpendata = pendata[crange]
+            columns = [[sfile]*ccount,
+                       np.arange(cstart, cend),
+                       cpendata['time'],
+                       cpendata['x'],
+                       cpendata['y'],
+                       cpendata['pressure'],
+                       state_lists[np.searchsorted(state_values,
+                                                   states[crange])],
+                       [catname]*ccount]
+
+            nf = lvl_found_counts[crange]
+            if cvcolcount:
+                ctrial_ixs = trial_cvrow_ixs[crange]
+            for m in xrange(label_colcount):
+                values = np.empty(ccount, dtype=object)
+                values.fill(cls.missingval)
+                if m < len(lvl_names):
+                    has_name = nf > m
+                    values[has_name] = lvl_names[m][crange][has_name]
+                if cvcolcount:
+                    cv_ixs = m-nf
+                    has_cv = (cv_ixs >= 0) & (cv_ixs < cvcolcount)
+                    values[has_cv] = trial_cvs[ctrial_ixs[has_cv],
+                                               cv_ixs[has_cv]]
+                columns.append(values)
+            yield columns
+
+    @classmethod
+    def _levelSegmentNames(cls):
+        # For each level, find the name of the segment that contains each
+        # data point time; the first matching seg in the level's seg list
+        # (sorted by start time) is used. If no seg matched a data point at
+        # a level, none is used for it at lower levels either. Returns a
+        # list with the segment name array of each level, and the number of
+        # levels that have a segment name for each data point.
+        ss = cls.project.segmenttree
+        lvls = range(1,ss.getLevelCount()+1)
 
-        for i in xrange(pendata.shape[0]):
-            dp=pendata[i]
-
-
-            rowdata = [sfile,i,dp['time'],dp['x'],dp['y'],dp['pressure'],
-                       convertSampleStateValue(dp['state']), catname]
-
-            # Go through segment levels finding matching seg at each level for
-            # current data point. Use '' for levels where no seg matched
-            # data point time, otherwise use segment name.
-            for l in lvls:
-                dpsegname=cls.missingval
-                for seg in segs_by_lvl[l]:
-                    if seg.contains(time=dp['time']):
-                        dpsegname=seg.name
-                        break
-                # If no seg was found at this level, none will exist at lower
-                # levels for this point, so break the loop. Remaining col vals
-                # will automatically be filled in by ReportExporter
-                if dpsegname == cls.missingval:
-                    break
-                rowdata.append(dpsegname)
+        times = cls.project.pendata['time']
+        sample_count = times.shape[0]
+        lvl_names = []
+        lvl_found_counts = np.zeros(sample_count, dtype=np.int32)
+        found_at_lvl = np.ones(sample_count, dtype=bool)
+        for l in lvls:
+            segs = ss.getLevelSegments(l)
+            seg_ixs = cls._segmentLabels(times, l)
+            found_at_lvl &= seg_ixs >= 0
+            lvl_found_counts += found_at_lvl
+            seg_names = np.asarray([seg.name for seg in segs]+[cls.missingval],
+                                   dtype=object)
+            lvl_names.append(seg_names[seg_ixs])
+        return lvl_names, lvl_found_counts
 
-            if cvcolcount:
-                tcv=cls.project.getTrialConditionsForSample(i)
-                if tcv is not None:  
-                    rowdata.extend(tcv)
-                else:
-                    rowdata.extend([cls.missingval for i in range(cvcolcount)])
-            yield rowdata
+    @classmethod
+    def _segmentLabels(cls, times, level):
+        # Return the index in the level's seg list of the first segment that
+        # contains each pen sample time, or -1 if no segment contains the
+        # sample. Found with binary searches of the segment tree index.
+        return cls.project.segmenttree.getLevelSegmentIndexesAtTimes(times,
+                                                                     level)
 
+    @classmethod
+    def _trialConditionLabels(cls):
+        # Return an array with the index into the returned list of trial
+        # condition values to use for each pen sample, and the list of
+        # trial condition values (as returned by
+        # project.getTrialConditionsForSample()). Samples that are not in a
+        # trial have an index of -1.
+        project = cls.project
+        trial_ixs = np.empty(project.pendata.shape[0], dtype=np.int32)
+        trial_ixs.fill(-1)
+        trial_cvs = []
+        tbounds = project.trial_boundaries
+        if len(tbounds) > 0 and len(project.trial_cond_vars) > 0:
+            cvrow_ixs = sorted(set(tbounds['cvrow_ix']))
+            for cvrow_ix in cvrow_ixs:
+                tcv = []
+                for c in list(project.trial_cond_vars[cvrow_ix]):
+                    if isinstance(c, str):
+                        c = c.decode('utf-8')
+                    tcv.append(c)
+                trial_cvs.append(tcv)
+            cvrow_ixs = dict((cvrow_ix, i) for i, cvrow_ix in enumerate(cvrow_ixs))
+            # Same as for segments, the first matching trial is used.
+            for tb in tbounds[::-1]:
+                if tb['start_ix'] <= tb['end_ix']:
+                    trial_ixs[tb['start_ix']:tb['end_ix']+1] = cvrow_ixs[tb['cvrow_ix']]
+        return trial_ixs, trial_cvs
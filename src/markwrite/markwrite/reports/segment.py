@@ -81,8 +81,8 @@ class SegmentLevelReportExporter(ReportExporter):
         catname = segment_tree.name
         filename=catname=segment_tree.name
 
-        for level_num, segment_list in cls.project.segmenttree.getLeveledSegments().items():
-            for segment in segment_list:
+        for level_num in segment_tree.segmentindex.levels():
+            for segment in segment_tree.getLevelSegments(level_num):
                 # Some QString's seem to be slipping through
                 # so convert all to unicode str. This could be optimized.
                 splist = [u"{}".format(sl) for sl in segment.path]
@@ -96,9 +96,10 @@ class SegmentLevelReportExporter(ReportExporter):
                 prev_penpress_time=''
                 next_penpress_time=''
                 if start_index>0:
-                    prev_non_zeros = pendata['time'][0:start_index][pendata['pressure'][0:start_index] > 0]
-                    if prev_non_zeros.shape[0]>0:                    
-                        prev_penpress_time = prev_non_zeros[-1]
+                    # Number of pen press samples before start_index.
+                    pix = np.searchsorted(nonzero_pressure_ixs, start_index, side='left')
+                    if pix>0:
+                        prev_penpress_time = pendata['time'][nonzero_pressure_ixs[pix-1]]
                 if end_index < pointcount-1:
                     nix = np.searchsorted(nonzero_pressure_ixs, end_index, side='left')+1
                     if nix >= nonzero_pressure_ixs.shape[0]:
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Binary report file formats that ReportExporter.export() can save a report
+to instead of a tab delimited text file:
+
+    * 'hdf5': A PyTables file with the report saved as the compressed
+              table /report. The report label is used as the table title,
+              and the preamble and column names are saved as the table
+              attributes 'preamble' and 'column_names'. Table column names
+              must be ASCII, so other characters in a column name are
+              replaced by backslash escapes.
+    * 'npz':  A numpy .npz file with one array for each report column.
+    * 'npy':  A numpy .npy file holding one structured array, with a field
+              for each report column.
+
+The type of each report column is taken from the values of the first block
+of data rows. Integer, unsigned integer, boolean and float columns keep
+their numpy type. Integer and boolean columns with missing values in the
+first block are saved as float64 columns, and missing values of float
+columns are saved as NaN. All other columns are saved as utf-8 encoded
+strings, formatted the same way as in a text report. A report without data
+rows is saved with a zero length string column for each report column.
+"""
+import zipfile
+from cStringIO import StringIO
+
+import numpy as np
+
+def _fieldname(cname, encoding='utf-8'):
+    # numpy field names must be str in python 2.
+    if isinstance(cname, unicode):
+        return cname.encode(encoding, 'backslashreplace')
+    return cname
+
+def blockcolumn(exporter, values, rowcount):
+    """
+    Return (values, mask) for the values of one report column in a data
+    block, where values is a 1D ndarray (or None if the column has no
+    values) and mask is a bool array that is True for missing values (or
+    None if no values are missing).
+    """
+    if values is None:
+        return None, np.ones(rowcount, dtype=bool)
+    if isinstance(values, np.ma.MaskedArray):
+        return values.data, np.ma.getmaskarray(values)
+    if isinstance(values, np.ndarray):
+        return values, None
+
+    # A list or tuple of values, possibly with missingval elements as
+    # returned by .datarows().
+    missingval = exporter.missingval
+    mask = np.fromiter((isinstance(v, basestring) and v == missingval
+                        for v in values), dtype=bool, count=rowcount)
+    if mask.any():
+        present = [v for v, m in zip(values, mask) if not m]
+        if not present:
+            return None, mask
+        present = _valuearray(present)
+        column = np.zeros(rowcount, dtype=present.dtype)
+        column[~mask] = present
+        return column, mask
+    return _valuearray(values), None
+
+def _valuearray(values):
+    # 1D array of a sequence of values. Sequences of lists are saved as an
+    # object array instead of a 2D array.
+    column = np.asarray(values)
+    if column.ndim != 1:
+        column = np.empty(len(values), dtype=object)
+        for i, v in enumerate(values):
+            column[i] = v
+    return column
+
+def columndtype(values, mask):
+    """
+    Return the numpy dtype to use for a report column, given the
+    blockcolumn() values and mask of the column in the first data block.
+    None is returned for columns that are saved as strings.
+    """
+    if values is None or values.dtype.kind not in 'biuf':
+        return None
+    if values.dtype.kind != 'f' and mask is not None and mask.any():
+        return np.dtype(np.float64)
+    return values.dtype
+
+def typedcolumn(exporter, cname, values, mask, dtype, rowcount):
+    """
+    Return the blockcolumn() values and mask of a report column as an
+    array of the column's columndtype().
+    """
+    if dtype is None:
+        if values is None:
+            svalues = [exporter.missingval]*rowcount
+        elif mask is not None:
+            svalues = exporter._formatcolumn(cname,
+                                             np.ma.masked_array(values, mask))
+        else:
+            svalues = exporter._formatcolumn(cname, values)
+        return np.array([s.encode('utf-8') for s in svalues], dtype=np.bytes_)
+
+    if mask is None or not mask.any():
+        return np.asarray(values, dtype=dtype)
+    if dtype.kind != 'f':
+        raise ValueError(u"Report column {} has missing values, but is "
+                         u"saved as a {} column.".format(cname, dtype))
+    if values is None:
+        column = np.empty(rowcount, dtype=dtype)
+    else:
+        column = np.array(values, dtype=dtype)
+    column[mask] = np.nan
+    return column
+
+class ReportSink(object):
+    """
+    Base class of the binary report file formats. A sink is created for
+    each report saved. write() is called with the typed report columns of
+    each data block, in column name order, and close() is called once
+    all blocks have been written.
+    """
+    file_extension = None
+
+    def __init__(self, file_path, column_names, title=u'', preamble=u'',
+                 expectedrows=0):
+        self.file_path = file_path
+        self.column_names = column_names
+        self.title = title
+        self.preamble = preamble
+        self.expectedrows = expectedrows
+
+    def write(self, columns):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def _emptycolumns(self):
+        # Report columns of a report without data rows. There are no values
+        # to take the column types from, so all columns are string columns,
+        # the same as columns that have no values in the first data block.
+        return [np.zeros(0, dtype='S1') for cname in self.column_names]
+
+class Hdf5ReportSink(ReportSink):
+    file_extension = u'.hdf5'
+    table_name = 'report'
+    filters = dict(complevel=5, complib='zlib', shuffle=True)
+
+    def __init__(self, file_path, column_names, title=u'', preamble=u'',
+                 expectedrows=0):
+        ReportSink.__init__(self, file_path, column_names, title, preamble,
+                            expectedrows)
+        import tables
+        self.hdf = tables.openFile(file_path, 'w', title=title)
+        self.table = None
+
+    def _createtable(self, dtype, name):
+        import tables
+        table = self.hdf.createTable('/', name, dtype, title=self.title,
+                                     filters=tables.Filters(**self.filters),
+                                     expectedrows=max(self.expectedrows, 1))
+        table.attrs.preamble = self.preamble
+        table.attrs.column_names = list(self.column_names)
+        return table
+
+    def write(self, columns):
+        dtype = self._tabledtype(columns)
+        if self.table is None:
+            self.table = self._createtable(dtype, self.table_name)
+        else:
+            self._widenstrings(dtype)
+
+        rows = np.empty(len(columns[0]), dtype=self.table.dtype)
+        for fname, c in zip(rows.dtype.names, columns):
+            rows[fname] = c
+        self.table.append(rows)
+
+    def _tabledtype(self, columns):
+        return np.dtype([(_fieldname(cname, 'ascii'), c.dtype) for cname, c
+                         in zip(self.column_names, columns)])
+
+    def _widenstrings(self, dtype):
+        # Table string columns have a fixed width. If a block has a longer
+        # string than the table column can hold, copy the table to one
+        # with wider string columns.
+        tdtype = self.table.dtype
+        descr = []
+        widen = False
+        for fname in tdtype.names:
+            ft = tdtype[fname]
+            bt = dtype[fname]
+            if ft.kind == 'S' and bt.itemsize > ft.itemsize:
+                ft = bt
+                widen = True
+            descr.append((fname, ft))
+        if not widen:
+            return
+        wide_dtype = np.dtype(descr)
+        old_table = self.table
+        new_table = self._createtable(wide_dtype, self.table_name+'_widened')
+        chunk_size = 100000
+        for i in range(0, old_table.nrows, chunk_size):
+            new_table.append(old_table.read(i, i+chunk_size).astype(wide_dtype))
+        self.hdf.removeNode(old_table)
+        self.hdf.renameNode(new_table, self.table_name)
+        self.table = new_table
+
+    def close(self):
+        if self.table is None and self.column_names:
+            self.table = self._createtable(
+                self._tabledtype(self._emptycolumns()), self.table_name)
+        if self.table is not None:
+            self.table.flush()
+        self.hdf.close()
+
+class NpzReportSink(ReportSink):
+    file_extension = u'.npz'
+
+    def __init__(self, file_path, column_names, title=u'', preamble=u'',
+                 expectedrows=0):
+        ReportSink.__init__(self, file_path, column_names, title, preamble,
+                            expectedrows)
+        self.blocks = []
+
+    def write(self, columns):
+        self.blocks.append(columns)
+
+    def _columns(self):
+        # The full report columns. String columns get the width of the
+        # longest value of any block.
+        if not self.blocks:
+            return self._emptycolumns()
+        columns = [np.concatenate(cblocks) for cblocks in zip(*self.blocks)]
+        self.blocks = []
+        return columns
+
+    def close(self):
+        # Written the same way as numpy.savez_compressed(), which can not
+        # be used for reports with a column called 'file'.
+        columns = self._columns()
+        zf = zipfile.ZipFile(self.file_path, 'w', zipfile.ZIP_DEFLATED,
+                             allowZip64=True)
+        try:
+            for cname, c in zip(self.column_names, columns):
+                f = StringIO()
+                np.lib.format.write_array(f, c)
+                zf.writestr(_fieldname(cname)+'.npy', f.getvalue())
+        finally:
+            zf.close()
+
+class NpyReportSink(NpzReportSink):
+    file_extension = u'.npy'
+
+    def close(self):
+        columns = self._columns()
+        dtype = np.dtype([(_fieldname(cname), c.dtype) for cname, c
+                          in zip(self.column_names, columns)])
+        rows = np.empty(len(columns[0]) if columns else 0, dtype=dtype)
+        for fname, c in zip(dtype.names, columns):
+            rows[fname] = c
+        with open(self.file_path, 'wb') as f:
+            np.save(f, rows)
+
+REPORT_SINKS = dict(hdf5=Hdf5ReportSink,
+                    npz=NpzReportSink,
+                    npy=NpyReportSink)
@@ -20,8 +20,154 @@ from collections import OrderedDict
 from operator import attrgetter
 from weakref import proxy, ProxyType,WeakValueDictionary
 import numpy as np
-from markwrite.gui.projectsettings import SETTINGS
-from markwrite.gui import X_FIELD, Y_FIELD
+from markwrite.settings import SETTINGS
+from markwrite.util import X_FIELD, Y_FIELD
+from markwrite.file_io import PenSampleColumns
+
+class SegmentTreeIndex(object):
+    """
+    SegmentTreeIndex keeps track of the segments in a project segment tree
+    by segment level and time range. The root PenDataSegmentCategory of a
+    segment tree creates the index, and segments are added to and removed
+    from it by PenDataSegmentCategory.addChild() and .removeChild().
+
+    For each level, the segments are kept sorted by start time, together
+    with arrays of their start times, end times and the running maximum of
+    their end times. These are rebuilt the first time a level is queried
+    after it has changed. A time query then needs two binary searches, and
+    only checks the segments that can contain the time period searched for.
+    """
+    def __init__(self):
+        # level -> {segment id: segment}
+        self._levelsegs = dict()
+        # level -> (sorted segments, start times, end times, max end times)
+        self._sortedlevels = dict()
+
+    def add(self, segment, level):
+        """
+        Add segment, and any child segments it has, to the index.
+
+        :param segment: PenDataSegment
+        :param level: int: the level of segment in the segment tree.
+        :return: None
+        """
+        self._levelsegs.setdefault(level, dict())[segment.id] = segment
+        self._sortedlevels.pop(level, None)
+        for c in segment.children:
+            self.add(c, level+1)
+
+    def remove(self, segment, level):
+        """
+        Remove segment, and any child segments it has, from the index.
+
+        :param segment: PenDataSegment
+        :param level: int: the level of segment in the segment tree.
+        :return: None
+        """
+        lsegs = self._levelsegs.get(level)
+        if lsegs and lsegs.pop(segment.id, None) is not None:
+            self._sortedlevels.pop(level, None)
+            if not lsegs:
+                del self._levelsegs[level]
+        for c in segment.children:
+            self.remove(c, level+1)
+
+    def invalidate(self, level):
+        """
+        Must be called when the time range of a segment at level changes.
+        """
+        self._sortedlevels.pop(level, None)
+
+    def levels(self):
+        """
+        Return a sorted list of the levels that have at least one segment.
+
+        :return: list of int
+        """
+        return sorted(self._levelsegs.keys())
+
+    def _sortedlevel(self, level):
+        sl = self._sortedlevels.get(level)
+        if sl is None:
+            segs = sorted(self._levelsegs.get(level, {}).values(),
+                          key=lambda s: (s.starttime, s.endtime, s.id))
+            starts = np.asarray([s.starttime for s in segs], dtype=np.float64)
+            ends = np.asarray([s.endtime for s in segs], dtype=np.float64)
+            maxends = np.maximum.accumulate(ends) if len(segs) else ends
+            sl = segs, starts, ends, maxends
+            self._sortedlevels[level] = sl
+        return sl
+
+    def levelSegments(self, level):
+        """
+        Return a list of the segments at level, sorted by start time.
+
+        :param level: int
+        :return: list of PenDataSegment
+        """
+        return list(self._sortedlevel(level)[0])
+
+    def overlapping(self, starttime, endtime, level=None):
+        """
+        Return a list of the segments that have at least one time in the
+        starttime to endtime period (inclusive). If level is None, the
+        segments of all levels are returned, ordered by level. Segments of a
+        level are ordered by start time.
+
+        :param starttime: float
+        :param endtime: float
+        :param level: int or None
+        :return: list of PenDataSegment
+        """
+        if level is None:
+            found = []
+            for l in self.levels():
+                found.extend(self.overlapping(starttime, endtime, l))
+            return found
+
+        segs, starts, ends, maxends = self._sortedlevel(level)
+        # Segments before lo all end before starttime, and segments from
+        # hi on all start after endtime.
+        lo = np.searchsorted(maxends, starttime, side='left')
+        hi = np.searchsorted(starts, endtime, side='right')
+        return [segs[i] for i in xrange(lo, hi) if ends[i] >= starttime]
+
+    def containing(self, time, level=None):
+        """
+        Return a list of the segments with starttime <= time <= endtime.
+        If level is None, the segments of all levels are returned, ordered
+        by level.
+
+        :param time: float
+        :param level: int or None
+        :return: list of PenDataSegment
+        """
+        return self.overlapping(time, time, level)
+
+    def firstContaining(self, times, level):
+        """
+        Return an int array with the index, in levelSegments(level), of the
+        first segment that contains each time in the times array, or -1 for
+        times that no segment at level contains.
+
+        :param times: ndarray of float
+        :param level: int
+        :return: ndarray of int32
+        """
+        segs, starts, ends, maxends = self._sortedlevel(level)
+        times = np.asarray(times)
+        if not len(segs):
+            seg_ixs = np.empty(times.shape, dtype=np.int32)
+            seg_ixs.fill(-1)
+            return seg_ixs
+        # The first segment with an end time >= time is the segment where
+        # the running maximum end time reaches time. It contains time if it
+        # starts at or before time; if it does not, no segment after it
+        # starts early enough, and none before it ends late enough.
+        ixs = np.searchsorted(maxends, times, side='left')
+        found = ixs < len(segs)
+        found[found] = starts[ixs[found]] <= times[found]
+        return np.where(found, ixs, -1).astype(np.int32)
 
 class PenDataSegmentCategory(object):
     """
@@ -75,6 +221,12 @@ class PenDataSegmentCategory(object):
         self._childsegments = []
         self._childsegment_ids=[]
 
+        # The root segment of a segment tree holds the SegmentTreeIndex
+        # for all the segments in the tree.
+        self._segmentindex = None
+        if parent is None:
+            self._segmentindex = SegmentTreeIndex()
+
         # If a segment is locked, it can not be deleted or modified.
         self._locked=False
 
@@ -220,6 +372,9 @@ class PenDataSegmentCategory(object):
         self._childsegments = sorted(self._childsegments, key=attrgetter('starttime'))
         self._childsegment_ids.insert(self._childsegments.index(s),s.id)
         PenDataSegmentCategory.totalsegmentcount+=1
+        segindex = self.segmentindex
+        if segindex is not None:
+            segindex.add(s, self.level+1)
 
     def removeChild(self, s):
         """
@@ -233,6 +388,78 @@ class PenDataSegmentCategory(object):
         self._childsegment_ids.remove(s.id)
         self._childsegments.pop(seg_index)
         PenDataSegmentCategory.totalsegmentcount-=1
+        segindex = self.segmentindex
+        if segindex is not None:
+            segindex.remove(s, self.level+1)
+
+    @property
+    def segmentindex(self):
+        """
+        Return the SegmentTreeIndex of the segment tree that the current
+        segment is part of.
+
+        :return: SegmentTreeIndex
+        """
+        return self.getRoot()._segmentindex
+
+    def getLevelSegments(self, level):
+        """
+        Return a list of all the segments at the given level of the project
+        segment tree, regardless of parent, sorted by segment start time.
+
+        :param level: int
+        :return: list of PenDataSegment objects
+        """
+        return self.segmentindex.levelSegments(level)
+
+    def getSegmentsAtTime(self, time, level=None):
+        """
+        Return a list of the segments in the project segment tree that
+        contain the sec.msec time, i.e. starttime <= time <= endtime.
+        If level is None, segments from all levels are returned, ordered by
+        level; otherwise only the segments at the given level are returned.
+
+        :param time: float
+        :param level: int or None
+        :return: list of PenDataSegment objects
+        """
+        return self.segmentindex.containing(time, level)
+
+    def getSegmentsAtSampleIndex(self, ix, level=None):
+        """
+        Return a list of the segments in the project segment tree that
+        contain the pen sample at index ix of project.pendata.
+        See getSegmentsAtTime().
+
+        :param ix: int
+        :param level: int or None
+        :return: list of PenDataSegment objects
+        """
+        return self.getSegmentsAtTime(self._project.pendata['time'][ix], level)
+
+    def getSegmentsInTimePeriod(self, starttime, endtime, level=None):
+        """
+        Return a list of the segments in the project segment tree that
+        overlap the starttime to endtime period. See getSegmentsAtTime().
+
+        :param starttime: float
+        :param endtime: float
+        :param level: int or None
+        :return: list of PenDataSegment objects
+        """
+        return self.segmentindex.overlapping(starttime, endtime, level)
+
+    def getLevelSegmentIndexesAtTimes(self, times, level):
+        """
+        Return an int array with the index, in getLevelSegments(level), of
+        the first segment that contains each sec.msec time in the times
+        array, or -1 for times that are not in a segment at level.
+
+        :param times: ndarray of float
+        :param level: int
+        :return: ndarray of int32
+        """
+        return self.segmentindex.firstContaining(times, level)
 
     @property
     def parent(self):
@@ -401,7 +628,7 @@ class PenDataSegmentCategory(object):
             p = p.parent
         return lvl
 
-    def getLevelCount(self, curlvl=None, visitedlvls=[]):
+    def getLevelCount(self, curlvl=None, visitedlvls=None):
         """
         Return the maximum level depth in the project segment tree.
 
@@ -409,7 +636,11 @@ class PenDataSegmentCategory(object):
         """
         if curlvl is None:
             curlvl=self.level
+            if self._segmentindex is not None:
+                return max([curlvl]+self._segmentindex.levels())
 
+        if visitedlvls is None:
+            visitedlvls = []
         if curlvl not in visitedlvls:
             visitedlvls.append(curlvl)
 
@@ -430,23 +661,20 @@ class PenDataSegmentCategory(object):
         if curlvl is None:
             curlvl=self.level+1
 
-        if not segsbylvl.has_key(curlvl):
-            segsbylvl[curlvl]=[]
-            
         if self.parent:
             lsegs=[]
             for c in self.parent.children:
                 lsegs+=c.children
-            for s in lsegs:
-                if s not in segsbylvl[curlvl]: 
-                    segsbylvl[curlvl].append(s)
         else:
-            for s in list(self.children):
-                if s not in segsbylvl[curlvl]: 
-                    segsbylvl[curlvl].append(s)
+            lsegs=list(self.children)
+        segsbylvl.setdefault(curlvl, []).extend(lsegs)
 
-        for c in self.children:
-            c.getLeveledSegments(curlvl+1,segsbylvl)
+        # Segments at each lower level, ordered by parent.
+        lsegs = self.children
+        while lsegs:
+            curlvl+=1
+            lsegs = [s for c in lsegs for s in c.children]
+            segsbylvl.setdefault(curlvl, []).extend(lsegs)
 
         return segsbylvl
 
@@ -559,6 +787,17 @@ class PenDataSegmentCategory(object):
         :return:
         """
         pendata = cls._project.pendata
+        ix_range = cls._project.getTimePeriodIndexRange(starttime, endtime)
+        if ix_range is not None:
+            start_ix, end_ix = ix_range
+            if SETTINGS['new_segment_trim_0_pressure_points']:
+                nonzero_ixs = np.nonzero(pendata['pressure'][start_ix:end_ix] > 0)[0]
+                if nonzero_ixs.shape[0]>0:
+                    return start_ix+nonzero_ixs[[0,-1]]
+            elif end_ix > start_ix:
+                return np.asarray([start_ix, end_ix-1])
+            return []
+
         mask = None
         if SETTINGS['new_segment_trim_0_pressure_points']:
             mask = (pendata['time'] >= starttime) & (pendata['time'] <=endtime) & (pendata['pressure'] > 0)
@@ -605,16 +844,23 @@ class PenDataSegmentCategory(object):
         """
         if parent is None:
             seg = PenDataSegmentCategory(name=d['_name'], project=project, id=d['id'])
-            PenDataSegmentCategory.totalsegmentcount=d['totalsegmentcount']
         else:
-            pd = parent.project.getPenDataForTimePeriod(*d['timerange'])
-            seg = PenDataSegment(name=d['_name'], pendata=pd, parent=parent, fulltimerange=d['timerange'], id=d['id'])
+            # Segments saved before start_ix and end_ix were added find
+            # their samples from the segment time range.
+            ix_range = None
+            pd = None
+            if d.get('start_ix') is not None:
+                ix_range = d['start_ix'], d['end_ix']
+            else:
+                pd = parent.project.getPenDataForTimePeriod(*d['timerange'])
+            seg = PenDataSegment(name=d['_name'], pendata=pd, parent=parent, fulltimerange=d['timerange'], id=d['id'], ix_range=ix_range)
 
-        seg._childsegment_ids=d['_childsegment_ids']
         seg._locked=d['_locked']
 
+        # Child segments add themselves to seg's children, child ids and the
+        # segment tree index, and update totalsegmentcount.
         for cs in d['child_segments']:
-           seg._childsegments.append(PenDataSegment.fromDict(cs, project, seg))
+           PenDataSegment.fromDict(cs, project, seg)
 
         return seg
 
@@ -649,7 +895,11 @@ class PenDataSegment(PenDataSegmentCategory):
     PenDataSegmentCategory class, all segments within a project are instances of
     PenDataSegment.
     """
-    def __init__(self, name=None, pendata=None, parent=None, fulltimerange=None, id=None):
+    _serialize_attributes=PenDataSegmentCategory._serialize_attributes+(
+                            'start_ix',
+                            'end_ix'
+                          )
+    def __init__(self, name=None, pendata=None, parent=None, fulltimerange=None, id=None, ix_range=None):
         """
         PenDataSegment class is used when a segment is created within the
         MarkWrite App.
@@ -657,6 +907,13 @@ class PenDataSegment(PenDataSegmentCategory):
         `pendata` is a slice from the `project.pendata` ndarray, containing
         only the samples that fall within the segments time period.
 
+        The segment only stores the (start_ix, end_ix) index range of its
+        samples in `project.pendata`, given by `ix_range` or found from
+        `pendata` when it is a view of `project.pendata`; the segment
+        `pendata` property then returns the `project.pendata[start_ix:end_ix]`
+        view. If `pendata` is not a view of `project.pendata`, the segment
+        keeps the `pendata` array itself.
+
         If `fulltimerange` arg is provided, the segments `starttime` , `endtime`
         properties equal fulltimerange[0] , fulltimerange[1], otherwise the
         segments `starttime` equals `pendata['time'][0]` and `endtime` equals
@@ -667,27 +924,85 @@ class PenDataSegment(PenDataSegmentCategory):
         :param parent: PenDataSegment: proxy to the parent segment
         :param fulltimerange: [float, float] or None: Exact start and end times to use for the segment.
         :param id: int: Segment id. Only used when recreating segments from a saved .mpw file.
+        :param ix_range: (int, int) or None: (start_ix, end_ix) index range of the segment's samples in project.pendata.
         :return: PenDataSegment
         """
         PenDataSegmentCategory.__init__(self,name, parent, False, id=id)
 
+        self._ix_range = None
+        self._pendata = None
+        if ix_range is not None:
+            self._ix_range = int(ix_range[0]), int(ix_range[1])
+        else:
+            self.pendata = pendata
+
         if fulltimerange is None:
-            fulltimerange = pendata['time'][[0,-1]]
+            fulltimerange = self.pendata['time'][[0,-1]]
         self._timerange = fulltimerange
 
         if self._name is None:
             self._name="Segment %d"%(self._id)
 
-        self._pendata=pendata
-
         self.tableprops = None
 
         parent.addChild(self)
 
     @property
     def pendata(self):
+        if self._ix_range is not None:
+            start_ix, end_ix = self._ix_range
+            return self._project.pendata[start_ix:end_ix]
         return self._pendata
 
+    @property
+    def start_ix(self):
+        """
+        Index of the segment's first sample in project.pendata, or None if
+        the segment samples are not a contiguous range of project.pendata.
+
+        :return: int or None
+        """
+        if self._ix_range is not None:
+            return self._ix_range[0]
+
+    @property
+    def end_ix(self):
+        """
+        Index after the segment's last sample in project.pendata, so that
+        segment.pendata is project.pendata[start_ix:end_ix]. None if the
+        segment samples are not a contiguous range of project.pendata.
+
+        :return: int or None
+        """
+        if self._ix_range is not None:
+            return self._ix_range[1]
+
+    @classmethod
+    def _getViewIndexRange(cls, pendata):
+        # Return the (start_ix, end_ix) range of project.pendata that the
+        # pendata array is a view of, or None if it is not such a view.
+        allpendata = cls._project.pendata
+        if isinstance(pendata, PenSampleColumns):
+            return pendata.viewIndexRange(allpendata)
+        if not isinstance(pendata, np.ndarray) or pendata.ndim != 1 or \
+                not isinstance(allpendata, np.ndarray) or \
+                pendata.dtype != allpendata.dtype:
+            return None
+        itemsize = allpendata.dtype.itemsize
+        if pendata.shape[0] > 1 and pendata.strides[0] != itemsize:
+            return None
+        if not np.may_share_memory(pendata, allpendata) and pendata.shape[0]:
+            return None
+        offset = (pendata.__array_interface__['data'][0] -
+                  allpendata.__array_interface__['data'][0])
+        if offset < 0 or offset % itemsize:
+            return None
+        start_ix = offset//itemsize
+        end_ix = start_ix+pendata.shape[0]
+        if end_ix > allpendata.shape[0]:
+            return None
+        return start_ix, end_ix
+
     @property
     def starttime(self):
         """
@@ -729,10 +1044,17 @@ class PenDataSegment(PenDataSegmentCategory):
     @timerange.setter
     def timerange(self, tr):
         self._timerange = tr
+        segindex = self.segmentindex
+        if segindex is not None:
+            segindex.invalidate(self.level)
 
     @pendata.setter
     def pendata(self, n):
-        self._pendata = n
+        self._ix_range = self._getViewIndexRange(n)
+        if self._ix_range is None:
+            self._pendata = n
+        else:
+            self._pendata = None
 
     def propertiesTableData(self):
         """
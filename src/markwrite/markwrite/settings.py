@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Application settings used by MarkWrite.
+
+SETTINGS holds the current value of each setting, keyed by the setting name.
+It is created from the default values in flattenned_settings_dict and can be
+used without the MarkWrite GUI. When the GUI is running, the settings dialog
+(gui.projectsettings.ProjectSettingsDialog) updates the same SETTINGS dict.
+"""
+from __future__ import division
+from collections import OrderedDict
+
+SETTINGS_DIALOG_SIZE_SETTING = 'gui_settings_dialog_size'
+APP_WIN_SIZE_SETTING = 'gui_app_win_size'
+
+#TODO: min_pressed_count = 3   # Minimum number of > 0 pressure samples in a series must be <= min_series_length
+
+flattenned_settings_dict = OrderedDict()
+
+flattenned_settings_dict['auto_generate_l1segments'] = {'name': 'Enable Level 1 Auto Segmentation', 'type': 'bool', 'value': True}
+
+flattenned_settings_dict['filter_imported_pen_data'] = {'name': 'Filter Imported Pen Data', 'type': 'bool', 'value': False}
+
+flattenned_settings_dict['device_spatial_resolution'] = {'name': 'Spatial (lines/cm)', 'type': 'float', 'value': 100.0, 'limits': (0.0, 1000.0)}
+flattenned_settings_dict['device_temporal_resolution'] = {'name': 'Sampling Rate (Hz)', 'type': 'float', 'value': 0.0, 'limits': (0.0, 1000.0)}
+
+flattenned_settings_dict['hdf5_trial_start_var_select_filter'] = {'name': 'Start Time Options Filter', 'type': 'str', 'value': "DV_*_START"}
+flattenned_settings_dict['hdf5_trial_end_var_select_filter'] = {'name': 'End Time Options Filter', 'type': 'str', 'value':  "DV_*_END"}
+flattenned_settings_dict['hdf5_apply_time_offset_var_select_filter'] = {'name': 'Exp. Time Condition Variables', 'type': 'str', 'value': "DV_*_START,DV_*_END"}
+
+flattenned_settings_dict['new_segment_trim_0_pressure_points'] = {'name': 'Trim 0 Pressure Points', 'type': 'bool', 'value': True}
+flattenned_settings_dict['plotviews_background_color'] = {'name': 'Background Color', 'type': 'color', 'value': (32,32,32), 'tip': "Application Plot's background color. Change will not take effect until the application is restarted."}
+flattenned_settings_dict['plotviews_foreground_color'] =  {'name': 'Foreground Color', 'type': 'color', 'value': (224,224,224), 'tip': "Application Plot's foreground color (axis lines / labels)."}
+flattenned_settings_dict['pen_stroke_boundary_size'] ={'name': 'Stroke Boundary Point Size', 'type': 'int', 'value': 2, 'limits': (0, 5)}
+flattenned_settings_dict['pen_stroke_boundary_color'] =  {'name': 'Motion Stroke Boundary Sample Color', 'type': 'color', 'value': (224,0,224)}
+flattenned_settings_dict['pen_stroke_pause_boundary_color'] =  {'name': 'Pause Stroke Boundary Sample Color', 'type': 'color', 'value': (112,0,112)}
+
+flattenned_settings_dict['timeplot_enable_ymouse'] = {'name': 'Enable Y Axis Pan / Scale with Mouse', 'type': 'bool', 'value': False}
+flattenned_settings_dict['display_timeplot_xtrace'] = {'name': 'Display', 'type': 'bool', 'value': True}
+flattenned_settings_dict['timeplot_xtrace_color'] = {'name': 'Point Color', 'type': 'color', 'value': (170,255,127)}
+flattenned_settings_dict['timeplot_xtrace_size'] ={'name': 'Point Size', 'type': 'int', 'value': 1, 'limits': (1, 5)}
+flattenned_settings_dict['display_timeplot_ytrace'] = {'name': 'Display', 'type': 'bool', 'value': True}
+flattenned_settings_dict['timeplot_ytrace_color'] = {'name': 'Point Color', 'type': 'color', 'value': (0,170,255)}
+flattenned_settings_dict['timeplot_ytrace_size'] ={'name': 'Point Size', 'type': 'int', 'value': 1, 'limits': (1, 5)}
+
+flattenned_settings_dict['display_timeplot_vtrace'] = {'name': 'Display Plot', 'type': 'bool', 'value': False}
+flattenned_settings_dict['timeplot_vtrace_color'] = {'name': 'Point Color', 'type': 'color', 'value': (255,170,100)}
+flattenned_settings_dict['timeplot_vtrace_size'] ={'name': 'Point Size', 'type': 'int', 'value': 1, 'limits': (1, 5)}
+flattenned_settings_dict['display_timeplot_atrace'] = {'name': 'Display Plot', 'type': 'bool', 'value': False}
+flattenned_settings_dict['timeplot_atrace_color'] = {'name': 'Point Color', 'type': 'color', 'value': (100,170,255)}
+flattenned_settings_dict['timeplot_atrace_size'] ={'name': 'Point Size', 'type': 'int', 'value': 1, 'limits': (1, 5)}
+flattenned_settings_dict['spatialplot_invert_y_axis'] = {'name': 'Invert Y Axis', 'type': 'bool', 'value': True}
+flattenned_settings_dict['spatialplot_default_color'] = {'name':'Default Point Color', 'type': 'color', 'value':(224,224,224)}
+flattenned_settings_dict['spatialplot_default_point_size'] = {'name': 'Size', 'type': 'int', 'value': 1, 'limits': (1, 5)}
+flattenned_settings_dict['spatialplot_selectedvalid_color'] = {'name': 'Valid Segment Color', 'type': 'color', 'value':(0,160,0)}
+flattenned_settings_dict['spatialplot_selectedinvalid_color'] ={'name': 'Invalid Segment Color', 'type': 'color', 'value': (160,0,0)}
+flattenned_settings_dict['spatialplot_selectedpoint_size'] = {'name': 'Size', 'type': 'int', 'value': 2, 'limits': (1, 5)}
+
+flattenned_settings_dict['stroke_detect_pressed_runs_only'] = {'name': 'Use Pressed Sample Runs Only', 'type': 'bool', 'value': True}
+flattenned_settings_dict['stroke_detect_min_p2p_sample_count'] = {'name': 'Minimum Stroke Sample Count', 'type': 'int', 'value': 7, 'limits': (1, 50)}
+flattenned_settings_dict['stroke_detect_edge_type'] =  {'name': 'Detect Edge Type', 'type': 'list', 'values': ['none', 'rising', 'falling', 'both'], 'value': 'rising'}
+flattenned_settings_dict['stroke_detect_algorithm'] =  {'name': 'Parsing Algorithm', 'type': 'list', 'values': ['xy_velocity&curvature', 'xy_velocity', 'y_filtered'], 'value': 'S/N Velocity Peak Diff'}
+flattenned_settings_dict['stroke_detect_peak_or_valley'] =  {'name': 'Detect Peaks / Valleys', 'type': 'list', 'values': ['Minima', 'Maxima', 'Minima & Maxima'], 'value': 'Minima'}
+flattenned_settings_dict['stroke_detect_inter_sample_distance'] = {'name': 'Curvature ISD (cm)', 'type': 'float', 'value': 0.1, 'limits': (0.001, 100.0)}
+flattenned_settings_dict['stroke_detect_abs_dalpha_thresh'] = {'name': 'DAlpha Angle Threshold', 'type': 'float', 'value': 40.0, 'limits': (0.0, 180.0)}
+flattenned_settings_dict['stroke_detect_min_stroke_length'] = {'name': 'Minimum Stroke Length (cm)', 'type': 'float', 'value': 0.05, 'limits': (0.001, 100.0)}
+flattenned_settings_dict['stroke_detect_min_stroke_velocity'] = {'name': 'Minimum Stroke Velocity (cm/sec)', 'type': 'float', 'value': 0.5, 'limits': (0.01, 100.0)}
+
+flattenned_settings_dict['series_detect_max_isi_msec'] = {'name': 'Maximum Series ISI (msec)', 'type': 'int', 'value': 0, 'limits': (0, 100)}
+flattenned_settings_dict['series_process_worker_count'] = {'name': 'Series Processing Workers', 'type': 'int', 'value': 1, 'limits': (0, 64), 'tip': "Number of processes used to filter and parse pen sample series when loading data. 0 uses one process per CPU core. 1 processes all series in the application process."}
+flattenned_settings_dict['pendata_format'] = {'name': 'Pen Sample Format', 'type': 'list', 'values': ['standard', 'compact'], 'value': 'standard', 'tip': "'compact' stores the filtered position, velocity and acceleration of each pen sample as float32 instead of float64, and uses narrower sample label ids, reducing project memory use by about a third. Used for data loaded after the setting is changed."}
+flattenned_settings_dict['pendata_layout'] = {'name': 'Pen Sample Layout', 'type': 'list', 'values': ['records', 'columns'], 'value': 'records', 'tip': "'records' stores pen samples as one numpy structured array. 'columns' stores each pen sample field in a separate array, which is faster for operations that use a few fields of many samples. Used for data loaded after the setting is changed."}
+flattenned_settings_dict['pendata_cache_max_mb'] = {'name': 'Pen Data Cache Size (MB)', 'type': 'int', 'value': 1024, 'limits': (0, 1000000), 'tip': "Maximum disk space used to cache imported and processed pen data files, so files that have been opened before open faster. The least recently used files are removed from the cache when it is full. 0 disables the cache."}
+
+flattenned_settings_dict['kbshortcut_create_segment'] = {'name': 'Create Segment', 'type': 'str', 'value': 'Return'}
+flattenned_settings_dict['kbshortcut_delete_segment'] = {'name': 'Delete Segment', 'type': 'str', 'value': 'Ctrl+D'}
+flattenned_settings_dict['kbshortcut_timeplot_increase_mag'] = {'name': 'Increase Timeplot Magnification 2x', 'type': 'str', 'value': 'Ctrl++'}
+flattenned_settings_dict['kbshortcut_timeplot_decrease_mag'] = {'name': 'Decrease Timeplot Magnification 2x', 'type': 'str', 'value': 'Ctrl+-'}
+flattenned_settings_dict['kbshortcut_move_plots_to_selection'] = {'name': 'Reposition Views on Selected Time Period', 'type': 'str', 'value': 'Ctrl+Home'}
+flattenned_settings_dict['kbshortcut_selected_timeperiod_forward'] = {'name': 'Move Selected Time Period Forward', 'type': 'str', 'value': 'PgUp'}
+flattenned_settings_dict['kbshortcut_selected_timeperiod_backward'] = {'name': 'Move Selected Time Period Backward', 'type': 'str', 'value': 'PgDown'}
+#flattenned_settings_dict['kbshortcut_increase_selected_end_time'] = {'name': 'Increase Selected End Time', 'type': 'str', 'value': 'Ctrl+PgUp'}
+#flattenned_settings_dict['kbshortcut_decrease_selected_end_time'] = {'name': 'Decrease Selected End Time', 'type': 'str', 'value': 'Ctrl+PgDown'}
+#flattenned_settings_dict['kbshortcut_increase_selected_start_time'] = {'name': 'Increase Selected Start Time', 'type': 'str', 'value': 'Alt+PgUp'}
+#flattenned_settings_dict['kbshortcut_decrease_selected_start_time'] = {'name': 'Decrease Selected Start Time', 'type': 'str', 'value': 'Alt+PgDown'}
+
+
+flattenned_settings_dict['kbshortcut_select_next_series'] = {'name': 'Select Next Sample Series', 'type': 'str', 'value': 'Alt+Up'}
+flattenned_settings_dict['kbshortcut_select_previous_series'] = {'name': 'Select Previous Sample Series', 'type': 'str', 'value': 'Alt+Down'}
+flattenned_settings_dict['kbshortcut_selection_end_to_next_series_end'] = {'name': 'Move Selection End to Next Series End', 'type': 'str', 'value': 'Alt+Right'}
+flattenned_settings_dict['kbshortcut_selection_end_to_prev_series_end'] = {'name': 'Move Selection End to Previous Series End', 'type': 'str', 'value': 'Alt+Left'}
+flattenned_settings_dict['kbshortcut_selection_start_to_next_series_start'] = {'name': 'Move Selection Start to Next Series Start', 'type': 'str', 'value': 'Alt+Shift+Right'}
+flattenned_settings_dict['kbshortcut_selection_start_to_prev_series_start'] = {'name': 'Move Selection Start to Previous Series Start', 'type': 'str', 'value': 'Alt+Shift+Left'}
+
+flattenned_settings_dict['kbshortcut_select_next_run'] = {'name': 'Select Next Sample Run', 'type': 'str', 'value': 'Ctrl+Up'}
+#flattenned_settings_dict['kbshortcut_select_next_unmarked_run'] =  {'name': 'Select Next Unmarked Run', 'type': 'str', 'value': 'Ctrl+Shift+Up'}
+flattenned_settings_dict['kbshortcut_select_previous_run'] = {'name': 'Select Previous Sample Run', 'type': 'str', 'value': 'Ctrl+Down'}
+flattenned_settings_dict['kbshortcut_selection_end_to_next_run_end'] = {'name': 'Move Selection End to Next Run End', 'type': 'str', 'value': 'Ctrl+Right'}
+flattenned_settings_dict['kbshortcut_selection_end_to_prev_run_end'] = {'name': 'Move Selection End to Previous Run End', 'type': 'str', 'value': 'Ctrl+Left'}
+flattenned_settings_dict['kbshortcut_selection_start_to_next_run_start'] = {'name': 'Move Selection Start to Next Run Start', 'type': 'str', 'value': 'Ctrl+Shift+Right'}
+flattenned_settings_dict['kbshortcut_selection_start_to_prev_run_start'] = {'name': 'Move Selection Start to Previous Run Start', 'type': 'str', 'value': 'Ctrl+Shift+Left'}
+
+flattenned_settings_dict['kbshortcut_select_next_stroke'] = {'name': 'Select Next Stroke', 'type': 'str', 'value': 'Up'}
+#flattenned_settings_dict['kbshortcut_select_next_unmarked_stroke'] = {'name': 'Select Next Unmarked Stroke', 'type': 'str', 'value': 'Shift+Up'}
+flattenned_settings_dict['kbshortcut_select_previous_stroke'] = {'name': 'Select Previous Stroke', 'type': 'str', 'value': 'Down'}
+flattenned_settings_dict['kbshortcut_selection_end_to_next_stroke_end'] = {'name': 'Move Selection End to Next Stroke End', 'type': 'str', 'value': 'Right'}
+flattenned_settings_dict['kbshortcut_selection_end_to_prev_stroke_end'] = {'name': 'Move Selection End to Previous Stroke End', 'type': 'str', 'value': 'Left'}
+flattenned_settings_dict['kbshortcut_selection_start_to_next_stroke_start'] = {'name': 'Move Selection Start to Next Stroke Start', 'type': 'str', 'value': 'Shift+Right'}
+flattenned_settings_dict['kbshortcut_selection_start_to_prev_stroke_start'] = {'name': 'Move Selection Start to Previous Stroke Start', 'type': 'str', 'value': 'Shift+Left'}
+
+
+flattenned_settings_dict['save_settings_to_file'] = {'name': 'Save As', 'type': 'action'}
+flattenned_settings_dict['load_settings_from_file'] = {'name': 'Load', 'type': 'action'}
+
+
+SETTINGS = dict()
+
+def _defaultSettingValue(sdict):
+    value = sdict.get('value')
+    values = sdict.get('values')
+    if values and value not in values:
+        # Same as the settings dialog, which selects the first list item
+        # when the default value is not one of the list values.
+        value = values[0]
+    return value
+
+def resetSettings():
+    """
+    Set SETTINGS to the default value of each setting.
+    """
+    SETTINGS.clear()
+    for key, sdict in flattenned_settings_dict.items():
+        if sdict['type'] != 'action':
+            SETTINGS[key] = _defaultSettingValue(sdict)
+
+def updateSettings(savedstate):
+    """
+    Update SETTINGS using the values in the savedstate dict, which is
+    usually a settings dict that was saved to a settings pickle file.
+    Keys that are not MarkWrite settings are ignored.
+
+    :param savedstate: dict of setting name -> value.
+    :return: None
+    """
+    if not savedstate:
+        return
+    for key, val in savedstate.items():
+        if key in (SETTINGS_DIALOG_SIZE_SETTING, APP_WIN_SIZE_SETTING):
+            SETTINGS[key] = val
+        elif key in SETTINGS:
+            SETTINGS[key] = val
+
+resetSettings()
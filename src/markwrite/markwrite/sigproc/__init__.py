@@ -4,4 +4,5 @@ __author__ = 'Sol'
 from .sample_filter import filter_pen_sample_series
 from .sample_va import calculate_velocity
 from .detect_peaks import detect_peaks
-from .parse_strokes import parse_using_sample_field, parse_velocity_and_curvature
\ No newline at end of file
+from .parse_strokes import parse_using_sample_field, parse_velocity_and_curvature, vc_parse_series
+from .parse_strokes import vc_stale_stage, VC_PARSE_STAGES
\ No newline at end of file
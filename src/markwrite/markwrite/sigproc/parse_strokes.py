@@ -10,22 +10,27 @@ import numpy as np
 from numpy import (sqrt, square, diff, cumsum, append, sign, vectorize,
                    arctan2, pi, where, abs, hypot)                   
 from scipy import signal
-from ..gui.projectsettings import SETTINGS
+from ..settings import SETTINGS
 from . import detect_peaks
 
-def parse_using_sample_field(pen_samples):
+def parse_using_sample_field(pen_samples, settings=None):
     """
     Find stroke boundary positions within pen_samples array. 
     
     pen_samples only contains the sample data for a single sample run
     (as defined by associated settings), not all the pen data.
+
+    settings is a dict using the same keys as the MarkWrite project
+    SETTINGS, which are used if settings is None.
     """
+    if settings is None:
+        settings = SETTINGS
     ppp_minima = None
     
-    edge_type = SETTINGS['stroke_detect_edge_type']
+    edge_type = settings['stroke_detect_edge_type']
     if edge_type == 'none':
         edge_type = None
-    vtype = SETTINGS['stroke_detect_peak_or_valley']
+    vtype = settings['stroke_detect_peak_or_valley']
     # vtype 'Minima' == True        
     valley_types = [True,]
     if vtype == 'Maxima':
@@ -35,16 +40,16 @@ def parse_using_sample_field(pen_samples):
         
     for vt in valley_types:
         if ppp_minima is None:
-            ppp_minima = detect_peaks(pen_samples[SETTINGS['stroke_detect_algorithm']],
+            ppp_minima = detect_peaks(pen_samples[settings['stroke_detect_algorithm']],
                               mph=None,
-                              mpd=SETTINGS[
+                              mpd=settings[
                                   'stroke_detect_min_p2p_sample_count'],
                               edge=edge_type,
                               valley=vt)
         else:
-            ppp_minima2 = detect_peaks(pen_samples[SETTINGS['stroke_detect_algorithm']],
+            ppp_minima2 = detect_peaks(pen_samples[settings['stroke_detect_algorithm']],
                               mph=None,
-                              mpd=SETTINGS[
+                              mpd=settings[
                                   'stroke_detect_min_p2p_sample_count'],
                               edge=edge_type,
                               valley=vt)
@@ -55,24 +60,97 @@ def parse_using_sample_field(pen_samples):
     return ppp_minima
     
 
-_dat = dict()
-temporal_resolution = 0.0
-spatial_resolution = 0.0
-
-def parse_velocity_and_curvature(series, all_series_dat=None, series_id=None):
+def parse_velocity_and_curvature(series, all_series_dat=None, series_id=None,
+                                 settings=None):
     """
     Find stroke boundary positions within series pen samples array. 
     
     series only contains the sample data for a single sample series / run
     (as defined by associated settings), not all the pen data.
+
+    If all_series_dat and series_id are given, the parser diagnostic
+    data for the series is stored in all_series_dat[series_id].
+
+    See vc_parse_series() for the settings param.
     """
-    global _dat, temporal_resolution, spatial_resolution
-    _dat = dict()
+    stroke_bounds, series_dat = vc_parse_series(series, settings)
     if all_series_dat is not None and series_id is not None:
-        all_series_dat[series_id]=_dat
-    spatial_resolution = SETTINGS['device_spatial_resolution']
-    temporal_resolution = SETTINGS['device_temporal_resolution']
+        all_series_dat[series_id] = series_dat
+    return stroke_bounds
+
+# Stages of the velocity & curvature stroke parser, in the order they are
+# run, with the settings each stage uses. The results of a stage only change
+# when its settings, or the settings of an earlier stage, change.
+VC_PARSE_STAGES = (
+    ('filter', ('device_temporal_resolution',)),
+    ('velocity', ('device_spatial_resolution',)),
+    ('extrema', ()),
+    ('dalpha', ('stroke_detect_inter_sample_distance',)),
+    ('classify', ('stroke_detect_abs_dalpha_thresh',
+                  'stroke_detect_min_stroke_length',
+                  'stroke_detect_min_stroke_velocity')),
+)
+
+def vc_stage_settings(settings=None):
+    """
+    Return a list with the tuple of settings values used by each
+    VC_PARSE_STAGES stage.
+    """
+    if settings is None:
+        settings = SETTINGS
+    return [tuple(settings[k] for k in skeys) for sname, skeys in VC_PARSE_STAGES]
+
+def vc_stale_stage(series_dat, settings=None):
+    """
+    Return the index of the first VC_PARSE_STAGES stage that needs to be
+    run again to parse a series with settings, given the series_dat
+    returned by an earlier vc_parse_series() call for the same series.
+    0 is returned if series_dat is None.
+    """
+    if series_dat is None:
+        return 0
+    stage_settings = vc_stage_settings(settings)
+    cached_settings = series_dat.get('stage_settings', [])
+    for i, ssettings in enumerate(stage_settings):
+        if i >= len(cached_settings) or cached_settings[i] != ssettings:
+            return i
+    # Classification results are not kept, so the last stage is always run.
+    return len(stage_settings) - 1
+
+def vc_parse_series(series, settings=None, cache=None):
+    """
+    Velocity & curvature stroke parser for a single pen sample series / run.
+
+    settings is a dict using the same keys as the MarkWrite project
+    SETTINGS, which are used if settings is None. Only the device_* and
+    stroke_detect_* values are read.
+
+    cache is the series_dat returned by an earlier call for the same
+    series, or None. Parser stages whose settings have not changed since
+    that call are not run again (see VC_PARSE_STAGES), so changing a
+    stroke classification threshold only reruns the classification stage.
+
+    Returns (stroke_bounds, series_dat), where series_dat is a dict of the
+    diagnostic arrays calculated for the series. The function does not use
+    any module level state, so it can be called for several series at the
+    same time.
+    """
+    if settings is None:
+        settings = SETTINGS
+    first_stage = vc_stale_stage(cache, settings)
+    if first_stage == 0:
+        dat = dict()
+    else:
+        dat = dict(cache)
+    dat['stage_settings'] = vc_stage_settings(settings)
 
+    stroke_bounds = None
+    for sname, skeys in VC_PARSE_STAGES[first_stage:]:
+        stroke_bounds = _VC_STAGE_FUNCS[sname](series, dat, settings)
+    return stroke_bounds, dat
+
+def _vc_filter(series, dat, settings):
+    temporal_resolution = settings['device_temporal_resolution']
     if temporal_resolution == 0.0:
         misi = diff(series['time']).mean()
         temporal_resolution = 1.0 / misi
@@ -80,117 +158,165 @@ def parse_velocity_and_curvature(series, all_series_dat=None, series_id=None):
             print "Warning: Setting resolution to default:", 1.0 / 0.01, len(series)
             misi = 0.01
             temporal_resolution = 1.0 / misi
-    _dat['x.fc5'] = butter_it(series['x'], 5, temporal_resolution)
-    _dat['x.fc10'] = butter_it(series['x'], 10, temporal_resolution)
-    _dat['y.fc5'] = butter_it(series['y'], 5, temporal_resolution)
-    _dat['y.fc10'] = butter_it(series['y'], 10, temporal_resolution)
-    
-    _dat['series_sample_index'] = np.arange(len(series['time'])) 
+    dat['temporal_resolution'] = temporal_resolution
+    dat['x.fc5'], dat['y.fc5'] = butter_xy(series['x'], series['y'], 5,
+                                           temporal_resolution)
+    dat['x.fc10'], dat['y.fc10'] = butter_xy(series['x'], series['y'], 10,
+                                             temporal_resolution)
+    dat['series_sample_index'] = np.arange(len(series['time']))
+
+def _vc_velocity(series, dat, settings):
     # Calculate velocity data
     # NOTE: velocity array index -1 is a copy of index -2 so velocity array 
     # == input array size.
-    (_dat['vx.fc5'], 
-     _dat['vy.fc5'], 
-     _dat['vxy.fc5']) = get_velocity(series['time'], _dat['x.fc5'], _dat['y.fc5'])
-     
-    (_dat['vx.fc10'],
-     _dat['vy.fc10'],
-     _dat['vxy.fc10']) = get_velocity(series['time'], _dat['x.fc10'], _dat['y.fc10'])
-
+    spatial_resolution = settings['device_spatial_resolution']
+    temporal_resolution = dat['temporal_resolution']
+    dat['vxy.fc5'] = get_velocity(series['time'], dat['x.fc5'], dat['y.fc5'],
+                                  spatial_resolution, temporal_resolution)[2]
+    dat['vxy.fc10'] = get_velocity(series['time'], dat['x.fc10'],
+                                   dat['y.fc10'], spatial_resolution,
+                                   temporal_resolution)[2]
+
+def _vc_extrema(series, dat, settings):
     # Calculate local minima / maxima for xy velocity fc5 and fc10
     # Extrema are stored as index lists that can be used to access xy_fc*
-    extrema = diff(sign(diff(_dat['vxy.fc10'])))
-    _dat['vxy.fc10.minima'] = (extrema > 0).nonzero()[0] + 1
-    _dat['vxy.fc10.maxima'] = (extrema < 0).nonzero()[0] + 1 
-    extrema = diff(sign(diff(_dat['vxy.fc5'])))
-    _dat['vxy.fc5.minima'] = (extrema > 0).nonzero()[0] + 1
-    _dat['vxy.fc5.maxima'] = (extrema < 0).nonzero()[0] + 1 
+    extrema = diff(sign(diff(dat['vxy.fc10'])))
+    dat['vxy.fc10.minima'] = (extrema > 0).nonzero()[0] + 1
+    dat['vxy.fc10.maxima'] = (extrema < 0).nonzero()[0] + 1 
+    extrema = diff(sign(diff(dat['vxy.fc5'])))
+    dat['vxy.fc5.minima'] = (extrema > 0).nonzero()[0] + 1
+    dat['vxy.fc5.maxima'] = (extrema < 0).nonzero()[0] + 1 
     del extrema
     
     # Assign the first and the last element of a series as an extreme. 
-    fixup_extrema(10)
-    fixup_extrema(5)
+    fixup_extrema(dat, 10)
+    fixup_extrema(dat, 5)
     
-    # Build _dat[vxy.fc*.extrema] arrays,
+    # Build dat[vxy.fc*.extrema] arrays,
     # where -1 = minima, +1 = maxima, all other elements = 0.
-    _dat['vxy.fc10.extrema'] = np.zeros(len(_dat['vxy.fc10']))
-    _dat['vxy.fc10.extrema'][_dat['vxy.fc10.minima']] = -1
-    _dat['vxy.fc10.extrema'][_dat['vxy.fc10.maxima']] = 1
+    dat['vxy.fc10.extrema'] = np.zeros(len(dat['vxy.fc10']))
+    dat['vxy.fc10.extrema'][dat['vxy.fc10.minima']] = -1
+    dat['vxy.fc10.extrema'][dat['vxy.fc10.maxima']] = 1
 
-    _dat['vxy.fc5.extrema'] = np.zeros(len(_dat['vxy.fc5']))
-    _dat['vxy.fc5.extrema'][_dat['vxy.fc5.minima']] = -1
-    _dat['vxy.fc5.extrema'][_dat['vxy.fc5.maxima']] = 1
+    dat['vxy.fc5.extrema'] = np.zeros(len(dat['vxy.fc5']))
+    dat['vxy.fc5.extrema'][dat['vxy.fc5.minima']] = -1
+    dat['vxy.fc5.extrema'][dat['vxy.fc5.maxima']] = 1
 
-    # Get nearest fc10_max to each fc5_max
-    def find_nearest_maxfc10(value):
-        return find_nearest(_dat['vxy.fc10.maxima'], value)
-
-    # Any indices MISSING from NN are supernumerous maxima vxy.fc10 point.
-    #NN = vectorize(find_nearest_maxfc10)(_dat['vxy.fc5.maxima'])
+    # Only the fc10 minima are used by later stages.
+    del dat['vxy.fc10.maxima']
+    del dat['vxy.fc5.minima']
+    del dat['vxy.fc5.maxima']
 
+def _vc_dalpha(series, dat, settings):
     ## Calculate DAlpha Extrema
 
     # Approximate dalpha for fc10
-    dalpha = get_dalpha(10)
+    dalpha = get_dalpha(dat, 10, settings['device_spatial_resolution'],
+                        settings['stroke_detect_inter_sample_distance'])
 
-    _dat['vxy.fc10.minima.dalpha'] = np.zeros(len(series['time']), dtype=np.float64)
-    _dat['vxy.fc10.minima.dalpha'][_dat['vxy.fc10.minima']] = dalpha
+    dat['vxy.fc10.minima.dalpha'] = np.zeros(len(series['time']), dtype=np.float64)
+    dat['vxy.fc10.minima.dalpha'][dat['vxy.fc10.minima']] = dalpha
     
-    pre_ix = _dat['vxy.fc10.minima.pre']
-    _dat['vxy.fc10.minima.pre'] = np.zeros(len(series['time']), dtype=np.int)
-    _dat['vxy.fc10.minima.pre'][_dat['vxy.fc10.minima']] = pre_ix
-
-    post_ix = _dat['vxy.fc10.minima.post']
-    _dat['vxy.fc10.minima.post'] = np.zeros(len(series['time']), dtype=np.int)
-    _dat['vxy.fc10.minima.post'][_dat['vxy.fc10.minima']] = post_ix
-    
-    # Get candidate stroke_minima boundaries that pass abs_dalpha_thresh.        
-    filtered_series_minima = _dat['vxy.fc10.minima'][abs(dalpha) > SETTINGS['stroke_detect_abs_dalpha_thresh']]
-    #filtered_series_maxima = _dat['vxy.fc10.maxima'][NN]
-
-    _dat['stroke_id'] = np.zeros(len(series['time']), dtype=np.uint32)
-    _dat['stroke_state'] = np.zeros(len(series['time']), dtype=np.int8)
-    _dat['stroke_state'][:] = -1
-   
-    stroke_bounds = assign_stroke_boundaries(series, filtered_series_minima)       
-
-
-    keep_dat_cols = ['x.fc10', 'y.fc10', 'x.fc5', 'y.fc5', 'vxy.fc10', 'vxy.fc5',
-                     'vxy.fc10.extrema', 'vxy.fc5.extrema', 'vxy.fc10.minima.dalpha',
-                     'series_sample_index', 'vxy.fc10.minima.pre',
-                     'vxy.fc10.minima.post']
-
-    for dk in _dat.keys():
-        if dk not in keep_dat_cols:
-            _dat[dk] = None
-            del _dat[dk]
-            
-    return stroke_bounds
+    pre_ix = dat['vxy.fc10.minima.pre']
+    dat['vxy.fc10.minima.pre'] = np.zeros(len(series['time']), dtype=np.int)
+    dat['vxy.fc10.minima.pre'][dat['vxy.fc10.minima']] = pre_ix
+
+    post_ix = dat['vxy.fc10.minima.post']
+    dat['vxy.fc10.minima.post'] = np.zeros(len(series['time']), dtype=np.int)
+    dat['vxy.fc10.minima.post'][dat['vxy.fc10.minima']] = post_ix
+
+def _vc_classify(series, dat, settings):
+    # Get candidate stroke_minima boundaries that pass abs_dalpha_thresh.
+    # Each series minima has its own sample index, so the dalpha of each
+    # minima can be read back from the per sample dalpha array.
+    minima = dat['vxy.fc10.minima']
+    dalpha = dat['vxy.fc10.minima.dalpha'][minima]
+    filtered_series_minima = minima[abs(dalpha) > settings['stroke_detect_abs_dalpha_thresh']]
+
+    return assign_stroke_boundaries(series, filtered_series_minima, dat,
+                                    settings['stroke_detect_min_stroke_length'],
+                                    settings['stroke_detect_min_stroke_velocity'])
+
+_VC_STAGE_FUNCS = dict(filter=_vc_filter,
+                       velocity=_vc_velocity,
+                       extrema=_vc_extrema,
+                       dalpha=_vc_dalpha,
+                       classify=_vc_classify)
 
 # Butterworth filter
+# Low pass filter designs, keyed by (order, frequency, sampling_rate).
+_butter_sos_cache = dict()
+_BUTTER_SOS_CACHE_SIZE = 64
+
+def butter_sos(order, frequency, sampling_rate):
+    """
+    Return the second-order sections of a low pass Butterworth filter.
+    Designs are cached, so each filter is only designed once.
+
+    When the sampling rate is estimated from the sample times of each
+    series, most designs are only used once. Even order filters are
+    therefore built from the filter poles directly, which gives the same
+    sections as signal.butter(..., output='sos') several times faster.
+    """
+    key = (order, frequency, sampling_rate)
+    sos = _butter_sos_cache.get(key)
+    if sos is None:
+        w = 2.0 * (frequency/sampling_rate)#frequency / (sampling_rate / 2.0) # Normalize the frequency
+        if order % 2:
+            sos = signal.butter(order, w, 'low', output='sos')
+        else:
+            # All zeros are at -1. Each section has one conjugate pole
+            # pair, ordered by distance from the unit circle; the first
+            # section has the filter gain.
+            _, poles, gain = signal.butter(order, w, 'low', output='zpk')
+            poles = poles[poles.imag > 0]
+            poles = poles[np.argsort(np.abs(poles))]
+            sos = np.zeros((order//2, 6))
+            sos[:, :3] = 1.0, 2.0, 1.0
+            sos[0, :3] *= gain
+            sos[:, 3] = 1.0
+            sos[:, 4] = -2.0*poles.real
+            sos[:, 5] = (poles*poles.conj()).real
+        if len(_butter_sos_cache) >= _BUTTER_SOS_CACHE_SIZE:
+            # When the sampling rate is estimated per series, most keys
+            # are never used again.
+            _butter_sos_cache.clear()
+        _butter_sos_cache[key] = sos
+    return sos
+
 def butter_it(samples, frequency, sampling_rate):
     """
+    Zero phase low pass filter samples using a 4th order Butterworth filter.
+    samples can be a 1D array, or a 2D array with one series per row.
     """
-    # Pad input array with reflection of first and last [temporal_resolution] 
+    # Pad input array with reflection of first and last [sampling_rate] 
     # elements. e.g. 133, for 133 hz. This way we pad using about 1 second 
     # worth of data at each end of the series.
-    pad_len = min(len(samples), int(temporal_resolution))
-    padding = samples[:pad_len][::-1] #reverse  order
-    padded_data = append(padding, samples)
-    padding = samples[-pad_len:][::-1] #reverse  order
-    padded_data = append(padded_data, padding)
+    sample_count = samples.shape[-1]
+    pad_len = min(sample_count, int(sampling_rate))
+    padded_data = np.empty(samples.shape[:-1]+(sample_count+2*pad_len,),
+                           dtype=np.float64)
+    padded_data[..., pad_len:pad_len+sample_count] = samples
+    padded_data[..., :pad_len] = samples[..., :pad_len][..., ::-1] #reverse  order
+    padded_data[..., pad_len+sample_count:] = samples[..., sample_count-pad_len:][..., ::-1] #reverse  order
     
-    w = 2.0 * (frequency/sampling_rate)#frequency / (sampling_rate / 2.0) # Normalize the frequency
-    #print 'w:',w    
     try:
-        b, a  = signal.butter(4, w, 'low') 
-        return signal.filtfilt(b, a, padded_data, padtype=None)[pad_len:-pad_len]
+        sos = butter_sos(4, frequency, sampling_rate)
+        return signal.sosfiltfilt(sos, padded_data, padtype=None)[..., pad_len:pad_len+sample_count]
     except:
         print 'Warning: Exception filtering samples. Sample length:', samples.shape
         return samples
 
+def butter_xy(x, y, frequency, sampling_rate):
+    """
+    Filter the x and y sample arrays together with butter_it().
+    Returns (x_filtered, y_filtered).
+    """
+    filtered = butter_it(np.vstack((x, y)), frequency, sampling_rate)
+    return filtered[0], filtered[1]
+
 # Calculate velocity of given series
-def get_velocity(t, x, y):
+def get_velocity(t, x, y, spatial_resolution, temporal_resolution):
     dx = (x[1:] - x[:-1]) / spatial_resolution
     dx = append(dx, dx[-1])
     dy = (y[1:] - y[:-1]) / spatial_resolution
@@ -204,43 +330,43 @@ def get_velocity(t, x, y):
     return dx/dt, dy/dt, dxy/dt
 
 
-def fixup_extrema(freq):
+def fixup_extrema(dat, freq):
     max_ix_key = "vxy.fc%d.maxima"%(freq)
     min_ix_key = "vxy.fc%d.minima"%(freq)
     klabel = "vxy.fc%d"%(freq)
     
-    if len(_dat[min_ix_key]) == len(_dat[max_ix_key]) == 0:
+    if len(dat[min_ix_key]) == len(dat[max_ix_key]) == 0:
         # no extrema in series
-        if _dat[klabel][0] > _dat[klabel][-1]:
-            _dat[max_ix_key] = append([0],_dat[max_ix_key])
-            _dat[min_ix_key] = append(_dat[min_ix_key],[len(_dat[klabel])-1])
+        if dat[klabel][0] > dat[klabel][-1]:
+            dat[max_ix_key] = append([0],dat[max_ix_key])
+            dat[min_ix_key] = append(dat[min_ix_key],[len(dat[klabel])-1])
         else:
-            _dat[min_ix_key] = append([0],_dat[min_ix_key])
-            _dat[max_ix_key] = append(_dat[max_ix_key],[len(_dat[klabel])-1])
-    elif len(_dat[min_ix_key]) == 0:
-        _dat[min_ix_key] = append([0],_dat[min_ix_key])
-        _dat[min_ix_key] = append(_dat[min_ix_key],[len(_dat[klabel])-1])
-    elif len(_dat[max_ix_key]) == 0:
-        _dat[max_ix_key] = append([0],_dat[max_ix_key])
-        _dat[max_ix_key] = append(_dat[max_ix_key],[len(_dat[klabel])-1])
+            dat[min_ix_key] = append([0],dat[min_ix_key])
+            dat[max_ix_key] = append(dat[max_ix_key],[len(dat[klabel])-1])
+    elif len(dat[min_ix_key]) == 0:
+        dat[min_ix_key] = append([0],dat[min_ix_key])
+        dat[min_ix_key] = append(dat[min_ix_key],[len(dat[klabel])-1])
+    elif len(dat[max_ix_key]) == 0:
+        dat[max_ix_key] = append([0],dat[max_ix_key])
+        dat[max_ix_key] = append(dat[max_ix_key],[len(dat[klabel])-1])
     else:
         # Extrema exist in series
-        if _dat[max_ix_key][0] < _dat[min_ix_key][0] and _dat[max_ix_key][0] > 0:
-            _dat[min_ix_key] = append([0],_dat[min_ix_key])
-        elif _dat[max_ix_key][0] > _dat[min_ix_key][0] and _dat[min_ix_key][0] > 0:
-            _dat[max_ix_key] = append([0],_dat[max_ix_key])
+        if dat[max_ix_key][0] < dat[min_ix_key][0] and dat[max_ix_key][0] > 0:
+            dat[min_ix_key] = append([0],dat[min_ix_key])
+        elif dat[max_ix_key][0] > dat[min_ix_key][0] and dat[min_ix_key][0] > 0:
+            dat[max_ix_key] = append([0],dat[max_ix_key])
 
-        if _dat[max_ix_key][-1] > _dat[min_ix_key][-1] and _dat[max_ix_key][-1] < len(_dat[klabel])-1:
-            _dat[min_ix_key] = append(_dat[min_ix_key],[len(_dat[klabel])-1])
-        elif _dat[max_ix_key][-1] < _dat[min_ix_key][-1] and _dat[min_ix_key][0] < len(_dat[klabel])-1:
-            _dat[max_ix_key] = append(_dat[max_ix_key],[len(_dat[klabel])-1])
+        if dat[max_ix_key][-1] > dat[min_ix_key][-1] and dat[max_ix_key][-1] < len(dat[klabel])-1:
+            dat[min_ix_key] = append(dat[min_ix_key],[len(dat[klabel])-1])
+        elif dat[max_ix_key][-1] < dat[min_ix_key][-1] and dat[min_ix_key][0] < len(dat[klabel])-1:
+            dat[max_ix_key] = append(dat[max_ix_key],[len(dat[klabel])-1])
 
 
 def find_nearest(a, v):
     return (abs(a - v)).argmin()
 
 
-def get_dalpha(freq):
+def get_dalpha(dat, freq, spatial_resolution, inter_sample_distance):
     """
     """
     x_label = 'x.fc%d'%(freq)
@@ -250,59 +376,49 @@ def get_dalpha(freq):
     # Calculate Arc Length between two data points. ####
 
     sres = spatial_resolution
-    dx = diff(_dat[x_label]) / sres
-    dy = diff(_dat[y_label]) / sres
+    dx = diff(dat[x_label]) / sres
+    dy = diff(dat[y_label]) / sres
     dxy = sqrt(square(dx) + square(dy))
-    _dat[sxy_label] = append([0,], cumsum(dxy))  
+    dat[sxy_label] = append([0,], cumsum(dxy))  
     
     del dx
     del dy
     del dxy
         
     # get indexes of vxy.fc10 minima for the actual series
-    vminsxy = _dat[sxy_label][_dat['vxy.fc%d.minima'%(freq)]]
+    vminsxy = dat[sxy_label][dat['vxy.fc%d.minima'%(freq)]]
     
-    isd = SETTINGS['stroke_detect_inter_sample_distance'] 
+    # Arc length is non-decreasing, so the sample indices for all minima
+    # can be found with binary searches of the arc length array.
+    sxy = dat[sxy_label]
+    isd = inter_sample_distance
     # find data point of at least inter_sample_distance 
-    # spatially distance previous and succeeding        
-    def find_pre(x):
-        try:
-            return where(_dat[sxy_label] >= (x - isd))[0][0] - 1
-        except:
-            return -1
-
-    def find_it(x):
-        try:
-            return where(_dat[sxy_label] == x)[0][0]
-        except:
-            return -1
-
-    def find_post(x):
-        try:
-            return where(_dat[sxy_label] >= (x + isd))[0][0]
-        except:
-            return -1
-
-    pre = vectorize(find_pre)(vminsxy)
+    # spatially distance previous and succeeding
+    # pre: index before the first sample with sxy >= minima sxy - isd.
+    pre_found = sxy.searchsorted(vminsxy - isd, side='left')
+    pre = pre_found - 1
     # check if pre is always present, if not choose first value in series
-    pre[pre==-1] = 0
+    pre[pre_found == len(sxy)] = 0
+    pre[pre == -1] = 0
     
-    _dat['vxy.fc10.minima.pre'] = pre
-    vmin = vectorize(find_it)(vminsxy)
+    dat['vxy.fc10.minima.pre'] = pre
+    # vmin: first sample with sxy == minima sxy.
+    vmin = sxy.searchsorted(vminsxy, side='left')
     
-    post = vectorize(find_post)(vminsxy)
+    # post: first sample with sxy >= minima sxy + isd.
+    post = sxy.searchsorted(vminsxy + isd, side='left')
     # check if post is always present, if not choose last value in series
-    post[post==-1] = len(_dat[sxy_label])-1
-    _dat['vxy.fc10.minima.post'] = post
+    post[post == len(sxy)] = len(sxy) - 1
+    dat['vxy.fc10.minima.post'] = post
 
     # angle between x axis and each line between start and 
     # individual point (i.e., index) which is between start and end
-    alpha1 = arctan2( _dat[y_label][vmin] - _dat[y_label][pre],
-                      _dat[x_label][vmin] - _dat[x_label][pre] ) * ( 180.0 / pi )
+    alpha1 = arctan2( dat[y_label][vmin] - dat[y_label][pre],
+                      dat[x_label][vmin] - dat[x_label][pre] ) * ( 180.0 / pi )
     # angle between x axis and each line between individual point
     # (i.e., index) which is between start and end and end
-    alpha2 = arctan2(_dat[y_label][post] - _dat[y_label][vmin],
-                     _dat[x_label][post] - _dat[x_label][vmin] ) * ( 180.0 / pi )
+    alpha2 = arctan2(dat[y_label][post] - dat[y_label][vmin],
+                     dat[x_label][post] - dat[x_label][vmin] ) * ( 180.0 / pi )
       
     # change in angle
     dalpha = alpha2 - alpha1
@@ -312,15 +428,14 @@ def get_dalpha(freq):
     return dalpha
 
 
-def assign_stroke_boundaries(series_data, stroke_minima):
+def assign_stroke_boundaries(series_data, stroke_minima, dat,
+                             min_stroke_length, min_stroke_velocity):
     MOTION = 0
     STROKE_PAUSE = 4
         
-    # Each element of stroke_boundaries will be a list of:
-    # stroke_id    start_ix    end_ix    type
+    # Each element of stroke_boundaries will be a row of:
+    # stroke_id    type    start_ix    end_ix
     # where type indicates pause or motion.    
-    stroke_boundaries = []
-    
     if len(stroke_minima) == 0:
         print("Warning: No minima detected for series.")  
     if len(stroke_minima) > 0:
@@ -332,49 +447,43 @@ def assign_stroke_boundaries(series_data, stroke_minima):
             #print "Adding end Minima"
             stroke_minima = append(stroke_minima,len(series_data)-1) 
 
-        i = 0
-        current_stroke = None
-        for minima in stroke_minima[:-1]:
-            start_ix = minima
-            end_ix = stroke_minima[i+1]
-            next_sxy = _dat['sxy.fc10'][end_ix]
-            cur_sxy = _dat['sxy.fc10'][start_ix]
-            dxy = next_sxy - cur_sxy
-            if dxy < SETTINGS['stroke_detect_min_stroke_length']:
-                # If stroke distance is less than min_stroke_length thresh,
-                # mark it as a PAUSE
-                if current_stroke:
-                    # Expand current pause.
-                    current_stroke[-1] = end_ix
-                else:
-                    # Start a pause stroke.
-                    current_stroke=[len(stroke_boundaries)+1, STROKE_PAUSE, start_ix, end_ix]
-            else:
-                # Use mean velocity test
-                avg_vel = _dat['vxy.fc10'][start_ix:end_ix].mean()
-                if avg_vel < SETTINGS['stroke_detect_min_stroke_velocity']:
-                    if current_stroke:
-                        # Expand current pause.
-                        current_stroke[-1] = end_ix
-                    else:
-                        # Start a pause stroke.
-                        current_stroke=[len(stroke_boundaries)+1, STROKE_PAUSE, start_ix, end_ix]
-                else:
-                    if current_stroke:
-                        stroke_boundaries.append(tuple(current_stroke))    
-                    current_stroke=[len(stroke_boundaries)+1, MOTION, start_ix, end_ix]
-                    stroke_boundaries.append(tuple(current_stroke))    
-                    current_stroke = None
-            i+=1            
-                    
-        if current_stroke:
-            stroke_boundaries.append(tuple(current_stroke))    
+        # Each pair of consecutive minima is a candidate stroke interval.
+        start_ixs = stroke_minima[:-1]
+        end_ixs = stroke_minima[1:]
+
+        # If stroke distance is less than min_stroke_length thresh,
+        # mark it as a PAUSE
+        sxy = dat['sxy.fc10']
+        is_pause = (sxy[end_ixs] - sxy[start_ixs]) < min_stroke_length
+
+        # Otherwise use mean velocity test. Interval means of
+        # vxy.fc10[start_ix:end_ix] are taken from a cumulative sum. Means
+        # close enough to the threshold for the cumulative sum rounding
+        # error to matter are recalculated directly.
+        vxy = dat['vxy.fc10']
+        vxy_csum = append([0.0,], cumsum(vxy))
+        interval_lengths = end_ixs - start_ixs
+        csum_error = 4.0 * np.finfo(np.float64).eps * len(vxy) * abs(vxy_csum).max()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg_vel = (vxy_csum[end_ixs] - vxy_csum[start_ixs]) / interval_lengths
+            recheck = abs(avg_vel - min_stroke_velocity) <= csum_error / interval_lengths
+            for i in recheck.nonzero()[0]:
+                avg_vel[i] = vxy[start_ixs[i]:end_ixs[i]].mean()
+            is_pause |= avg_vel < min_stroke_velocity
+
+        # Consecutive pause intervals are merged into a single pause stroke,
+        # each motion interval is a stroke of its own.
+        stroke_starts = np.ones(len(is_pause), dtype=bool)
+        stroke_starts[1:] = ~(is_pause[1:] & is_pause[:-1])
+        first_ixs = stroke_starts.nonzero()[0]
+        last_ixs = append(first_ixs[1:], len(is_pause))[:len(first_ixs)] - 1
 
         stroke_dtype = np.dtype({'names': ['id', 'type', 'start_ix', 'end_ix'],
                                  'formats': [np.uint32, np.uint8, np.uint32, np.uint32]})
                                  
-        # Convert stroke_boundaries list of lists into an ndarray
-        stroke_boundaries = np.asarray(stroke_boundaries,
-                                            dtype=stroke_dtype)
-                    
+        stroke_boundaries = np.zeros(len(first_ixs), dtype=stroke_dtype)
+        stroke_boundaries['id'] = np.arange(1, len(first_ixs)+1)
+        stroke_boundaries['type'] = where(is_pause[first_ixs], STROKE_PAUSE, MOTION)
+        stroke_boundaries['start_ix'] = start_ixs[first_ixs]
+        stroke_boundaries['end_ix'] = end_ixs[last_ixs]
         return stroke_boundaries
@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import division
-from markwrite import SETTINGS
+from markwrite.settings import SETTINGS
 
 from scipy.signal import savgol_filter
 
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Run a function for each pen sample series of a pendata array, using a pool
+of worker processes when more than one worker is requested.
+
+Workers are forked from the calling process, so they see the pendata array
+and SETTINGS as they were when map_series() was called. When the series
+function writes to its series samples, pendata is first copied to a shared
+memory block that all workers write to, and the results are copied back
+into pendata once all series have been processed.
+
+Worker processes are only used on platforms that fork new processes
+(i.e. not Windows), and never from within a worker process.
+"""
+from __future__ import division
+
+import sys
+import Queue
+import traceback
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+# Minimum number of pen samples in each task sent to a worker process.
+# Short series are batched together until they reach this size. It is also
+# the default minimum number of samples per worker process used.
+#
+# Starting the worker processes and collecting their results costs about
+# 12 - 19 msec per map_series() call, and each extra task well under a
+# msec. 2000 samples take about 35 msec to parse for strokes, so a task
+# is always much longer than its overhead. See tests/bench_series_pool.py.
+MIN_BATCH_SAMPLE_COUNT = 2000
+# Number of tasks to create per worker process, so that work is spread
+# evenly when series lengths differ. With a single CPU core, 1 to 32
+# tasks per worker gave the same times within the measurement noise, so
+# the value could not be tuned further there.
+BATCHES_PER_WORKER = 8
+
+_worker_pendata = None
+
+def get_worker_count(workers):
+    """
+    Return the number of worker processes to use for the requested number
+    of workers. 0 (or None) means one worker per CPU core. 1 is returned if
+    worker processes can not be used from the current process.
+    """
+    if sys.platform == 'win32' or multiprocessing.current_process().daemon:
+        return 1
+    if not workers:
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    return max(1, int(workers))
+
+def map_series(func, pendata, index_ranges, workers=1, modifies_pendata=False,
+               min_worker_sample_count=None):
+    """
+    Return [func(pendata[start_ix:stop_ix]) for start_ix, stop_ix in
+    index_ranges], processing the series in `workers` processes.
+
+    func must be a module level function, and its return values must be
+    picklable. If func writes to the series array it is given,
+    modifies_pendata must be True. The returned list is always in
+    index_ranges order.
+
+    Fewer workers are used when there are less than min_worker_sample_count
+    (default MIN_BATCH_SAMPLE_COUNT) samples per worker, since the work
+    would then take less time than starting the worker processes. An error raised by func in a worker
+    process is raised as a RuntimeError with the worker's traceback.
+    """
+    global _worker_pendata
+    if min_worker_sample_count is None:
+        min_worker_sample_count = MIN_BATCH_SAMPLE_COUNT
+    index_ranges = list(index_ranges)
+    sample_count = sum(stop_ix - start_ix for start_ix, stop_ix in index_ranges)
+    workers = min(get_worker_count(workers), len(index_ranges),
+                  max(1, sample_count // min_worker_sample_count))
+    if workers <= 1:
+        return [func(pendata[start_ix:stop_ix])
+                for start_ix, stop_ix in index_ranges]
+
+    if modifies_pendata:
+        _worker_pendata = _sharedCopy(pendata)
+    else:
+        _worker_pendata = pendata
+
+    batches = _batch_ranges(index_ranges, workers)
+    workers = min(workers, len(batches))
+    try:
+        batch_results = _run_workers(func, batches, workers)
+    finally:
+        worker_pendata = _worker_pendata
+        _worker_pendata = None
+
+    if modifies_pendata:
+        pendata[:] = worker_pendata
+    results = []
+    for batch_result in batch_results:
+        results.extend(batch_result)
+    return results
+
+def _sharedCopy(pendata):
+    # Return a copy of pendata in shared memory. A structured ndarray is
+    # copied to one shared memory block; a file_io.PenSampleColumns is
+    # copied to a block per field.
+    if isinstance(pendata, np.ndarray):
+        shared = np.frombuffer(RawArray('b', pendata.nbytes),
+                               dtype=pendata.dtype)
+        shared[:] = pendata
+        return shared
+    columns = dict()
+    for fname in pendata.dtype.names:
+        column = pendata[fname]
+        columns[fname] = np.frombuffer(RawArray('b', column.nbytes),
+                                       dtype=column.dtype)
+        columns[fname][:] = column
+    return type(pendata)(columns, pendata.dtype)
+
+def _batch_ranges(index_ranges, workers):
+    # Split index_ranges into consecutive batches of about equal sample count.
+    sample_count = sum(stop_ix - start_ix for start_ix, stop_ix in index_ranges)
+    batch_size = max(MIN_BATCH_SAMPLE_COUNT,
+                     sample_count // (workers * BATCHES_PER_WORKER))
+    batches = []
+    batch = []
+    batch_sample_count = 0
+    for start_ix, stop_ix in index_ranges:
+        batch.append((start_ix, stop_ix))
+        batch_sample_count += stop_ix - start_ix
+        if batch_sample_count >= batch_size:
+            batches.append(batch)
+            batch = []
+            batch_sample_count = 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _run_workers(func, batches, workers):
+    # Run func over the index ranges of each batch in `workers` forked
+    # processes, and return the list of results of each batch. Batches are
+    # taken from a task queue by the workers as they become free.
+    #
+    # multiprocessing.Pool is not used: on python 2, Pool.close() or
+    # .terminate() followed by .join() takes 100 msec, as the pool's worker
+    # handler thread polls every 0.1 sec. That was more than the time
+    # needed to filter all the series of most pen data files.
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    for batch_ix, batch in enumerate(batches):
+        task_queue.put((batch_ix, batch))
+    for w in range(workers):
+        task_queue.put(None)
+
+    processes = [multiprocessing.Process(target=_worker,
+                                         args=(func, task_queue, result_queue))
+                 for w in range(workers)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+    batch_results = [None]*len(batches)
+    try:
+        for i in range(len(batches)):
+            batch_ix, error, batch_result = _get_result(result_queue,
+                                                        processes)
+            if error:
+                raise RuntimeError("Pen sample series worker process "
+                                   "failed:\n%s" % (error))
+            batch_results[batch_ix] = batch_result
+    except:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+    return batch_results
+
+def _get_result(result_queue, processes):
+    # Return the next item of result_queue, raising an error if a worker
+    # process exits without having put all of its results.
+    while True:
+        try:
+            return result_queue.get(timeout=1.0)
+        except Queue.Empty:
+            for process in processes:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError("Pen sample series worker process "
+                                       "exited with code %d."
+                                       % (process.exitcode))
+
+def _worker(func, task_queue, result_queue):
+    for batch_ix, index_ranges in iter(task_queue.get, None):
+        try:
+            result_queue.put((batch_ix, None,
+                              _run_batch(func, index_ranges)))
+        except Exception:
+            result_queue.put((batch_ix, traceback.format_exc(), None))
+
+def _run_batch(func, index_ranges):
+    return [func(_worker_pendata[start_ix:stop_ix])
+            for start_ix, stop_ix in index_ranges]
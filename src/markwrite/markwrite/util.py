@@ -23,6 +23,10 @@ from timeit import default_timer
 import sys
 import numpy as np
 
+# pen sample fields used for sample x and y position
+X_FIELD = 'x_filtered'
+Y_FIELD = 'y_filtered'
+
 def getTime():
     return default_timer()
 
@@ -82,6 +86,34 @@ def contiguous_regions(condition):
 
     return starts, stops, lengths
 
+def interval_sample_owners(start_ixs, end_ixs, sample_count):
+    """Given the inclusive [start_ixs[i], end_ixs[i]] sample index ranges of
+    a boundary table, returns two 1d arrays of length sample_count:
+    the position of the first table row whose range contains each sample
+    (-1 for samples not within any range), and the number of ranges
+    that contain each sample.
+    """
+    owners = np.full(sample_count, -1, dtype=np.int64)
+    start_ixs = np.asarray(start_ixs, dtype=np.int64)
+    lengths = np.asarray(end_ixs, dtype=np.int64) - start_ixs + 1
+    lengths[lengths < 0] = 0
+    if lengths.sum() == 0:
+        return owners, np.zeros(sample_count, dtype=np.int64)
+
+    # Expand each range into the sample indices it covers, keeping the
+    # rows in table order so a stable sort leaves the first row first.
+    row_ixs = np.repeat(np.arange(lengths.shape[0]), lengths)
+    sample_ixs = (np.arange(row_ixs.shape[0]) -
+                  np.repeat(np.cumsum(lengths) - lengths, lengths) +
+                  start_ixs[row_ixs])
+    counts = np.bincount(sample_ixs, minlength=sample_count)
+    order = np.argsort(sample_ixs, kind='mergesort')
+    sample_ixs = sample_ixs[order]
+    first = np.ones(sample_ixs.shape[0], dtype=bool)
+    first[1:] = sample_ixs[1:] != sample_ixs[:-1]
+    owners[sample_ixs[first]] = row_ixs[order][first]
+    return owners, counts
+
 # Pen Sample field conversions
 
 SAMPLE_STATES=dict()
@@ -25,6 +25,9 @@ setup(
         # If any package contains *.txt or *.rst files, include them:
         'markwrite': ['resources/icons/*.png','resources/tags/*.tag'],
         },
+    entry_points={
+        'console_scripts': ['markwrite-batch = markwrite.batch:main'],
+        },
     url='https://github.com/isolver/OpenHandWrite#markwrite',
     license='GPLv3+',
     author='Sol Simpson',
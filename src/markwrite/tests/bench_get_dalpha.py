@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Micro-benchmark of sigproc.parse_strokes.get_dalpha().
+
+For each series length given, a random walk pen sample series with some
+flat (no motion) stretches is created and run through the velocity &
+curvature parser filter, velocity and extrema stages. get_dalpha() is then
+timed on the series data, along with oldGetDalpha(), the earlier version of
+get_dalpha() that searched the whole arc length array for each velocity
+minima. The minima pre, post and dalpha values of both are checked to be
+the same.
+
+oldGetDalpha() takes O(minima x samples) time, a few seconds for 1e5
+samples and about 5 minutes for 1e6 samples, so by default it is only
+timed for series of up to 1e5 samples. Run the benchmark from the src/markwrite folder with:
+
+    python tests/bench_get_dalpha.py
+
+or, to also time oldGetDalpha() for 1e6 samples:
+
+    python tests/bench_get_dalpha.py -m 1000000
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from numpy import (sqrt, square, diff, cumsum, append, vectorize, arctan2,
+                   pi, where)
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from markwrite.settings import SETTINGS
+from markwrite.sigproc import parse_strokes
+from markwrite.sigproc.parse_strokes import get_dalpha
+
+def oldGetDalpha(dat, freq, spatial_resolution, inter_sample_distance):
+    '''
+    get_dalpha() as it was before the minima neighbour samples were found
+    with binary searches of the arc length array.
+    '''
+    x_label = 'x.fc%d'%(freq)
+    y_label = 'y.fc%d'%(freq)
+    sxy_label = 'sxy.fc%d'%(freq)
+
+    sres = spatial_resolution
+    dx = diff(dat[x_label]) / sres
+    dy = diff(dat[y_label]) / sres
+    dxy = sqrt(square(dx) + square(dy))
+    dat[sxy_label] = append([0,], cumsum(dxy))
+
+    vminsxy = dat[sxy_label][dat['vxy.fc%d.minima'%(freq)]]
+
+    isd = inter_sample_distance
+    def find_pre(x):
+        try:
+            return where(dat[sxy_label] >= (x - isd))[0][0] - 1
+        except:
+            return -1
+
+    def find_it(x):
+        try:
+            return where(dat[sxy_label] == x)[0][0]
+        except:
+            return -1
+
+    def find_post(x):
+        try:
+            return where(dat[sxy_label] >= (x + isd))[0][0]
+        except:
+            return -1
+
+    pre = vectorize(find_pre)(vminsxy)
+    pre[pre==-1] = 0
+    dat['vxy.fc10.minima.pre'] = pre
+    vmin = vectorize(find_it)(vminsxy)
+    post = vectorize(find_post)(vminsxy)
+    post[post==-1] = len(dat[sxy_label])-1
+    dat['vxy.fc10.minima.post'] = post
+
+    alpha1 = arctan2( dat[y_label][vmin] - dat[y_label][pre],
+                      dat[x_label][vmin] - dat[x_label][pre] ) * ( 180.0 / pi )
+    alpha2 = arctan2(dat[y_label][post] - dat[y_label][vmin],
+                     dat[x_label][post] - dat[x_label][vmin] ) * ( 180.0 / pi )
+
+    dalpha = alpha2 - alpha1
+    dalpha[dalpha > 180.0] = dalpha[dalpha > 180.0] - 360.0
+    dalpha[dalpha < -180.0] = dalpha[dalpha < -180.0] + 360.0
+    return dalpha
+
+def createSeriesData(sample_count, rng):
+    '''
+    Return the parser series data of a random walk series of sample_count
+    samples, as used by get_dalpha().
+    '''
+    series = np.zeros(sample_count, dtype=[('time', np.float64),
+                                           ('x', np.float64),
+                                           ('y', np.float64)])
+    series['time'] = np.arange(sample_count)/200.0
+    steps = rng.normal(0.0, 5.0, (2, sample_count))
+    # Leave the pen still for about 10% of the samples.
+    steps[:, rng.uniform(size=sample_count) < 0.1] = 0.0
+    series['x'] = cumsum(steps[0])
+    series['y'] = cumsum(steps[1])
+    dat = dict()
+    parse_strokes._vc_filter(series, dat, SETTINGS)
+    parse_strokes._vc_velocity(series, dat, SETTINGS)
+    parse_strokes._vc_extrema(series, dat, SETTINGS)
+    return dat
+
+def timeDalpha(dalpha_func, dat, repeat):
+    '''
+    Return (fastest time of repeat calls, results) of dalpha_func for dat,
+    where results is (dalpha, pre, post).
+    '''
+    args = (10, SETTINGS['device_spatial_resolution'],
+            SETTINGS['stroke_detect_inter_sample_distance'])
+    best = None
+    for r in range(repeat):
+        stime = time.time()
+        dalpha = dalpha_func(dat, *args)
+        dt = time.time() - stime
+        best = dt if best is None else min(best, dt)
+    return best, (dalpha, dat['vxy.fc10.minima.pre'],
+                  dat['vxy.fc10.minima.post'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Time get_dalpha() for pen sample series of different "
+                    u"lengths.")
+    parser.add_argument('-n', '--sample-counts', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000, 1000000],
+                        help=u"Series lengths to time.")
+    parser.add_argument('-m', '--max-old-samples', type=int, default=100000,
+                        help=u"Longest series oldGetDalpha() is timed for.")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help=u"Number of times get_dalpha() is timed for "
+                             u"each series. The fastest time is reported.")
+    args = parser.parse_args(argv)
+
+    rng = np.random.RandomState(0)
+    print u"%10s %8s %12s %12s %8s %6s" % (u'samples', u'minima',
+                                           u'old ms', u'new ms',
+                                           u'speedup', u'same')
+    for sample_count in args.sample_counts:
+        dat = createSeriesData(sample_count, rng)
+        minima_count = len(dat['vxy.fc10.minima'])
+        new_time, new_results = timeDalpha(get_dalpha, dat, args.repeat)
+        if sample_count <= args.max_old_samples:
+            old_time, old_results = timeDalpha(oldGetDalpha, dat, 1)
+            same = all(np.array_equal(o, n)
+                       for o, n in zip(old_results, new_results))
+            print u"%10d %8d %12.1f %12.1f %8.0f %6s" % (
+                sample_count, minima_count, old_time*1000.0, new_time*1000.0,
+                old_time/new_time, same)
+        else:
+            print u"%10d %8d %12s %12.1f %8s %6s" % (
+                sample_count, minima_count, u'-', new_time*1000.0, u'-', u'-')
+
+if __name__ == '__main__':
+    main()
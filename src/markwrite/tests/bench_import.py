@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the cost of importing markwrite.
+
+Each set of modules in IMPORTS is imported in a new Python process, from
+the markwrite source folder given. The time taken, the number of modules
+loaded, the increase in peak memory use (resident set size) of the process
+and the GUI / HDF5 packages that were loaded (PyQt4, sip, pyqtgraph,
+tables) are printed. Importing numpy and scipy.signal alone is included
+for comparison.
+
+The processes are run with HOME and XDG_CONFIG_HOME set to a temporary
+folder, so markwrite versions that save the settings files when they are
+imported do not change the user's settings. Peak memory use is only
+reported on platforms with the resource module.
+
+Run the benchmark from the src/markwrite folder with:
+
+    python tests/bench_import.py
+
+Older markwrite versions create a QApplication when markwrite is imported,
+so they need PyQt4 and a display. To compare with one of those, check it
+out to another folder and run the benchmark under a virtual display, for
+example:
+
+    git worktree add ../mw-before <commit>
+    xvfb-run python tests/bench_import.py -s ../mw-before/src/markwrite
+"""
+import os
+import sys
+import ast
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORTS = [('numpy, scipy.signal', ['numpy', 'scipy.signal']),
+           ('markwrite', ['markwrite']),
+           ('markwrite.project', ['markwrite.project']),
+           ('markwrite.reports', ['markwrite.reports']),
+           ('all three', ['markwrite', 'markwrite.project',
+                          'markwrite.reports'])]
+
+GUI_PACKAGES = ['PyQt4', 'sip', 'pyqtgraph', 'tables']
+
+# Run in the new Python process, with src_dir and module_names set.
+_IMPORT_CODE = '''
+import sys, time
+sys.path.insert(0, src_dir)
+def peakMemoryMB():
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss/1048576.0
+    return maxrss/1024.0
+start_mb = peakMemoryMB()
+start_count = len([m for m in sys.modules.values() if m is not None])
+stime = time.time()
+for module_name in module_names:
+    __import__(module_name)
+dt = time.time() - stime
+module_count = len([m for m in sys.modules.values() if m is not None])
+end_mb = peakMemoryMB()
+added_mb = None
+if start_mb is not None:
+    added_mb = end_mb - start_mb
+print repr((dt, module_count - start_count, added_mb,
+            [p for p in gui_packages if p in sys.modules]))
+'''
+
+def measureImport(src_dir, module_names, env):
+    '''
+    Import module_names from src_dir in a new Python process. Returns
+    (time, number of modules loaded, added MB, GUI packages loaded), or
+    the last line of the error output if the import failed.
+    '''
+    code = 'src_dir = %r\nmodule_names = %r\ngui_packages = %r\n%s' % (
+        src_dir, module_names, GUI_PACKAGES, _IMPORT_CODE)
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = proc.communicate()
+    if proc.returncode != 0:
+        return (errors.strip().splitlines() or ['exit code %d' %
+                                                proc.returncode])[-1]
+    return ast.literal_eval(output.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Measure the cost of importing markwrite.")
+    parser.add_argument('-s', '--src', default=os.path.dirname(TESTS_DIR),
+                        help=u"markwrite source folder, the folder that "
+                             u"has the markwrite package in it.")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help=u"Number of times each import is timed. The "
+                             u"fastest time is reported.")
+    args = parser.parse_args(argv)
+
+    src_dir = os.path.abspath(args.src)
+    home_dir = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['HOME'] = home_dir
+    env['XDG_CONFIG_HOME'] = os.path.join(home_dir, '.config')
+    try:
+        print src_dir
+        print u"%-20s %8s %8s %9s  %s" % (u'import', u's', u'modules',
+                                          u'added MB', u'GUI packages')
+        for label, module_names in IMPORTS:
+            results = [measureImport(src_dir, module_names, env)
+                       for r in range(args.repeat)]
+            if isinstance(results[0], basestring):
+                print u"%-20s failed: %s" % (label, results[0])
+                continue
+            dt = min(r[0] for r in results)
+            dt_, module_count, added_mb, gui_packages = results[0]
+            if added_mb is None:
+                added_mb = float('nan')
+            print u"%-20s %8.3f %8d %9.1f  %s" % (
+                label, dt, module_count, added_mb,
+                u', '.join(gui_packages) or u'-')
+    finally:
+        shutil.rmtree(home_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
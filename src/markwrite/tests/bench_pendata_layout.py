@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the pendata_format and pendata_layout settings.
+
+A project is created from each of the pen data files used by
+test_vc_parser.py, once for each pen sample format ('standard' or
+'compact') and layout ('records' or 'columns'). For each combination, the
+following are printed:
+
+  * MB: memory used by the per sample project arrays (pendata,
+    stroke_boundary_samples, sample_labels and the sample stroke counts).
+  * load s: time taken to create the projects, which includes the series
+    filtering and stroke parsing (sigproc) of all the pen samples.
+  * series s: time taken by a sigproc style pass over the derived channels
+    of each sample series: the series samples are sliced from pendata and
+    the mean and maximum of the filtered position, velocity and
+    acceleration channels are calculated.
+  * report s: time taken to save the pen sample level report of each
+    project as a text file.
+  * same: True if the stroke boundaries and reports are the same as for
+    the first combination.
+
+The pen data cache is not used, so every project is created from its pen
+data file. Run the benchmark from the src/markwrite folder with:
+
+    python tests/bench_pendata_layout.py
+
+or, for other files and repeat counts:
+
+    python tests/bench_pendata_layout.py -f data1.txyp data2.xml -r 3
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import cStringIO
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from markwrite.settings import SETTINGS
+from markwrite.project import MarkWriteProject
+from markwrite.reports.sample import PenSampleReportExporter
+from test_vc_parser import getTestDataFiles, projectFilePath
+
+PENDATA_SETTINGS = [('standard', 'records'),
+                    ('standard', 'columns'),
+                    ('compact', 'records'),
+                    ('compact', 'columns')]
+
+SERIES_CHANNELS = ['x_filtered', 'y_filtered', 'xy_velocity',
+                   'xy_acceleration']
+
+def projectArraysMB(project):
+    '''
+    Return the memory used by the per sample arrays of project in MB.
+    '''
+    nbytes = project.pendata.nbytes + project.sample_labels.nbytes + \
+             project._sample_stroke_counts.nbytes
+    if project.stroke_boundary_samples is not None:
+        nbytes += project.stroke_boundary_samples.nbytes
+    return nbytes/1048576.0
+
+def seriesPass(project, repeat):
+    '''
+    Return the time taken by repeat passes over the derived channels of
+    each sample series of project.
+    '''
+    pendata = project.pendata
+    series_ranges = [(b['start_ix'], b['end_ix']+1)
+                     for b in project.series_boundaries]
+    stime = time.time()
+    for r in range(repeat):
+        for start_ix, end_ix in series_ranges:
+            series = pendata[start_ix:end_ix]
+            for cname in SERIES_CHANNELS:
+                channel = series[cname]
+                channel.mean()
+                channel.max()
+    return time.time() - stime
+
+def runSettings(file_paths, report_path, series_repeat):
+    '''
+    Create a project for each of file_paths using the current SETTINGS.
+    Returns (MB, load time, series time, report time, results), where
+    results is a list with a digest of the stroke boundaries and the pen
+    sample report of each project.
+    '''
+    megabytes = load_time = series_time = report_time = 0.0
+    results = []
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        for file_path in file_paths:
+            stime = time.time()
+            project = MarkWriteProject(file_path=file_path)
+            load_time += time.time() - stime
+            megabytes += projectArraysMB(project)
+            series_time += seriesPass(project, series_repeat)
+            stime = time.time()
+            PenSampleReportExporter.export(report_path, project)
+            report_time += time.time() - stime
+            with open(report_path, 'rb') as f:
+                results.append((
+                    hashlib.md5(np.asarray(project.stroke_boundaries)
+                                .tobytes()).hexdigest(),
+                    hashlib.md5(f.read()).hexdigest()))
+            project.close()
+    finally:
+        sys.stdout = stdout
+    return megabytes, load_time, series_time, report_time, results
+
+def runBenchmark(file_paths, repeat, series_repeat, tmp_dir):
+    '''
+    Print the memory use and times of file_paths for each of
+    PENDATA_SETTINGS, the fastest of repeat runs. The runs of each setting
+    are interleaved, so a slow down of the computer affects all of them.
+    '''
+    report_path = os.path.join(tmp_dir, 'report.txt')
+    best = [None]*len(PENDATA_SETTINGS)
+    for r in range(repeat):
+        for si, (format_name, layout) in enumerate(PENDATA_SETTINGS):
+            SETTINGS['pendata_format'] = format_name
+            SETTINGS['pendata_layout'] = layout
+            run = runSettings(file_paths, report_path, series_repeat)
+            if best[si] is None:
+                best[si] = list(run)
+            else:
+                best[si][1:4] = [min(a, b) for a, b
+                                 in zip(best[si][1:4], run[1:4])]
+
+    print u"%d files" % (len(file_paths))
+    print u"%-18s %8s %8s %9s %9s %6s" % (u'format / layout', u'MB',
+                                          u'load s', u'series s',
+                                          u'report s', u'same')
+    baseline = best[0][4]
+    for (format_name, layout), run in zip(PENDATA_SETTINGS, best):
+        megabytes, load_time, series_time, report_time, results = run
+        print u"%-18s %8.2f %8.2f %9.3f %9.2f %6s" % (
+            u'%s / %s' % (format_name, layout), megabytes, load_time,
+            series_time, report_time, results == baseline)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Compare the memory use and speed of the MarkWrite "
+                    u"pen sample formats and layouts.")
+    parser.add_argument('-f', '--files', nargs='+',
+                        help=u"Pen data files to use. The test_vc_parser.py "
+                             u"test data files are used by default.")
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help=u"Number of times each format and layout is "
+                             u"timed. The fastest time is reported.")
+    parser.add_argument('-s', '--series-repeat', type=int, default=50,
+                        help=u"Number of passes over the sample series "
+                             u"timed for each project.")
+    args = parser.parse_args(argv)
+
+    settings = dict(SETTINGS)
+    SETTINGS['pendata_cache_max_mb'] = 0
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if args.files:
+            fs_encoding = sys.getfilesystemencoding()
+            file_paths = [os.path.abspath(f).decode(fs_encoding)
+                          for f in args.files]
+        else:
+            file_paths = [projectFilePath(f, tmp_dir)
+                          for f in getTestDataFiles()]
+        runBenchmark(file_paths, args.repeat, args.series_repeat, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        SETTINGS.update(settings)
+
+if __name__ == '__main__':
+    main()
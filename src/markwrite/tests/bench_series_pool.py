@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the series_process_worker_count setting.
+
+A project is created from each of the pen data files used by
+test_vc_parser.py, once for each number of series processing workers
+given. For each worker count, the time taken to create all the projects
+is printed, along with the part of it spent in sigproc.series_pool
+map_series() calls (series filtering and stroke parsing), and the speedup
+of both compared to the first worker count given. The projects created
+are checked to have the same pen data and stroke boundaries as the ones
+created with the first worker count.
+
+The pen data cache is not used, so every project is created from its pen
+data file. Run the benchmark from the src/markwrite folder, on a computer
+with more than one CPU core, with:
+
+    python tests/bench_series_pool.py
+
+or, for other worker counts (0 uses one worker per CPU core):
+
+    python tests/bench_series_pool.py -w 1 2 4 8 0 -r 3
+
+The series_pool MIN_BATCH_SAMPLE_COUNT and BATCHES_PER_WORKER values can be
+changed with -b and -t, to compare other values with the same worker
+counts.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import cStringIO
+import multiprocessing
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from markwrite.settings import SETTINGS
+import markwrite.project
+from markwrite.project import MarkWriteProject
+from markwrite.sigproc import series_pool
+from markwrite.sigproc.series_pool import get_worker_count
+from test_vc_parser import getTestDataFiles, projectFilePath
+
+_map_series = markwrite.project.map_series
+_map_series_time = [0.0]
+
+def _timedMapSeries(*args, **kwargs):
+    stime = time.time()
+    try:
+        return _map_series(*args, **kwargs)
+    finally:
+        _map_series_time[0] += time.time() - stime
+
+def createProjects(file_paths, workers):
+    '''
+    Create a project from each of file_paths using workers series
+    processing workers. Returns (total time, map_series() time, results),
+    where results is a list with the pen data and stroke boundaries of
+    each project.
+    '''
+    SETTINGS['series_process_worker_count'] = workers
+    _map_series_time[0] = 0.0
+    results = []
+    total_time = 0.0
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    try:
+        for file_path in file_paths:
+            stime = time.time()
+            project = MarkWriteProject(file_path=file_path)
+            total_time += time.time() - stime
+            # segment_id is left out, since segment ids are taken from a
+            # counter that keeps increasing while the benchmark runs.
+            pendata = project.pendata
+            results.append([pendata[fname].tobytes()
+                            for fname in pendata.dtype.names
+                            if fname != 'segment_id'] +
+                           [np.asarray(project.stroke_boundaries).tobytes()])
+            project.close()
+    finally:
+        sys.stdout = stdout
+    return total_time, _map_series_time[0], results
+
+def runBenchmark(file_paths, worker_counts, repeat):
+    '''
+    Print the project creation times of file_paths for each of
+    worker_counts, the fastest of repeat runs.
+    '''
+    try:
+        cpu_count = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpu_count = u'unknown'
+    print u"%d files, %s CPU cores, MIN_BATCH_SAMPLE_COUNT %d, " \
+          u"BATCHES_PER_WORKER %d" % (len(file_paths), cpu_count,
+                                     series_pool.MIN_BATCH_SAMPLE_COUNT,
+                                     series_pool.BATCHES_PER_WORKER)
+    print u"%8s %10s %8s %10s %8s %6s" % (u'workers', u'total s',
+                                          u'speedup', u'series s',
+                                          u'speedup', u'same')
+    baseline = None
+    for workers in worker_counts:
+        total_time = series_time = None
+        for r in range(repeat):
+            t, st, results = createProjects(file_paths, workers)
+            total_time = t if total_time is None else min(total_time, t)
+            series_time = st if series_time is None else min(series_time, st)
+        if baseline is None:
+            baseline = total_time, series_time, results
+        print u"%8s %10.2f %8.2f %10.2f %8.2f %6s" % (
+            u'%d (%d)' % (workers, get_worker_count(workers)),
+            total_time, baseline[0]/total_time,
+            series_time, baseline[1]/series_time,
+            results == baseline[2])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Time MarkWrite project creation with different "
+                    u"numbers of series processing workers.")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 0],
+                        help=u"Worker counts to time. The first one is the "
+                             u"baseline. 0 uses one worker per CPU core.")
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help=u"Number of times each worker count is timed. "
+                             u"The fastest time is reported.")
+    parser.add_argument('-b', '--min-batch-samples', type=int,
+                        default=series_pool.MIN_BATCH_SAMPLE_COUNT,
+                        help=u"series_pool.MIN_BATCH_SAMPLE_COUNT value.")
+    parser.add_argument('-t', '--batches-per-worker', type=int,
+                        default=series_pool.BATCHES_PER_WORKER,
+                        help=u"series_pool.BATCHES_PER_WORKER value.")
+    args = parser.parse_args(argv)
+    series_pool.MIN_BATCH_SAMPLE_COUNT = args.min_batch_samples
+    series_pool.BATCHES_PER_WORKER = args.batches_per_worker
+
+    SETTINGS['pendata_cache_max_mb'] = 0
+    markwrite.project.map_series = _timedMapSeries
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_paths = [projectFilePath(f, tmp_dir) for f in getTestDataFiles()]
+        runBenchmark(file_paths, args.workers, args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the tab delimited (.txyp) pen data file parser.
+
+A synthetic .txyp file is created, with the same layout as the TXYP
+test_data files: a header line, a '!TRIAL_CV_LABELS' line, and trials of
+pen samples that each end with a '!TRIAL_CV_VALUES' line. The file is then
+read with TabDelimitedDataImporter.parsearray(), which converts the sample
+lines in bulk, and with DataImporter.parsearray(), which converts the list
+of sample tuples returned by the line by line TabDelimitedDataImporter
+.parse(). The fastest time of each is printed, and the pen data and trial
+condition variables they return are checked to be the same.
+
+Run the benchmark from the src/markwrite folder with:
+
+    python tests/bench_txyp_parser.py
+
+or, for a file with another number of samples:
+
+    python tests/bench_txyp_parser.py -n 100000 -r 3
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from markwrite.file_io import DataImporter, TabDelimitedDataImporter
+
+def writeTestFile(file_path, sample_count, trial_sample_count=5000, seed=0):
+    '''
+    Write a .txyp file with sample_count pen samples to file_path, in trials
+    of trial_sample_count samples.
+    '''
+    rng = np.random.RandomState(seed)
+    times = np.arange(sample_count)*7.3 + 6224.0
+    xs = 357 + np.cumsum(rng.randint(-3, 4, sample_count))
+    ys = 324 + np.cumsum(rng.randint(-3, 4, sample_count))
+    pressures = np.where(rng.uniform(size=sample_count) < 0.2, 0,
+                         rng.randint(1, 1024, sample_count))
+    with open(file_path, 'wb') as f:
+        f.write(b'T\tX\tY\tP\n')
+        f.write(b'!TRIAL_CV_LABELS Part_ID Trial_ID Trial_Word '
+                b'DV_TRIAL_START DV_TRIAL_END\n')
+        for trial, tstart in enumerate(xrange(0, sample_count,
+                                              trial_sample_count)):
+            tend = min(tstart+trial_sample_count, sample_count)
+            for i in xrange(tstart, tend):
+                f.write(b'%.1f\t%d\t%d\t%d\t\n' % (times[i], xs[i], ys[i],
+                                                   pressures[i]))
+            f.write(b'!TRIAL_CV_VALUES 5-02-w %02d Wort %.3f %.3f\n' % (
+                trial+1, times[tstart], times[tend-1]))
+
+def timeParser(parsearray, file_path, repeat):
+    '''
+    Return (fastest time of repeat calls, pen data, condition variables)
+    of the parsearray method for file_path.
+    '''
+    best = None
+    for r in range(repeat):
+        stime = time.time()
+        pendata = parsearray(file_path)
+        dt = time.time() - stime
+        best = dt if best is None else min(best, dt)
+    return best, pendata, TabDelimitedDataImporter.exp_condvars
+
+def lineParsearray(file_path):
+    # DataImporter.parsearray(), which uses the line by line .parse() of
+    # TabDelimitedDataImporter.
+    return DataImporter.parsearray.im_func(TabDelimitedDataImporter,
+                                           file_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Time the .txyp file parser on a synthetic file.")
+    parser.add_argument('-n', '--sample-count', type=int, default=1100000,
+                        help=u"Number of pen samples in the file.")
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help=u"Number of times each parser is timed. "
+                             u"The fastest time is reported.")
+    args = parser.parse_args(argv)
+
+    fd, file_path = tempfile.mkstemp(suffix='.txyp')
+    os.close(fd)
+    try:
+        writeTestFile(file_path, args.sample_count)
+        print u"%d samples, %.1f MB" % (args.sample_count,
+                                        os.path.getsize(file_path)/1048576.0)
+        line_time, line_pendata, line_cvs = timeParser(lineParsearray,
+                                                       file_path, args.repeat)
+        bulk_time, bulk_pendata, bulk_cvs = timeParser(
+            TabDelimitedDataImporter.parsearray, file_path, args.repeat)
+    finally:
+        os.remove(file_path)
+    print u"%-12s %8s %8s" % (u'parser', u's', u'speedup')
+    print u"%-12s %8.2f %8.2f" % (u'line', line_time, 1.0)
+    print u"%-12s %8.2f %8.2f" % (u'bulk', bulk_time, line_time/bulk_time)
+    print u"same pen data: %s, same condition variables: %s" % (
+        np.array_equal(line_pendata, bulk_pendata),
+        np.array_equal(line_cvs, bulk_cvs))
+
+if __name__ == '__main__':
+    main()
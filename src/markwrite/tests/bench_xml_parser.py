@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark of the XML pen data file importer.
+
+A large XML file is made by repeating the strokes elements of the
+test_data/XML/66.xml file. The file is then read by:
+
+  * two-pass: twoPassParsearray(), the earlier XmlDataImporter, which
+    built the element tree of the whole file with ElementTree.parse() once
+    in validate() and again in parse().
+  * iterparse: XmlDataImporter.validate() and .parsearray(), which stream
+    the file with iterparse().
+
+Each importer is run in its own Python process, so the peak memory use
+(resident set size) of the process can be reported. The time taken, the
+peak memory use and the increase in memory use over the process start are
+printed, and the pen data read is checked to be the same. Peak memory use
+is only reported on platforms with the resource module.
+
+Run the benchmark from the src/markwrite folder with:
+
+    python tests/bench_xml_parser.py
+
+or, for a file with another number of copies of the strokes elements:
+
+    python tests/bench_xml_parser.py -c 10
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import xml.etree.ElementTree
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from markwrite.file_io import (XmlDataImporter, markwrite_pendata_format,
+                               SAMPLE_STATES)
+
+TEST_FILE_PATH = os.path.join(TESTS_DIR, '..', '..', '..', 'distribution',
+                              'MarkWrite', 'test_data', 'XML', '66.xml')
+
+def twoPassParsearray(file_path):
+    '''
+    Read file_path the way XmlDataImporter did before it used iterparse().
+    '''
+    xml_root = xml.etree.ElementTree.parse(file_path)
+    if xml_root is None:
+        raise IOError("File could not be imported.")
+    list_result = []
+    xml_root = xml.etree.ElementTree.parse(file_path).getroot()
+    for stroke_set in xml_root.iter(u'strokes'):
+        si=0
+        for stroke in stroke_set.iter(u'stroke'):
+            status = SAMPLE_STATES['PRESSED']
+            if si == 0:
+                status += SAMPLE_STATES['FIRST_PRESS']
+            list_result.append((long(stroke.get("Time"))/1000.0,
+                                int(stroke.get("X")),
+                                int(stroke.get("Y")),
+                                1, # pressure, always 1
+                                status))
+            si+=1
+    txyps_array = [s+(0,)*XmlDataImporter._ADD_SAMPLE_COL_COUNT
+                   for s in list_result]
+    return np.asarray(txyps_array, markwrite_pendata_format)
+
+def iterparseParsearray(file_path):
+    if XmlDataImporter.validate(file_path) is False:
+        raise IOError("File could not be imported.")
+    return XmlDataImporter.parsearray(file_path)
+
+IMPORTERS = [('two-pass', twoPassParsearray),
+             ('iterparse', iterparseParsearray)]
+
+def writeTestFile(file_path, copy_count):
+    '''
+    Write an XML file to file_path that has copy_count copies of the
+    strokes elements of TEST_FILE_PATH.
+    '''
+    with open(TEST_FILE_PATH, 'rb') as f:
+        contents = f.read()
+    strokes_start = contents.index(b'<strokes')
+    strokes_end = contents.rindex(b'</strokes>') + len(b'</strokes>\n')
+    with open(file_path, 'wb') as f:
+        f.write(contents[:strokes_start])
+        for c in range(copy_count):
+            f.write(contents[strokes_start:strokes_end])
+        f.write(contents[strokes_end:])
+
+def peakMemoryMB():
+    # Peak resident set size of this process in MB, or None.
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss/1048576.0
+    return maxrss/1024.0
+
+def measureImporter(name, file_path):
+    '''
+    Run importer name for file_path and print the time taken, the peak
+    memory use before and after, the sample count and a digest of the pen
+    data, separated by spaces.
+    '''
+    parsearray = dict(IMPORTERS)[name]
+    start_mb = peakMemoryMB()
+    stime = time.time()
+    pendata = parsearray(file_path)
+    dt = time.time() - stime
+    print dt, start_mb, peakMemoryMB(), len(pendata), \
+        hashlib.md5(pendata.tobytes()).hexdigest()
+
+def runImporter(name, file_path):
+    # Run importer name in a new Python process, returning
+    # (time, start MB, peak MB, sample count, pen data digest).
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      '--measure', name, file_path])
+    dt, start_mb, peak_mb, sample_count, digest = output.split()
+    if start_mb == 'None':
+        start_mb = peak_mb = float('nan')
+    return (float(dt), float(start_mb), float(peak_mb), int(sample_count),
+            digest)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=u"Time the XML pen data file importer, and measure its "
+                    u"peak memory use.")
+    parser.add_argument('-c', '--copies', type=int, default=40,
+                        help=u"Number of copies of the 66.xml strokes "
+                             u"elements in the file.")
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help=u"Number of times each importer is run. The "
+                             u"fastest time is reported.")
+    parser.add_argument('--measure', nargs=2, metavar=('IMPORTER', 'FILE'),
+                        help=u"Run one importer in this process.")
+    args = parser.parse_args(argv)
+    if args.measure:
+        measureImporter(*args.measure)
+        return
+
+    fd, file_path = tempfile.mkstemp(suffix='.xml')
+    os.close(fd)
+    try:
+        writeTestFile(file_path, args.copies)
+        print u"%.1f MB file" % (os.path.getsize(file_path)/1048576.0)
+        print u"%-10s %8s %8s %10s %10s %6s" % (u'importer', u'samples',
+                                                u's', u'peak MB',
+                                                u'added MB', u'same')
+        baseline = None
+        for name, parsearray in IMPORTERS:
+            results = [runImporter(name, file_path)
+                       for r in range(args.repeat)]
+            dt = min(r[0] for r in results)
+            dt_, start_mb, peak_mb, sample_count, digest = results[0]
+            if baseline is None:
+                baseline = digest
+            print u"%-10s %8d %8.2f %10.1f %10.1f %6s" % (
+                name, sample_count, dt, peak_mb, peak_mb-start_mb,
+                digest == baseline)
+    finally:
+        os.remove(file_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests of the segment tree index time queries.
+
+Random segment trees, with overlapping segments at each level, are created
+for a pen data file. The segment tree level, time and sample index queries
+are compared with a search of all the segments of the tree, before and
+after some of the segments are removed.
+
+Run the test from the src/markwrite folder with:
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+import cStringIO
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from markwrite.settings import SETTINGS
+from markwrite.project import MarkWriteProject
+
+TEST_FILE_PATH = os.path.join(TESTS_DIR, '..', '..', '..', 'distribution',
+                              'MarkWrite', 'test_data', 'TXYP',
+                              'session.txyp')
+
+def allSegments(segment):
+    segs = []
+    for c in segment.children:
+        segs.append(c)
+        segs.extend(allSegments(c))
+    return segs
+
+class SegmentIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._settings = dict(SETTINGS)
+        SETTINGS['pendata_cache_max_mb'] = 0
+        stdout = sys.stdout
+        sys.stdout = cStringIO.StringIO()
+        try:
+            self.project = MarkWriteProject(file_path=TEST_FILE_PATH)
+        finally:
+            sys.stdout = stdout
+        self.rng = np.random.RandomState(0)
+        self.times = self.project.pendata['time']
+        self.addSegments(self.project.segmenttree, 3, 20)
+
+    def tearDown(self):
+        self.project.close()
+        SETTINGS.update(self._settings)
+
+    def addSegments(self, parent, depth, count=None):
+        # Add count (default 1 to 4) segments at random times of the parent
+        # segment, and child segments of those to depth levels.
+        if parent.pendata is None or len(parent.pendata) < 4:
+            return
+        ptimes = parent.pendata['time']
+        if count is None:
+            count = self.rng.randint(1, 5)
+        for k in range(count):
+            a, b = sorted(self.rng.choice(len(ptimes), 2, replace=False))
+            s = self.project.createSegmentForTimePeriod(u'S%d' % k, parent.id,
+                                                        ptimes[a], ptimes[b])
+            if depth > 1:
+                self.addSegments(s, depth-1)
+
+    def levelSegments(self):
+        segtree = self.project.segmenttree
+        bylevel = dict()
+        for s in allSegments(segtree):
+            bylevel.setdefault(s.level, []).append(s)
+        return bylevel
+
+    def ids(self, segs):
+        return sorted(s.id for s in segs)
+
+    def checkQueries(self):
+        segtree = self.project.segmenttree
+        bylevel = self.levelSegments()
+        self.assertEqual(segtree.getLevelCount(), max(bylevel.keys()))
+        tmin, tmax = self.times[0]-1.0, self.times[-1]+1.0
+        query_times = np.concatenate([self.rng.uniform(tmin, tmax, 100),
+                                      [s.starttime for s in segtree.children],
+                                      [s.endtime for s in segtree.children]])
+        for level, segs in bylevel.items():
+            lsegs = segtree.getLevelSegments(level)
+            self.assertEqual(self.ids(lsegs), self.ids(segs))
+            self.assertEqual([s.starttime for s in lsegs],
+                             sorted(s.starttime for s in segs))
+
+            for t in query_times:
+                found = segtree.getSegmentsAtTime(t, level)
+                self.assertEqual(self.ids(found),
+                                 self.ids(s for s in segs
+                                          if s.starttime <= t <= s.endtime))
+                t2 = t + self.rng.uniform(0, 5.0)
+                found = segtree.getSegmentsInTimePeriod(t, t2, level)
+                self.assertEqual(self.ids(found),
+                                 self.ids(s for s in segs
+                                          if s.starttime <= t2 and
+                                          s.endtime >= t))
+
+            seg_ixs = segtree.getLevelSegmentIndexesAtTimes(query_times,
+                                                            level)
+            for t, six in zip(query_times, seg_ixs):
+                first = [i for i, s in enumerate(lsegs)
+                         if s.starttime <= t <= s.endtime][:1] or [-1]
+                self.assertEqual(six, first[0])
+
+        for t in query_times[:20]:
+            found = segtree.getSegmentsAtTime(t)
+            self.assertEqual(self.ids(found),
+                             self.ids(s for segs in bylevel.values()
+                                      for s in segs
+                                      if s.starttime <= t <= s.endtime))
+        for ix in self.rng.randint(0, len(self.times), 20):
+            t = self.times[ix]
+            self.assertEqual(self.ids(segtree.getSegmentsAtSampleIndex(ix)),
+                             self.ids(segtree.getSegmentsAtTime(t)))
+
+    def test_queries(self):
+        self.checkQueries()
+
+    def test_queries_after_remove(self):
+        segtree = self.project.segmenttree
+        for s in allSegments(segtree)[::3]:
+            # Skip segments that were removed with a parent segment.
+            if s.id in [t.id for t in allSegments(segtree)]:
+                s.parent.removeChild(s)
+        self.checkQueries()
+        self.addSegments(self.project.segmenttree, 2, 10)
+        self.checkQueries()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests of sigproc.series_pool.map_series() with worker processes.
+
+Run the test from the src/markwrite folder with:
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from markwrite.sigproc.series_pool import map_series, get_worker_count
+
+def seriesSum(series):
+    return series['x'].sum()
+
+def doubleSeries(series):
+    series['x'] *= 2
+    return len(series)
+
+def failSeries(series):
+    if series['x'][0] == 0:
+        raise ValueError("first series")
+    return len(series)
+
+def seriesPid(series):
+    return os.getpid()
+
+def exitSeries(series):
+    os._exit(3)
+
+class SeriesPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pendata = np.zeros(10000, dtype=[('x', np.float64),
+                                              ('y', np.float64)])
+        self.pendata['x'] = np.arange(10000)
+        self.index_ranges = [(i, min(i+700, 10000))
+                             for i in range(0, 10000, 700)]
+
+    def workers(self):
+        if get_worker_count(4) == 1:
+            self.skipTest("Worker processes can not be used here.")
+        return 4
+
+    def test_results_in_order(self):
+        expected = [self.pendata[a:b]['x'].sum() for a, b in self.index_ranges]
+        results = map_series(seriesSum, self.pendata, self.index_ranges,
+                             self.workers(), min_worker_sample_count=1000)
+        self.assertEqual(results, expected)
+
+    def test_modifies_pendata(self):
+        expected = self.pendata['x']*2
+        results = map_series(doubleSeries, self.pendata, self.index_ranges,
+                             self.workers(), modifies_pendata=True,
+                             min_worker_sample_count=1000)
+        self.assertEqual(results, [b-a for a, b in self.index_ranges])
+        self.assertTrue(np.array_equal(self.pendata['x'], expected))
+
+    def test_min_worker_sample_count(self):
+        # Too few samples for more than one worker, so the series are
+        # processed in this process.
+        pids = map_series(seriesPid, self.pendata, self.index_ranges,
+                          self.workers(), min_worker_sample_count=10001)
+        self.assertEqual(set(pids), set([os.getpid()]))
+        pids = map_series(seriesPid, self.pendata, self.index_ranges,
+                          self.workers(), min_worker_sample_count=1000)
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_worker_error(self):
+        with self.assertRaises(RuntimeError) as cm:
+            map_series(failSeries, self.pendata, self.index_ranges,
+                       self.workers(), min_worker_sample_count=1000)
+        self.assertIn("first series", str(cm.exception))
+
+    def test_worker_exit(self):
+        with self.assertRaises(RuntimeError):
+            map_series(exitSeries, self.pendata, self.index_ranges,
+                       self.workers(), min_worker_sample_count=1000)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the open-source MarkWrite application.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Regression test of the velocity & curvature stroke parser.
+
+vc_parse_series() is run over each Series or pressed Run of the pen data
+files in distribution/MarkWrite/test_data, with
+stroke_detect_pressed_runs_only both True and False. The stroke boundaries
+found are compared with the ones saved in
+data/vc_parser_stroke_boundaries.npz. HDF5 files are not used, since
+reading them needs PyTables.
+
+Test data file names are handled as byte strings, so the test does not
+depend on the locale. Files with a name that can not be encoded with the
+file system encoding (e.g. non ASCII names in a C or POSIX locale) are
+copied to a temporary file with an ASCII name before they are opened.
+
+Run the test from the src/markwrite folder with:
+
+    python -m unittest discover -s tests
+
+After a change that is meant to change the stroke parser results, save the
+new expected stroke boundaries with:
+
+    python tests/test_vc_parser.py --update
+"""
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+import cStringIO
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from markwrite.settings import SETTINGS
+from markwrite.project import MarkWriteProject
+from markwrite.sigproc import vc_parse_series
+
+TEST_DATA_DIR = os.path.join(TESTS_DIR, '..', '..', '..', 'distribution',
+                             'MarkWrite', 'test_data')
+EXPECTED_FILE_PATH = os.path.join(TESTS_DIR, 'data',
+                                  'vc_parser_stroke_boundaries.npz')
+PRESSED_RUNS_ONLY_MODES = (True, False)
+
+# Stroke boundaries of all the Series or Runs of a pen data file, with
+# sample indices into the project pendata array.
+stroke_dtype = np.dtype([('parent_id', np.uint16),
+                         ('start_ix', np.uint32),
+                         ('end_ix', np.uint32),
+                         ('stroke_type', np.uint8)])
+
+def getTestDataFiles():
+    '''
+    Return the paths of the test data files, relative to TEST_DATA_DIR, as
+    byte strings.
+    '''
+    files = []
+    for pattern in ('TXYP/*.txyp', 'EPTXYP/*', 'XML/*.xml', 'XML/*/*.xml'):
+        files.extend(sorted(glob.glob(os.path.join(TEST_DATA_DIR, pattern))))
+    return [os.path.relpath(f, TEST_DATA_DIR) for f in files]
+
+def unicodePath(path):
+    # The test data file names are utf-8 encoded in the repository, but are
+    # in the file system encoding where that can hold them.
+    try:
+        return path.decode(sys.getfilesystemencoding() or 'ascii')
+    except UnicodeError:
+        return path.decode('utf-8')
+
+def expectedKey(rel_path, pressed_runs_only):
+    # npz keys are ascii str.
+    rel_path = unicodePath(rel_path).replace(unicode(os.sep), u'/')
+    return '%s|%s' % (rel_path.encode('unicode_escape'), pressed_runs_only)
+
+def projectFilePath(rel_path, tmp_dir):
+    '''
+    Return a unicode path that MarkWriteProject can open the test data file
+    rel_path with. Python 2 encodes unicode file paths with the file system
+    encoding; a file with a name that can not be encoded is copied to
+    tmp_dir first.
+    '''
+    file_path = os.path.join(TEST_DATA_DIR, rel_path)
+    try:
+        return file_path.decode(sys.getfilesystemencoding() or 'ascii')
+    except UnicodeError:
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(rel_path)[1],
+                                        dir=tmp_dir)
+        os.close(fd)
+        shutil.copyfile(file_path, tmp_path)
+        return tmp_path.decode('ascii')
+
+def parseTestDataFile(rel_path, pressed_runs_only):
+    '''
+    Return the stroke boundaries that vc_parse_series() finds in the pen
+    data file rel_path, as an ndarray with stroke_dtype.
+    '''
+    SETTINGS['stroke_detect_pressed_runs_only'] = pressed_runs_only
+    stdout = sys.stdout
+    sys.stdout = cStringIO.StringIO()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        project = MarkWriteProject(file_path=projectFilePath(rel_path,
+                                                             tmp_dir))
+        strokes = []
+        for si, ei, parent_id in project._getStrokeSearchBounds():
+            series = project.pendata[si:ei + 1]
+            if len(series) < SETTINGS['stroke_detect_min_p2p_sample_count']:
+                continue
+            stroke_bounds, series_dat = vc_parse_series(series)
+            if stroke_bounds is None:
+                continue
+            for stroke in stroke_bounds:
+                strokes.append((parent_id, si + stroke['start_ix'],
+                                si + stroke['end_ix'] - 1, stroke['type']))
+        project.close()
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return np.asarray(strokes, dtype=stroke_dtype)
+
+class VcParserTest(unittest.TestCase):
+    def setUp(self):
+        self._settings = dict(SETTINGS)
+        # Do not use, or add to, the pen data cache of the user.
+        SETTINGS['pendata_cache_max_mb'] = 0
+
+    def tearDown(self):
+        SETTINGS.update(self._settings)
+
+    def test_stroke_boundaries(self):
+        expected = np.load(EXPECTED_FILE_PATH)
+        keys = []
+        for rel_path in getTestDataFiles():
+            for pressed_runs_only in PRESSED_RUNS_ONLY_MODES:
+                key = expectedKey(rel_path, pressed_runs_only)
+                keys.append(key)
+                self.assertIn(key, expected.files)
+                strokes = parseTestDataFile(rel_path, pressed_runs_only)
+                self.assertTrue(np.array_equal(strokes, expected[key]),
+                                "Stroke boundaries of %s changed." % (key))
+        self.assertEqual(sorted(keys), sorted(expected.files))
+
+def updateExpected():
+    '''
+    Save the stroke boundaries that are currently found in the test data
+    files as the expected test results.
+    '''
+    SETTINGS['pendata_cache_max_mb'] = 0
+    expected = dict()
+    for rel_path in getTestDataFiles():
+        for pressed_runs_only in PRESSED_RUNS_ONLY_MODES:
+            strokes = parseTestDataFile(rel_path, pressed_runs_only)
+            expected[expectedKey(rel_path, pressed_runs_only)] = strokes
+            print rel_path, pressed_runs_only, len(strokes)
+    if not os.path.exists(os.path.dirname(EXPECTED_FILE_PATH)):
+        os.makedirs(os.path.dirname(EXPECTED_FILE_PATH))
+    np.savez_compressed(EXPECTED_FILE_PATH, **expected)
+
+if __name__ == '__main__':
+    if '--update' in sys.argv:
+        updateExpected()
+    else:
+        unittest.main()